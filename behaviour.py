@@ -17,10 +17,53 @@ Created by Niall Murphy on 2007-07-25.
 import constants
 import datetime
 import IPy
+import ledger
 import math
-import random
+import re
 import timeline
 
+# Spec to (class, args), so that each spec is parsed once however many
+# holders are given it.
+_SPECS = dict()
+# Spec to the instance every holder given it shares; see Shared().
+_SHARED = dict()
+
+def _ParseSpec(spec):
+  """(class, args) for a spec; args is None if the spec has none."""
+  parsed = _SPECS.get(spec)
+  if parsed is None:
+    q = re.match('(\S+)\((\S+)\)$', spec)
+    if q != None:
+      parsed = (globals()[q.group(1)], q.group(2))
+    else:
+      parsed = (globals()[spec], None)
+    _SPECS[spec] = parsed
+  return parsed
+
+def FromSpec(spec):
+  """Instantiate a behaviour from a CLI-style spec such as 'LIR_Static'
+  or 'LIR_Static(16)', where the bracketed part is passed as args."""
+  (klass, args) = _ParseSpec(spec)
+  if args is None:
+    return klass()
+  return klass(args)
+
+def Shared(spec):
+  """A behaviour from spec for one of many holders: the same instance
+  for all of them if its class keeps nothing per holder (see
+  Behaviour.shareable), otherwise a fresh one, as FromSpec()."""
+  if not _ParseSpec(spec)[0].shareable:
+    return FromSpec(spec)
+  shared = _SHARED.get(spec)
+  if shared is None:
+    shared = _SHARED[spec] = FromSpec(spec)
+  return shared
+
+def WindowStart(supplied_date, days):
+  """The first YYYYMMDD date fewer than days days before supplied_date,
+  i.e. the first date DayDelta(supplied_date, date) < days holds for."""
+  return ledger.OrdinalDate(ledger.DayOrdinal(supplied_date) - days + 1)
+
 
 class Behaviour(object):
   """Change request behaviour for address holders and suppliers.
@@ -30,6 +73,10 @@ class Behaviour(object):
   when addresses will be asked for, how much will be given out in response
   to a startup request, and controlling other simulation parameters."""
 
+  # True if nothing but args is read back between calls, so that one
+  # instance can serve any number of holders; see Shared().
+  shareable = False
+
   def __init__(self, args=None, debug=0):
     self.last_called = None # Date this obj last called
     self.cached_results = None # Place to store results in
@@ -47,9 +94,11 @@ class Behaviour(object):
     the constants file tells us."""
     return constants.defines._LIR_DEFAULT_POLICY
 
-  def Failed(self, cur_date, timeline, callback):
+  def Failed(self, cur_date, timeline, callback, key=None):
     """What I do if I asked for a block and got None. Default
-    action is to try again 'soon'."""
+    action is to try again 'soon'. key is the timeline key the caller
+    uses for its own callbacks, so that a retry replaces rather than
+    duplicates them."""
     #timeline.RegisterCallbackAtDate(timeline.CalculatePeriodLater(cur_date),
     #                                   callback)
     # TODO(niallm): revive this
@@ -82,26 +131,41 @@ class Scaling(Behaviour):
       print "(ITEMS) SPANS RETURNED: ", array
     return array
 
-  def SumPrefixesSpanCutoff(self, items, supplied_date, cutoff_point):
-    """Count the total number of registrations, and the total size of all
-    prefixes associated with that registration.
-    
+  def SpanBetween(self, items, first_date = None, last_date = None):
+    """How much did we register from first_date to last_date inclusive
+    (YYYYMMDD; None for no bound)? Holders hand us their history with
+    prefix sums attached, which makes this two binary searches; a plain
+    dict of date to prefixes, or list of (date, prefixes), is scanned.
+
     Returns: (number of prefixes, number of addresses)"""
+    if hasattr(items, 'SpanBetween'):
+      return items.SpanBetween(first_date, last_date)
+    if hasattr(items, 'items'):
+      items = items.items()
     total_pspan = 0
     total_regs = 0
-    plen = 0
-    for reg_date in items.keys():
-      if timeline.DayDelta(supplied_date, reg_date) < cutoff_point: # Filter FIXME
-        for prefix in items[reg_date]:
-          pspan = IPy.IP(prefix).len()
-          total_pspan += pspan
+    for (reg_date, prefixes) in items:
+      if ((first_date == None or reg_date >= first_date) and
+          (last_date == None or reg_date <= last_date)):
+        for prefix in prefixes:
+          total_pspan += IPy.IP(prefix).len()
           total_regs += 1
     return (total_regs, total_pspan)
+
+  def SumPrefixesSpanCutoff(self, items, supplied_date, cutoff_point):
+    """Count the total number of registrations, and the total size of all
+    prefixes associated with that registration, for registrations fewer
+    than cutoff_point days before supplied_date (or after it).
+    
+    Returns: (number of prefixes, number of addresses)"""
+    return self.SpanBetween(items, WindowStart(supplied_date, cutoff_point))
     
 
 class IANA_Standard(Behaviour):
   """Whatever things IANA needs to decide in a variable fashion
   are controlled here."""
+  shareable = True
+
   def CostOfBusiness(self, size=constants.defines._UNSIZED_DEFAULT_REQUEST):
     """ A function determining how attractive this address supplier is
     currently. (The basis of market simulation.) Almost by definition, either
@@ -119,6 +183,8 @@ class IANA_Standard(Behaviour):
 
 class RIR_Standard(Behaviour):
   """This defines how an RIR will behave as standard."""
+  shareable = True
+
   def CostOfBusiness(self, size=constants.defines._UNSIZED_DEFAULT_REQUEST):
     """A function determining how attractive this address supplier is
     for this particular request. Basis of (as yet unimplemented) market 
@@ -169,16 +235,18 @@ class RIR_Standard(Behaviour):
     # FIXME: properly implement this
     return ([0], timeline.CalculatePeriodLater(cur_date))
 
-  def Failed(self, cur_date, timeline, callback):
+  def Failed(self, cur_date, supplied_timeline, callback, key=None):
     """What I do if I asked for a block and got None. RIRs always
-    re-register."""
-    timeline.RegisterCallbackAtDate(timeline.CalculatePeriodLater(cur_date),
-                                    callback)
+    re-register; the handle is returned so the retry can be withdrawn."""
+    return supplied_timeline.RegisterCallbackAtDate(
+      timeline.CalculatePeriodLater(cur_date), callback, key)
 
 class LIR_Static(Scaling):
   """Whenever we're asked, we request a block of the same size;
   primarily used for testing. If a size is not specified, we use
   constants.defines._DEFAULT_LIR_STATIC_SCALING_SIZE."""
+  shareable = True
+
   def CalculateReqs(self, items, supplied_date):
     if self.args == None:
       return ([2 ** (32 - constants.defines._DEFAULT_LIR_STATIC_SCALING_SIZE)],
@@ -260,18 +328,8 @@ class LIR_Monthly_Exp(Scaling):
                                 constants.defines._DEFAULT_LIR_REQUEST_MULTIPLIER)
       return ([self.cached_results], month_later)
     else:
-      items.sort(reverse=True)
-      len_bucket = []
-      total_regs = 0
-      total_plen = 0
-      for collection in items:
-        reg_date = collection[0]
-        if timeline.DayDelta(supplied_date, reg_date) < 30:
-          total_plen = 0
-          for prefixes in collection[1]:
-            plen = IPy.IP(prefixes).len()
-            total_plen += plen
-            total_regs += 1
+      (total_regs, total_plen) = \
+        self.SpanBetween(items, WindowStart(supplied_date, 30))
       self.cached_results = total_plen
       return ([self.cached_results], month_later)
 
@@ -375,17 +433,15 @@ class LIR_Probability(Scaling):
     len_bucket = []
     date_bucket = []
     total_regs = 0
+    first_date = WindowStart(supplied_date, constants.defines._LOOKBACK_PERIOD)
     for collection in items:
       reg_date = collection[0]
-      if (timeline.DayDelta(supplied_date, reg_date) < 
-          constants.defines._LOOKBACK_PERIOD):
-        date_bucket.append(reg_date)
-        total_plen = 0
-        for prefixes in collection[1]:
-          plen = IPy.IP(prefixes).len()
-          total_plen += plen
-          total_regs += 1
-        len_bucket.append(int((32 - (math.log(int(total_plen), 2)))))
+      if reg_date < first_date:
+        break  # Newest first, so everything from here on is too old.
+      date_bucket.append(reg_date)
+      (regs, total_plen) = self.SpanBetween(items, reg_date, reg_date)
+      total_regs += regs
+      len_bucket.append(int((32 - (math.log(int(total_plen), 2)))))
     if self.debug >= 2:
       print "behave.scaling.lir_prob: total registrations [%s]" % total_regs
       print "behave.scaling.lir_prob: bucket [%s]" % len_bucket
@@ -394,7 +450,7 @@ class LIR_Probability(Scaling):
     if len(len_bucket) == 0:
       return ([0], timeline.CalculatePeriodLater(supplied_date))
     # Now pick a size from the bucket.
-    size = random.choice(len_bucket)
+    size = timeline.CurrentStream().choice(len_bucket)
     # But when should we register it?
     # We'll use the average gap.
     date_bucket.sort()
@@ -418,20 +474,23 @@ class LIR_Histogram(Scaling):
       collections = 0
       total_reqs = 0
       previous_date = supplied_date
+      first_date = WindowStart(supplied_date,
+                               constants.defines._LOOKBACK_PERIOD)
       for collection in items:
         reg_date = collection[0]
         collections += 1
-        if (timeline.DayDelta(supplied_date, reg_date) < 
-            constants.defines._LOOKBACK_PERIOD):
-          date_bucket.append(timeline.DayDelta(reg_date, previous_date))
-          grouping = 0
-          for prefixes in collection[1]:
-            plen = IPy.IP(prefixes).len()
-            #len_bucket[plen] = len_bucket.get(plen, 0) + 1
-            len_bucket.append(plen)
-            grouping += 1
-            total_reqs += 1
-          grouping_bucket.append(grouping)
+        if reg_date < first_date:
+          break  # Newest first, so everything from here on is too old.
+        date_bucket.append(timeline.DayDelta(reg_date, previous_date))
+        grouping = 0
+        for prefixes in collection[1]:
+          (network, length) = ledger.ParsePrefix(prefixes)
+          plen = 2 ** (32 - length)
+          #len_bucket[plen] = len_bucket.get(plen, 0) + 1
+          len_bucket.append(plen)
+          grouping += 1
+          total_reqs += 1
+        grouping_bucket.append(grouping)
         previous_date = reg_date
       if len(date_bucket) == 0:
         average_gap = 30  # Keep them in the game
@@ -445,10 +504,11 @@ class LIR_Histogram(Scaling):
     if len(self.cached_results['lengths']) == 0:
       plengths = [0]
     else:
-      number = random.choice(self.cached_results['grouping'])
+      stream = timeline.CurrentStream()
+      number = stream.choice(self.cached_results['grouping'])
       for x in range(1, number):
         # Now select a prefix length
-        plengths.append(random.choice(self.cached_results['lengths']))
+        plengths.append(stream.choice(self.cached_results['lengths']))
     #print "AVGDAYGAP", self.cached_results['avg_day_gap']
     next_date = timeline.CalculatePeriodLater(supplied_date, 
                                               self.cached_results['avg_day_gap'])
@@ -456,6 +516,8 @@ class LIR_Histogram(Scaling):
 
 class RIR_Static(Behaviour):
   """This defines how an RIR will behave as standard."""
+  shareable = True
+
   def CostOfBusiness(self, size=constants.defines._UNSIZED_DEFAULT_REQUEST):
     """A function determining how attractive this address supplier is
     for this particular request. Basis of market simulation."""
@@ -471,8 +533,8 @@ class RIR_Static(Behaviour):
     return ([constants.defines._RIR_DEFAULT_REQUEST],
             timeline.CalculatePeriodLater(cur_date))
 
-  def Failed(self, cur_date, timeline, callback):
+  def Failed(self, cur_date, supplied_timeline, callback, key=None):
     """What I do if I asked for a block and got None. RIRs always
-    re-register."""
-    timeline.RegisterCallbackAtDate(timeline.CalculatePeriodLater(cur_date),
-                                    callback)
+    re-register; the handle is returned so the retry can be withdrawn."""
+    return supplied_timeline.RegisterCallbackAtDate(
+      timeline.CalculatePeriodLater(cur_date), callback, key)
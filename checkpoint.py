@@ -0,0 +1,446 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+checkpoint.py - sectioned checkpoint files.
+
+A checkpoint holds the state of a simulation in separately loadable
+sections, one per holder plus a few for the rest of the world:
+
+  world           names and counts of the RIRs and LIRs
+  applied         the delegated lines the world was built from
+  iana            the IANA
+  rir:<name>      one per RIR
+  lir:<name>      one per LIR
+  population      the organisations whose LIRs haven't been made yet,
+                  in a world read one LIR per organisation (see
+                  population.py)
+  timeline        the timeline, with its pending callbacks
+  result          the RunResult of a run in progress, if any
+  random          the state of the random number generators (only in
+                  checkpoints taken during a run, so a resumed run draws
+                  the same numbers it would have)
+
+The file starts with a header (magic, container version and the offset of
+the index), followed by the sections, each a cPickle optionally
+compressed with zlib or lzma, followed by the index, which maps each
+section name to its offset, length, format version and compression.
+
+References from one section to an object in another (an LIR's
+address_supplier, a callback bound to an RIR, the simulation's shared
+event processor) are written as persistent ids rather than copied, and
+resolved when loading by loading just the section referred to. So
+loading a single RIR reads the header, the index, that RIR and the IANA
+that supplies it, and nothing else.
+
+Each kind of section carries its own format version. A reader refuses
+sections newer than it understands instead of failing somewhere inside
+cPickle.
+
+Periodic writes such a checkpoint during a run: a full one first, then
+appended sections for just the holders that have done anything since
+the last write, along with the timeline, result and RNG state.
+
+Typical use case:
+  reader = checkpoint.Reader("startup.checkpoint.simlir")
+  print reader.RIR("ripencc").AddressPercentageLeft()
+  reader.Close()
+"""
+
+import constants
+import instrumentation
+import timeline
+
+import cPickle
+import cStringIO
+import os
+import random
+import struct
+import time
+import types
+import zlib
+
+try:
+  import lzma
+except ImportError:
+  try:
+    from backports import lzma
+  except ImportError:
+    lzma = None
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+_MAGIC = "SIMLIRCK"
+_HEADER = ">HQ"  # Container version, index offset
+_CONTAINER_VERSION = 1
+# Format version of each kind of section; bump when its contents change.
+_SECTION_VERSIONS = {'world': 1,
+                     'applied': 1,
+                     'iana': 6,
+                     'rir': 8,
+                     'lir': 6,
+                     'population': 2,
+                     'timeline': 3,
+                     'result': 2,
+                     'random': 1}
+
+def Upgrade(kind, version, obj):
+  """Bring obj, loaded from a version version section of kind kind (0 for
+  an old single-pickle checkpoint), up to the current format."""
+  if kind == 'rir' and version < 2:
+    obj.capacity = dict()  # Capacity index, see lir.address_supplier.Request
+  if (kind in ('iana', 'lir') and version < 5) or \
+     (kind == 'rir' and version < 7):
+    obj._CountFree()  # See lir.address_holder.CanSatisfy
+  if kind == 'rir' and version < 4:
+    obj.request_queue = []  # See lir.address_supplier.QueueRequest
+  if (kind in ('iana', 'lir') and version < 6) or \
+     (kind == 'rir' and version < 8):
+    obj.stream = None  # Draws from random; see simulation.SeedStreams
+  # Holders from before ledgers (iana and lir < 3, rir < 5) have theirs
+  # made by lir.address_holder.__setstate__; from before slots (iana and
+  # lir < 4, rir < 6), they were made by calling their class, so have an
+  # id of None until the simulation enrols them.
+  if kind == 'timeline' and version < 2:
+    obj.partial = None  # Not part way through a node, see Timeline.WalkAlong
+  if kind == 'timeline' and version < 3:
+    obj.rank = None  # Dates are walked in insertion order
+  if kind == 'population' and version < 2:
+    # Wakes were for every RIR at once; see population.Population.Wake
+    obj.due = dict([((None, day), numbers)
+                    for (day, numbers) in obj.due.items()])
+    obj.seed = None
+  if kind == 'result' and version < 2:
+    obj.stats = None  # Seeded afresh by simulation.timelined.Run
+  return obj
+
+def _Compressor(compression):
+  """(compress, decompress) functions for a compression name."""
+  if compression == "none":
+    return (str, str)
+  elif compression == "zlib":
+    return (zlib.compress, zlib.decompress)
+  elif compression == "lzma":
+    if lzma is None:
+      raise ValueError, "lzma compression needs the lzma module"
+    return (lzma.compress, lzma.decompress)
+  raise ValueError, "Unknown checkpoint compression %s" % compression
+
+def _Kind(name):
+  return name.split(':', 1)[0]
+
+def IsSectioned(filename):
+  """Is filename a sectioned checkpoint, rather than an old single pickle?"""
+  f = open(filename, 'rb')
+  try:
+    return f.read(len(_MAGIC)) == _MAGIC
+  finally:
+    f.close()
+
+class Writer(object):
+  """Writes sections to a checkpoint file, then the index on Close.
+
+  In append mode, sections are added after the end of an existing file
+  and supersede any of the same name; the old ones become dead space.
+  The header only moves to the new index once that is safely on disk,
+  so a crash part way through leaves the previous checkpoint intact."""
+  def __init__(self, filename,
+               compression = constants.defines._CHECKPOINT_COMPRESSION,
+               append = False):
+    (self.compress, decompress) = _Compressor(compression)
+    self.compression = compression
+    if append:
+      reader = Reader(filename)
+      self.index = reader.index
+      reader.Close()
+      self.file = open(filename, 'r+b')
+      self.file.seek(0, 2)
+    else:
+      self.file = open(filename, 'wb')
+      self.file.write(_MAGIC + struct.pack(_HEADER, _CONTAINER_VERSION, 0))
+      self.index = dict()
+    self.external = dict()  # id(object) -> persistent id
+    self.root = None
+
+  def Share(self, obj, pid):
+    """Write references to obj, outside whatever section it is the root
+    of, as pid."""
+    self.external[id(obj)] = pid
+
+  def _PersistentId(self, obj):
+    if obj is self.root:
+      return None
+    pid = self.external.get(id(obj))
+    if pid is not None:
+      return pid
+    # Bound methods can't be pickled; those of shared objects (e.g. the
+    # holders' ActivityCallbacks) are referred to by name.
+    if isinstance(obj, types.MethodType) and obj.im_self is not None:
+      pid = self.external.get(id(obj.im_self))
+      if pid is not None:
+        return ('method', pid, obj.im_func.__name__)
+    return None
+
+  def Write(self, name, obj):
+    """Add obj as section name."""
+    output = cStringIO.StringIO()
+    pickler = cPickle.Pickler(output, -1)
+    pickler.persistent_id = self._PersistentId
+    self.root = obj
+    try:
+      pickler.dump(obj)
+    finally:
+      self.root = None
+    data = self.compress(output.getvalue())
+    self.index[name] = (self.file.tell(), len(data),
+                        _SECTION_VERSIONS[_Kind(name)], self.compression)
+    self.file.write(data)
+
+  def Close(self):
+    """Write the index and point the header at it."""
+    offset = self.file.tell()
+    cPickle.dump(self.index, self.file, -1)
+    self.file.flush()
+    os.fsync(self.file.fileno())
+    self.file.seek(len(_MAGIC))
+    self.file.write(struct.pack(_HEADER, _CONTAINER_VERSION, offset))
+    self.file.close()
+
+  def LiveSize(self):
+    """Bytes taken up by the sections the index refers to."""
+    return sum([entry[1] for entry in self.index.values()])
+
+class Reader(object):
+  """Loads sections of a checkpoint file on demand. Each section is
+  loaded at most once, so objects shared between sections stay shared."""
+  def __init__(self, filename, instrument = None):
+    """Read the header and index of filename. References to the shared
+    event processor are resolved to instrument, or a new one."""
+    self.file = open(filename, 'rb')
+    header = self.file.read(len(_MAGIC) + struct.calcsize(_HEADER))
+    if header[:len(_MAGIC)] != _MAGIC:
+      self.file.close()
+      raise ValueError, "%s is not a sectioned checkpoint" % filename
+    (version, offset) = struct.unpack(_HEADER, header[len(_MAGIC):])
+    if version > _CONTAINER_VERSION:
+      self.file.close()
+      raise ValueError, "%s is a version %s checkpoint; we read up to %s" % \
+        (filename, version, _CONTAINER_VERSION)
+    self.file.seek(offset)
+    self.index = cPickle.load(self.file)
+    self.filename = filename
+    if instrument is None:
+      instrument = instrumentation.event_processor()
+    self.loaded = {'instrument': instrument}
+    self.loading = dict()
+
+  def Names(self):
+    """Sorted names of the sections in the file."""
+    return sorted(self.index.keys())
+
+  def _PersistentLoad(self, pid):
+    if isinstance(pid, tuple) and pid[0] == 'method':
+      return getattr(self.Section(pid[1]), pid[2])
+    return self.Section(pid)
+
+  def Section(self, name):
+    """Load (or return the already loaded) section name.
+
+    Raises:
+      KeyError if there is no such section, and ValueError if it is of a
+      newer format than we understand."""
+    if name in self.loaded:
+      return self.loaded[name]
+    (offset, length, version, compression) = self.index[name]
+    if version > _SECTION_VERSIONS[_Kind(name)]:
+      raise ValueError, "Section %s of %s is version %s; we read up to %s" % \
+        (name, self.filename, version, _SECTION_VERSIONS[_Kind(name)])
+    if name in self.loading:
+      raise ValueError, "Section %s of %s refers back to itself" % \
+        (name, self.filename)
+    self.loading[name] = True
+    try:
+      self.file.seek(offset)
+      data = _Compressor(compression)[1](self.file.read(length))
+      unpickler = cPickle.Unpickler(cStringIO.StringIO(data))
+      unpickler.persistent_load = self._PersistentLoad
+      self.loaded[name] = Upgrade(_Kind(name), version, unpickler.load())
+    finally:
+      del self.loading[name]
+    return self.loaded[name]
+
+  def IANA(self):
+    return self.Section('iana')
+
+  def RIR(self, name):
+    return self.Section('rir:' + name)
+
+  def LIR(self, name):
+    return self.Section('lir:' + name)
+
+  def Close(self):
+    self.file.close()
+
+def _ShareWorld(writer, sim):
+  if sim.instrument is not None:
+    writer.Share(sim.instrument, 'instrument')
+  writer.Share(sim.iana, 'iana')
+  for (name, props) in sim.rirs.items():
+    writer.Share(props['obj'], 'rir:' + name)
+  for (name, props) in sim.lirs.items():
+    writer.Share(props['obj'], 'lir:' + name)
+  if sim.population != None:
+    writer.Share(sim.population, 'population')
+  writer.Share(sim.timeline, 'timeline')
+
+def _WriteRunState(writer, sim, rng):
+  """The sections every write has: names and counts, population (which
+  LIRs are made from as a run goes on), timeline, result, and if rng,
+  the RNG state."""
+  world = {'rirs': dict([(name, props['count'])
+                         for (name, props) in sim.rirs.items()]),
+           'lirs': dict([(name, props['count'])
+                         for (name, props) in sim.lirs.items()])}
+  writer.Write('world', world)
+  if sim.population != None:
+    writer.Write('population', sim.population)
+  writer.Write('timeline', sim.timeline)
+  writer.Write('result', sim.result)
+  if rng:
+    numpy_state = None
+    if numpy is not None:
+      numpy_state = numpy.random.get_state()
+    writer.Write('random', (random.getstate(), numpy_state))
+
+def Save(sim, filename,
+         compression = constants.defines._CHECKPOINT_COMPRESSION,
+         rng = False):
+  """Write the state of sim out as a sectioned checkpoint; if rng, with
+  the state of the random number generators too."""
+  writer = Writer(filename, compression)
+  _ShareWorld(writer, sim)
+  try:
+    _WriteRunState(writer, sim, rng)
+    writer.Write('applied', sim.applied)
+    writer.Write('iana', sim.iana)
+    for name in sorted(sim.rirs.keys()):
+      writer.Write('rir:' + name, sim.rirs[name]['obj'])
+    for name in sorted(sim.lirs.keys()):
+      writer.Write('lir:' + name, sim.lirs[name]['obj'])
+  except:
+    writer.file.close()  # Without an index, nobody will mistake it for one.
+    raise
+  writer.Close()
+
+def Append(sim, filename, holders,
+           compression = constants.defines._CHECKPOINT_COMPRESSION):
+  """Bring a checkpoint of sim written by Save(rng = True) up to date,
+  writing only the given holders, any holder the file doesn't have yet,
+  the IANA, the RIRs and the run state.
+
+  Returns:
+    the number of bytes of the file still in use."""
+  writer = Writer(filename, compression, append = True)
+  _ShareWorld(writer, sim)
+  try:
+    _WriteRunState(writer, sim, True)
+    # Every callback moves the IANA and RIR clocks on, and there are few
+    # of them; always write them.
+    writer.Write('iana', sim.iana)
+    for name in sorted(sim.rirs.keys()):
+      writer.Write('rir:' + name, sim.rirs[name]['obj'])
+    for name in sorted(sim.lirs.keys()):
+      lir = sim.lirs[name]['obj']
+      if id(lir) in holders or 'lir:' + name not in writer.index:
+        writer.Write('lir:' + name, lir)
+  except:
+    writer.file.close()
+    raise
+  writer.Close()
+  return writer.LiveSize()
+
+def Load(sim, filename):
+  """Replace the state of sim with everything in a sectioned checkpoint."""
+  reader = Reader(filename, sim.instrument)
+  try:
+    world = reader.Section('world')
+    sim.applied = reader.Section('applied')
+    sim.iana = reader.IANA()
+    sim.rirs = dict([(name, {'count': count, 'obj': reader.RIR(name)})
+                     for (name, count) in world['rirs'].items()])
+    sim.lirs = dict([(name, {'count': count, 'obj': reader.LIR(name)})
+                     for (name, count) in world['lirs'].items()])
+    sim.ReindexHolders()
+    sim.population = None
+    if 'population' in reader.index:
+      sim.population = reader.Section('population')
+      sim.population.Attach(sim)
+    sim.timeline = reader.Section('timeline')
+    # Checkpoints from before runs were checkpointed have neither.
+    if 'result' in reader.index:
+      sim.result = reader.Section('result')
+    if 'random' in reader.index:
+      (python_state, numpy_state) = reader.Section('random')
+      random.setstate(python_state)
+      if numpy is not None and numpy_state is not None:
+        numpy.random.set_state(numpy_state)
+  finally:
+    reader.Close()
+
+class Periodic(object):
+  """Checkpoints a run every so many simulated days or wall-clock seconds,
+  whichever comes first. timelined.Run() calls Touch() after every
+  callback and Due()/Write() between dates.
+
+  The first write, and any write once dead space outweighs live, is a
+  full Save; the rest Append only the holders touched since the last."""
+  def __init__(self, filename, days = None, seconds = None,
+               compression = constants.defines._CHECKPOINT_COMPRESSION):
+    self.filename = filename
+    self.days = days
+    self.seconds = seconds
+    self.compression = compression
+    self.touched = dict()  # id(holder) -> holder
+    self.last_date = None
+    self.last_time = time.time()
+    self.full = True
+    self.writes = 0
+
+  def Touch(self, handle):
+    """Note the holders a timeline callback may have changed: its own,
+    and whoever it could have asked for space."""
+    for callback in getattr(handle, 'event', [handle]):
+      holder = getattr(callback, 'im_self', None)
+      while holder is not None and id(holder) not in self.touched:
+        self.touched[id(holder)] = holder
+        holder = getattr(holder, 'address_supplier', None)
+
+  def Due(self, date):
+    """Is a checkpoint due before we process date?"""
+    if self.last_date == None:
+      self.last_date = date
+      return False
+    if self.days != None and \
+          timeline.DayDelta(date, self.last_date) >= self.days:
+      return True
+    if self.seconds != None and time.time() - self.last_time >= self.seconds:
+      return True
+    return False
+
+  def Write(self, sim, date):
+    """Checkpoint sim, which is about to process date."""
+    if self.full:
+      # Never leave a half-written checkpoint behind.
+      Save(sim, self.filename + ".tmp", self.compression, rng = True)
+      os.rename(self.filename + ".tmp", self.filename)
+      self.full = False
+    else:
+      live = Append(sim, self.filename, self.touched, self.compression)
+      self.full = os.path.getsize(self.filename) > 2 * live
+    self.touched = dict()
+    self.last_date = date
+    self.last_time = time.time()
+    self.writes += 1
+
@@ -21,6 +21,7 @@ class defines(object):
   _COST_BUSINESS_LOW = 0 # 'The cost of doing business' as an addr supplier
   _DEFAULT_LIR_STATIC_SCALING_SIZE = 13 # The /NN that we request for LIR_Static
   _RIR_DEFAULT_REQUEST = 2 ** 24 # RIRs want a /8 from IANA by default.
+  _RIR_REQUEST_POLICY = None # Batch LIR requests per date: None, fifo, largest or random
   _DEFAULT_LIR_REQUEST_MULTIPLIER = 1.1 # Multiplier in LIR_Monthly_Exp
   _LOOKBACK = 10 # Number of requests to look back at
   _LOOKBACK_PERIOD = 30 * 18 # Period of time in days to look back at
@@ -60,8 +61,10 @@ class defines(object):
                     'ftp://ftp.ripe.net/pub/stats/ripencc/delegated-ripencc-latest',
                     'ftp://ftp.lacnic.net/pub/stats/lacnic/delegated-lacnic-latest',
                     'http://www.potaroo.net/bgp/stats/iana/delegated-iana-latest',
-                    'http://bgp.potaroo.net/stats/nro/delegated.nro.txt']
+                    'http://bgp.potaroo.net/stats/nro/delegated.nro.txt',
+                    'ftp://ftp.ripe.net/pub/stats/ripencc/nro-stats/latest/nro-delegated-stats']
   _STARTUP_CHECKPOINT_FILE = "startup.checkpoint.simlir"
+  _STARTUP_ORG_CHECKPOINT_FILE = "startup.org.checkpoint.simlir"
   _CHECKPOINT_FILE = "checkpoint.simlir"
   _DEFAULT_NON_ZERO_DATE = "19930101"
   #_DEFAULT_LIR_BEHAVIOUR = "LIR_Simple_Steady_State"
@@ -77,6 +80,13 @@ class defines(object):
   _STARTCBASE = 10
   _STEPWISE = 100000
   _NRO_DATA = "data/delegated.nro.txt"
+  _NRO_EXTENDED_DATA = "data/nro-delegated-stats" # With organisation ids
+  _IANA_DATA = "data/delegated-iana-latest"
+  _SWEEP_CACHE_DIR = _DATA_DIR + "/sweep" # Where sweep.py memoises runs
+  _PARSE_CACHE_DIR = _DATA_DIR + "/cache" # Where ingest.py caches parsed files
+  _CHECKPOINT_COMPRESSION = "zlib" # none, zlib or lzma (backports.lzma on 2.x)
+  _CHECKPOINT_DAYS = 365 # Simulated days between run checkpoints
+  _CHECKPOINT_SECONDS = 600 # Wall-clock seconds between run checkpoints
   # These are used for the unit tests, and currently have to be manually updated.
   _IANA_START_FREE = 16.015625
   _CURRENT_FREE_POOL_COUNT = 42
@@ -95,3 +105,6 @@ class defines(object):
   _EXPECTED_EXHAUSTION_COUNT = 147
   _INSTRUMENTATION_MODES = { 'syslog': 0, 'stdout': 1, 'gui': 2}
   _INSTRUMENTATION_DEFAULT_MODE = _INSTRUMENTATION_MODES['stdout']
+  _TIMELINE_STREAMING = True # Release timeline dates once they are processed
+  _TIMELINE_ARCHIVE = True # Keep per-date event counts for released dates
+  _JITTER_BLOCK_SIZE = 4096 # Jitter values pre-drawn per JitterSource refill
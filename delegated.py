@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+delegated.py - streaming parser for RIR/NRO/IANA delegated files.
+
+Both the IANA file and the NRO aggregate use the delegated format:
+
+  RIR|Country|Type|Prefix|Size|Date|Status
+  iana|ZZ|ipv4|7.0.0.0|16777216|19880223|arin
+  lacnic|MX|ipv4|204.126.140.0|512|19950114|assigned
+
+with a version line and summary lines at the top. Parse() turns lines
+into one tuple per CIDR block:
+
+  (registry, country, status, start, plen, date, first)
+
+where start is the first address as an integer, plen the prefix length,
+date the YYYYMMDD string, and first is 1 for the first block of each line
+and 0 for the rest of that line's decomposition (sizes need not be powers
+of two). The extended format adds the holder's opaque organisation id
+(and, in some files, further fields after it):
+
+  ripencc|FR|ipv4|2.0.0.0|1048576|20100712|allocated|3f4a71a6-...
+
+and parsing with extended set reads only such lines, with the id as an
+eighth element of each tuple. Address arithmetic is done on integers
+throughout; nothing is built per line beyond the split and the tuples
+themselves, and lines that are not IPv4 records are dropped before they
+are split.
+
+Typical use case:
+  for (registry, country, status, start, plen, date, first) in \\
+      delegated.ParseFile("data/delegated.nro.txt", "19930101"):
+    print delegated.PrefixString(start, plen)
+"""
+
+_IPV4 = '|ipv4|'
+_ZERO_DATE = "00000000"
+
+def AddressToInt(address):
+  """'a.b.c.d' to an integer."""
+  (a, b, c, d) = address.split('.')
+  return (int(a) << 24) | (int(b) << 16) | (int(c) << 8) | int(d)
+
+def IntToAddress(value):
+  """An integer to 'a.b.c.d'."""
+  return "%d.%d.%d.%d" % (value >> 24, (value >> 16) & 0xff,
+                          (value >> 8) & 0xff, value & 0xff)
+
+def PrefixString(start, plen):
+  """An integer address and length to 'a.b.c.d/len'."""
+  return "%s/%s" % (IntToAddress(start), plen)
+
+def Decompose(start, amount):
+  """Split amount addresses from start into the fewest CIDR blocks,
+  largest first, as simulation.DecomposeAmountToPrefixes and
+  ProvideSeriesFromPrefixesAndLengths do. Yields (start, plen)."""
+  while amount > 0:
+    power = amount.bit_length() - 1
+    yield (start, 32 - power)
+    start += 1 << power
+    amount -= 1 << power
+
+def Parse(lines, zero_date = None, counts = None, extended = False):
+  """Generate block tuples from an iterable of delegated-format lines.
+
+  Args:
+    lines: any iterable of lines, e.g. an open file.
+    zero_date: if not None, substituted for the unknown date 00000000.
+    counts: optional dict; 'lines' and 'skipped' (comments, headers and
+      non-IPv4 lines) are added to it once the lines run out.
+    extended: if True, read the extended format, yielding
+      (registry, country, status, start, plen, date, first, org).
+  """
+  total = 0
+  skipped = 0
+  for line in lines:
+    total += 1
+    if line[:1] == '#' or _IPV4 not in line:
+      skipped += 1
+      continue
+    elements = line.rstrip().split('|')
+    if extended:
+      if len(elements) < 8:  # Summary lines
+        skipped += 1
+        continue
+    elif len(elements) != 7:  # Summary lines
+      skipped += 1
+      continue
+    (registry, country, kind, address, size, date, status) = elements[:7]
+    if zero_date is not None and date == _ZERO_DATE:
+      date = zero_date
+    first = 1
+    for (start, plen) in Decompose(AddressToInt(address), int(size)):
+      if extended:
+        yield (registry, country, status, start, plen, date, first,
+               elements[7])
+      else:
+        yield (registry, country, status, start, plen, date, first)
+      first = 0
+  if counts is not None:
+    counts['lines'] = counts.get('lines', 0) + total
+    counts['skipped'] = counts.get('skipped', 0) + skipped
+
+def ParseFile(filename, zero_date = None, counts = None, extended = False):
+  """Parse() the named file, closing it once we are done."""
+  f = open(filename, 'rb')
+  try:
+    for record in Parse(f, zero_date, counts, extended):
+      yield record
+  finally:
+    f.close()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+ensemble.py - Monte Carlo ensembles of timelined simulations.
+
+The behaviours and the timeline jitter are stochastic, so one run of
+simulation.py says rather little. This loads the startup world once,
+then runs N replicas of it across a pool of worker processes, each with
+its own seed derived from a master seed, and summarises the spread of
+exhaustion dates for IANA and each RIR.
+
+Workers are forked from the process that loaded the world, so each
+replica starts from an identical copy of it without re-reading any data.
+Given the same master seed and world, the results are the same however
+many processes are used.
+
+Typical use case:
+  ./ensemble.py --replicas 64 --seed 42
+"""
+
+import constants
+import instrumentation
+import simulation
+
+import getopt
+import multiprocessing
+import random
+import sys
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+# The loaded world, inherited by forked workers; see RunEnsemble.
+_WORLD = None
+
+def DeriveSeeds(master_seed, replicas):
+  """Return a list of per-replica seeds derived from the master seed."""
+  generator = random.Random(master_seed)
+  return [generator.randint(0, 2 ** 31 - 1) for i in range(replicas)]
+
+def RunSeeded(sim, seed, until = None):
+  """Seed every RNG the simulation draws from, then run sim to the end.
+
+  A run that tries to schedule something past _YEAR_MAX_END is reported
+  with whatever it had got to, and stopped_by 'horizon'.
+
+  Raises:
+    ValueError, naming the seed, if the run fails before it has a result
+    to report."""
+  random.seed(seed)
+  if numpy is not None:
+    numpy.random.seed(seed)
+  sim.SeedStreams(seed)
+  try:
+    result = sim.Run(until = until)
+  except ValueError, error:
+    result = sim.result
+    if result == None:
+      raise ValueError, ("Run with seed %s failed before starting: %s" %
+                         (seed, error)), sys.exc_info()[2]
+    result.stopped_by = 'horizon'
+  return result
+
+def _RunReplica(args):
+  """Pool worker: run the inherited world to completion under one seed."""
+  (replica, seed, until) = args
+  result = RunSeeded(_WORLD, seed, until)
+  return (replica, seed, result.exhaustion_dates, result.stopped_by)
+
+def RunEnsemble(world, replicas, master_seed, processes = None, until = None):
+  """Run replicas of world across a process pool.
+
+  Args:
+    world: a loaded but not yet started simulation.timelined.
+    replicas: how many runs to do.
+    master_seed: seed from which every replica's seed is derived.
+    processes: pool size; defaults to the number of CPUs.
+    until: optional YYYYMMDD date at which to stop each run.
+
+  Returns:
+    a list of (replica, seed, exhaustion_dates, stopped_by), in replica
+    order."""
+  global _WORLD
+  _WORLD = world
+  seeds = DeriveSeeds(master_seed, replicas)
+  # One task per child, so every replica gets a fresh fork of the world.
+  pool = multiprocessing.Pool(processes = processes, maxtasksperchild = 1)
+  try:
+    results = pool.map(_RunReplica,
+                       [(i, seeds[i], until) for i in range(replicas)],
+                       chunksize = 1)
+  finally:
+    pool.close()
+    pool.join()
+    _WORLD = None
+  results.sort()
+  return results
+
+def Percentile(ordered, fraction):
+  """Nearest-rank percentile of an already sorted, non-empty list."""
+  index = int(round(fraction * (len(ordered) - 1)))
+  return ordered[index]
+
+def Summarise(results):
+  """Aggregate exhaustion dates per entity.
+
+  Returns:
+    a dict mapping entity name to a dict with 'dates' (the sorted
+    exhaustion dates seen), 'exhausted' and 'not_exhausted' counts, and
+    'min', 'p10', 'median', 'p90' and 'max' dates."""
+  names = dict()
+  for (replica, seed, exhaustion_dates, stopped_by) in results:
+    for name in exhaustion_dates:
+      names[name] = True
+  summary = dict()
+  for name in names:
+    dates = [r[2][name] for r in results if name in r[2]]
+    dates.sort()
+    summary[name] = {'dates': dates,
+                     'exhausted': len(dates),
+                     'not_exhausted': len(results) - len(dates),
+                     'min': dates[0],
+                     'p10': Percentile(dates, 0.1),
+                     'median': Percentile(dates, 0.5),
+                     'p90': Percentile(dates, 0.9),
+                     'max': dates[-1]}
+  return summary
+
+def PrintSummary(summary, replicas):
+  """Print a table of the exhaustion date distribution per entity."""
+  print "Exhaustion dates over [%s] replicas:" % replicas
+  print "%-10s %5s %9s %9s %9s %9s %9s" % ("entity", "count", "min", "p10",
+                                           "median", "p90", "max")
+  for name in sorted(summary.keys()):
+    stats = summary[name]
+    print "%-10s %5s %9s %9s %9s %9s %9s" % (name, stats['exhausted'],
+                                             stats['min'], stats['p10'],
+                                             stats['median'], stats['p90'],
+                                             stats['max'])
+
+def Usage():
+  """Instructions for usage."""
+  print "Run a Monte Carlo ensemble of address allocation simulations."
+  print
+  print "--help: this help"
+  print "--replicas: how many runs to do (default 16)"
+  print "--seed: master seed from which each run's seed is derived (default 0)"
+  print "--processes: number of worker processes (default: one per CPU)"
+  print "--until: stop each run at this YYYYMMDD date"
+  print "--checkpoint: generate or use a previously generated checkpoint file"
+  print "--lir_behave: select a particular kind of LIR behaviour from available classes"
+  print "--rir_behave: select a particular kind of RIR behaviour from available classes"
+  print "--debug: set integer debug level"
+
+if __name__ == '__main__':
+  try:
+    opts, args = getopt.getopt(sys.argv[1:], "hn:s:j:u:cl:r:d:", ["help",
+                               "replicas=",
+                               "seed=",
+                               "processes=",
+                               "until=",
+                               "checkpoint",
+                               "lir_behave=",
+                               "rir_behave=",
+                               "debug="])
+  except getopt.GetoptError:
+    Usage()
+    sys.exit(2)
+  replicas = 16
+  master_seed = 0
+  processes = None
+  until = None
+  cp = False
+  cur_debug = 0
+  lir_behave = constants.defines._DEFAULT_LIR_BEHAVIOUR
+  rir_behave = constants.defines._DEFAULT_RIR_BEHAVIOUR
+  for opt, arg in opts:
+    if opt in ("-h", "--help"):
+      Usage()
+      sys.exit()
+    elif opt in ("-n", "--replicas"):
+      replicas = int(arg)
+    elif opt in ("-s", "--seed"):
+      master_seed = int(arg)
+    elif opt in ("-j", "--processes"):
+      processes = int(arg)
+    elif opt in ("-u", "--until"):
+      until = arg
+    elif opt in ("-c", "--checkpoint"):
+      cp = True
+    elif opt in ("-l", "--lir_behave"):
+      lir_behave = arg
+    elif opt in ("-r", "--rir_behave"):
+      rir_behave = arg
+    elif opt in ("-d", "--debug"):
+      cur_debug = int(arg)
+  eventp = instrumentation.event_processor()
+  world = simulation.timelined(supplied_debug = cur_debug,
+                               supplied_inst = eventp)
+  world.LoadStartupWorld(lir_behave, rir_behave, cp, processes)
+  results = RunEnsemble(world, replicas, master_seed, processes, until)
+  PrintSummary(Summarise(results), replicas)
@@ -0,0 +1,455 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+ingest.py - parallel ingestion of delegated files.
+
+simulation.FromIANAProcess and FromRIRProcess read a delegated file one
+line at a time. This splits a file into byte ranges, parses and
+CIDR-decomposes each range in a pool of worker processes into compact
+column arrays, merges the results in file order, and then applies them
+to the simulation's holders in date order.
+
+A parsed file is a Records object: one row per decomposed prefix, held
+as parallel array.array columns, with registry, country and status
+interned in a shared string table.
+
+If NumPy is available, parsed files are also cached under
+_PARSE_CACHE_DIR as one .npy file per column, keyed by a hash of the
+source file. A cached file is loaded memory-mapped, so a warm start does
+no parsing and almost no copying. update_data.py clears the cache when
+it fetches new data.
+
+A startup checkpoint also records which delegated lines went into it
+(see RecordApplied). When fresh files arrive, DeltaIngest diffs them
+against that record with a sorted merge, withdraws the lines that have
+gone or changed and applies the new ones, so the checkpoint can be
+brought up to date without a rebuild.
+
+Typical use case:
+  sim = simulation.timelined()
+  ingest.Ingest(sim, processes = 4)
+"""
+
+import constants
+import delegated
+
+import array
+import hashlib
+import multiprocessing
+import os
+import shutil
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+_COLUMNS = ('registries', 'countries', 'statuses', 'starts', 'plens',
+            'dates', 'firsts')
+
+def _AsSequence(column):
+  if numpy is not None and isinstance(column, numpy.ndarray):
+    return column.tolist()
+  return column
+
+class Records(object):
+  """Columns of decomposed delegated-file records.
+
+  Attributes:
+    strings: the string table that registries, countries and statuses
+      index into.
+    registries, countries, statuses: array('H') of string table indexes.
+    starts: array('I') of first addresses, as integers.
+    plens: array('B') of prefix lengths.
+    dates: array('I') of YYYYMMDD dates, as integers.
+    firsts: array('B'); 1 for the first prefix of each line, 0 for the
+      rest of that line's decomposition.
+  """
+  def __init__(self):
+    self.strings = []
+    self._index = dict()
+    self.registries = array.array('H')
+    self.countries = array.array('H')
+    self.statuses = array.array('H')
+    self.starts = array.array('I')
+    self.plens = array.array('B')
+    self.dates = array.array('I')
+    self.firsts = array.array('B')
+
+  def __len__(self):
+    return len(self.starts)
+
+  def Intern(self, string):
+    """Return the string table index for string, adding it if need be."""
+    index = self._index.get(string)
+    if index is None:
+      index = self._index[string] = len(self.strings)
+      self.strings.append(string)
+    return index
+
+  def Append(self, registry, country, status, start, plen, date, first):
+    self.registries.append(self.Intern(registry))
+    self.countries.append(self.Intern(country))
+    self.statuses.append(self.Intern(status))
+    self.starts.append(start)
+    self.plens.append(plen)
+    self.dates.append(date)
+    self.firsts.append(first)
+
+  def Extend(self, other):
+    """Append all of other's rows, re-interning its strings into ours."""
+    remap = [self.Intern(string) for string in other.strings]
+    self.registries.extend([remap[i] for i in other.registries])
+    self.countries.extend([remap[i] for i in other.countries])
+    self.statuses.extend([remap[i] for i in other.statuses])
+    self.starts.extend(other.starts)
+    self.plens.extend(other.plens)
+    self.dates.extend(other.dates)
+    self.firsts.extend(other.firsts)
+
+  def Rows(self, order = None):
+    """Yield (registry, country, status, start, plen, date, first) tuples,
+    in the supplied order of row numbers or else in stored order."""
+    strings = self.strings
+    # Memory-mapped columns are much cheaper to walk as plain lists.
+    (registries, countries, statuses, starts, plens, dates, firsts) = \
+      [_AsSequence(getattr(self, column)) for column in _COLUMNS]
+    if order is None:
+      order = xrange(len(self))
+    for i in order:
+      yield (strings[registries[i]], strings[countries[i]],
+             strings[statuses[i]], starts[i], plens[i], dates[i], firsts[i])
+
+  def DateOrder(self):
+    """Row numbers sorted by date; rows with equal dates keep file order,
+    so a line's prefixes stay together."""
+    dates = self.dates
+    if numpy is not None and isinstance(dates, numpy.ndarray):
+      return numpy.argsort(dates, kind = 'mergesort').tolist()
+    return sorted(xrange(len(dates)), key = dates.__getitem__)
+
+  def __getstate__(self):
+    state = self.__dict__.copy()
+    del state['_index']
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self._index = dict([(self.strings[i], i)
+                        for i in range(len(self.strings))])
+
+def HashFiles(filenames):
+  """sha1 over the names and contents of the given files, in order."""
+  digest = hashlib.sha1()
+  for filename in filenames:
+    digest.update(filename)
+    f = open(filename, 'rb')
+    block = f.read(1 << 20)
+    while block:
+      digest.update(block)
+      block = f.read(1 << 20)
+    f.close()
+  return digest.hexdigest()
+
+def CacheKey(filename, zero_date = None):
+  """Cache key for a parse of filename. Only the contents and the parse
+  options matter, so a file that moves keeps its cache entry."""
+  digest = hashlib.sha1(repr(zero_date))
+  digest.update(HashFiles([filename]).decode('hex'))
+  return digest.hexdigest()
+
+def SaveRecords(records, directory):
+  """Write records as one .npy file per column, plus the string table.
+  The directory appears atomically, complete or not at all."""
+  parent = os.path.dirname(directory)
+  if parent and not os.path.isdir(parent):
+    try:
+      os.makedirs(parent)
+    except OSError:
+      pass  # Someone else made it first.
+  tmp = "%s.%s.tmp" % (directory, os.getpid())
+  os.mkdir(tmp)
+  for column in _COLUMNS:
+    values = getattr(records, column)
+    numpy.save(os.path.join(tmp, column + ".npy"),
+               numpy.array(values, dtype = values.typecode))
+  numpy.save(os.path.join(tmp, "strings.npy"),
+             numpy.array(records.strings, dtype = object))
+  try:
+    os.rename(tmp, directory)
+  except OSError:
+    shutil.rmtree(tmp)  # Lost a race with an identical entry.
+
+def LoadRecords(directory):
+  """Load records saved by SaveRecords, memory-mapping the columns."""
+  records = Records()
+  for column in _COLUMNS:
+    setattr(records, column,
+            numpy.load(os.path.join(directory, column + ".npy"),
+                       mmap_mode = 'r'))
+  strings = numpy.load(os.path.join(directory, "strings.npy"),
+                       allow_pickle = True)
+  records.strings = [str(string) for string in strings]
+  records._index = dict([(records.strings[i], i)
+                         for i in range(len(records.strings))])
+  return records
+
+def ClearCache(cache_dir = constants.defines._PARSE_CACHE_DIR):
+  """Throw away every cached parse."""
+  if os.path.isdir(cache_dir):
+    shutil.rmtree(cache_dir)
+
+def _RangeLines(f, start, end):
+  """Yield the lines of f that start inside the byte range [start, end)."""
+  position = start
+  if start > 0:
+    # Whatever line we land in belongs to the previous range.
+    f.seek(start - 1)
+    position = start - 1 + len(f.readline())
+  while position < end:
+    line = f.readline()
+    if not line:
+      break
+    position += len(line)
+    yield line
+
+def ChunkRanges(filename, chunks):
+  """Split a file into about chunks byte ranges of similar size."""
+  size = os.path.getsize(filename)
+  step = max(1, size / max(1, chunks))
+  return [(start, min(size, start + step)) for start in range(0, size, step)]
+
+def ParseChunk(args):
+  """Parse the lines that start inside a byte range of a delegated file.
+
+  Args (as one tuple, for Pool.map):
+    filename, start, end: the file and the byte range.
+    zero_date: the date to use instead of 00000000, or None to keep it.
+
+  Returns:
+    a Records object for the IPv4 lines in the range."""
+  (filename, start, end, zero_date) = args
+  records = Records()
+  f = open(filename, 'rb')
+  try:
+    for row in delegated.Parse(_RangeLines(f, start, end), zero_date):
+      (registry, country, status, block, plen, date, first) = row
+      records.Append(registry, country, status, block, plen, int(date),
+                     first)
+  finally:
+    f.close()
+  return records
+
+def ParseFile(filename, processes = None, zero_date = None, pool = None,
+              cache_dir = constants.defines._PARSE_CACHE_DIR):
+  """Parse a delegated file in parallel into one Records object, rows in
+  file order. If NumPy is available and cache_dir is not None, reuse or
+  fill the parse cache there."""
+  if numpy is not None and cache_dir is not None:
+    directory = os.path.join(cache_dir, CacheKey(filename, zero_date))
+    if os.path.isdir(directory):
+      return LoadRecords(directory)
+    records = ParseFile(filename, processes, zero_date, pool, None)
+    SaveRecords(records, directory)
+    return records
+  if processes is None:
+    processes = multiprocessing.cpu_count()
+  ranges = ChunkRanges(filename, processes * 4)
+  args = [(filename, start, end, zero_date) for (start, end) in ranges]
+  if processes <= 1:
+    parts = map(ParseChunk, args)
+  elif pool is not None:
+    parts = pool.map(ParseChunk, args)
+  else:
+    pool = multiprocessing.Pool(processes)
+    try:
+      parts = pool.map(ParseChunk, args)
+    finally:
+      pool.close()
+      pool.join()
+  records = Records()
+  for part in parts:
+    records.Extend(part)
+  return records
+
+def _DatedRows(records):
+  """records' rows in date order, with the dates back as YYYYMMDD strings."""
+  for (registry, country, status, start, plen, date, first) in \
+        records.Rows(records.DateOrder()):
+    yield (registry, country, status, start, plen, "%08d" % date, first)
+
+def ApplyIANA(sim, records, rir_behave = None):
+  """Apply parsed IANA records to sim, as FromIANAProcess does."""
+  sim.ApplyIANARecords(_DatedRows(records), rir_behave)
+
+def ApplyRIR(sim, records, lir_behave = None, rir_behave = None):
+  """Apply parsed NRO records to sim, as FromRIRProcess does."""
+  sim.ApplyRIRRecords(_DatedRows(records), lir_behave, rir_behave)
+
+def Ingest(sim, iana_file = constants.defines._IANA_DATA,
+           nro_file = constants.defines._NRO_DATA, lir_behave = None,
+           rir_behave = None, processes = None,
+           cache_dir = constants.defines._PARSE_CACHE_DIR):
+  """Parse both delegated files in parallel, or fetch them from the parse
+  cache, and apply them to sim: the IANA file first, then the NRO file,
+  each in date order."""
+  if processes is None:
+    processes = multiprocessing.cpu_count()
+  pool = None
+  if processes > 1:
+    pool = multiprocessing.Pool(processes)
+  try:
+    iana_records = ParseFile(iana_file, processes, pool = pool,
+                             cache_dir = cache_dir)
+    nro_records = ParseFile(nro_file, processes,
+                            constants.defines._DEFAULT_NON_ZERO_DATE, pool,
+                            cache_dir)
+  finally:
+    if pool is not None:
+      pool.close()
+      pool.join()
+  if sim.debug >= 1:
+    print "ingest: parsed [%s] IANA and [%s] NRO prefixes" % \
+      (len(iana_records), len(nro_records))
+  ApplyIANA(sim, iana_records, rir_behave)
+  ApplyRIR(sim, nro_records, lir_behave, rir_behave)
+
+def AppliedLines(filename, zero_date = None, iana = True):
+  """The lines of a delegated file that matter to the simulation, as a
+  sorted list of (date, registry, country, status, start, size) keys.
+
+  Args:
+    filename: the delegated file.
+    zero_date: the date to use instead of 00000000, or None to keep it.
+    iana: if True, keep IANA lines, as FromIANAProcess does; if False,
+      keep RIR lines, as FromRIRProcess does. Nothing reads the status of
+      RIR lines, so it is blanked and changing it is not a change."""
+  lines = []
+  key = None
+  for (registry, country, status, start, plen, date, first) in \
+        delegated.ParseFile(filename, zero_date):
+    if (registry == 'iana') != iana:
+      continue
+    if first:
+      if key is not None:
+        lines.append(tuple(key))
+      if not iana:
+        status = ''
+      key = [date, registry, country, status, start, 0]
+    key[5] += 1 << (32 - plen)
+  if key is not None:
+    lines.append(tuple(key))
+  lines.sort()
+  return lines
+
+def Difference(old, new):
+  """Merge two sorted key lists; return (added, removed), both sorted."""
+  added = []
+  removed = []
+  i = 0
+  j = 0
+  while i < len(old) and j < len(new):
+    if old[i] == new[j]:
+      i += 1
+      j += 1
+    elif old[i] < new[j]:
+      removed.append(old[i])
+      i += 1
+    else:
+      added.append(new[j])
+      j += 1
+  removed.extend(old[i:])
+  added.extend(new[j:])
+  return (added, removed)
+
+def _LineRows(lines):
+  """Turn AppliedLines keys back into delegated.Parse() style rows."""
+  for (date, registry, country, status, start, size) in lines:
+    first = 1
+    for (block, plen) in delegated.Decompose(start, size):
+      yield (registry, country, status, block, plen, date, first)
+      first = 0
+
+def RecordApplied(sim, iana_file = constants.defines._IANA_DATA,
+                  nro_file = constants.defines._NRO_DATA):
+  """Note in sim which delegated lines it was built from, for
+  DeltaIngest to diff against later."""
+  sim.applied = {'iana': AppliedLines(iana_file, iana = True),
+                 'nro': AppliedLines(nro_file,
+                                     constants.defines._DEFAULT_NON_ZERO_DATE,
+                                     iana = False)}
+
+def _Withdrawable(sim, iana_lines, nro_lines, iana_removed, nro_removed):
+  """Can sim give up the removed lines and still look as if it had been
+  built from the new ones? Not if that would leave it a holder no line
+  mentions any more, which a rebuild would never have made."""
+  rirs = set([line[1] for line in nro_lines])
+  for line in iana_lines:
+    if line[3] not in ('assigned', 'ietf', 'various'):
+      rirs.add(line[3])
+  lirs = set([line[2] for line in nro_lines])
+  for line in iana_removed:
+    if line[3] not in ('assigned', 'ietf', 'various'):
+      if line[3] not in rirs or sim.GetRIRByName(line[3]) == None:
+        return False
+  for line in nro_removed:
+    if line[1] not in rirs or sim.GetRIRByName(line[1]) == None or \
+       line[2] not in lirs or sim.lirs.get(line[2]) == None:
+      return False
+  return True
+
+def DeltaIngest(sim, iana_file = constants.defines._IANA_DATA,
+                nro_file = constants.defines._NRO_DATA, lir_behave = None,
+                rir_behave = None):
+  """Bring sim up to date with the delegated files: withdraw the lines it
+  was built from that have gone, apply the ones it has not seen. A
+  changed line is both, so its old prefix is taken out of its holders
+  and its new one put in.
+
+  sim must have been built, or last refreshed, with RecordApplied.
+
+  Returns:
+    (iana_added, nro_added) line counts, or None if sim has no record of
+    what it was built from or a withdrawal would leave a holder with no
+    lines at all; rebuild instead."""
+  if sim.applied == None:
+    return None
+  iana_lines = AppliedLines(iana_file, iana = True)
+  nro_lines = AppliedLines(nro_file, constants.defines._DEFAULT_NON_ZERO_DATE,
+                           iana = False)
+  (iana_added, iana_removed) = Difference(sim.applied['iana'], iana_lines)
+  (nro_added, nro_removed) = Difference(sim.applied['nro'], nro_lines)
+  if not _Withdrawable(sim, iana_lines, nro_lines, iana_removed, nro_removed):
+    if sim.debug >= 1:
+      print "ingest: [%s] IANA and [%s] NRO lines can't be withdrawn" % \
+        (len(iana_removed), len(nro_removed))
+    return None
+  # Allocations come out before the blocks they were made from, and go
+  # in after. Keys sort by date first, so these are in date order.
+  sim.WithdrawRIRRecords(_LineRows(nro_removed))
+  sim.WithdrawIANARecords(_LineRows(iana_removed))
+  sim.ApplyIANARecords(_LineRows(iana_added), rir_behave)
+  sim.ApplyRIRRecords(_LineRows(nro_added), lir_behave, rir_behave)
+  # As if built in date order: blocks are allocated from oldest first,
+  # and an LIR's supplier is the RIR of its latest line.
+  rank = dict()
+  for (i, (date, registry, country, status, start, size)) in \
+        enumerate(iana_lines):
+    for (block, plen) in delegated.Decompose(start, size):
+      rank[delegated.PrefixString(block, plen)] = i
+  for name in set([line[3] for line in iana_added + iana_removed]):
+    the_rir = sim.GetRIRByName(name)
+    if the_rir != None:
+      the_rir.iana_prefixes.sort(key = rank.get)
+  suppliers = dict()
+  for (date, registry, country, status, start, size) in nro_lines:
+    suppliers[country] = registry
+  for line in nro_removed:
+    sim.GetLIRByName(line[2]).address_supplier = \
+      sim.GetRIRByName(suppliers[line[2]])
+  sim.applied = {'iana': iana_lines, 'nro': nro_lines}
+  if sim.debug >= 1:
+    print "ingest: withdrew [%s] IANA and [%s] NRO lines, applied [%s] and " \
+      "[%s] new" % (len(iana_removed), len(nro_removed), len(iana_added),
+                    len(nro_added))
+  return (len(iana_added), len(nro_added))
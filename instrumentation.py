@@ -29,6 +29,7 @@ _EVENTS = { 'ADD_ROUTE': 'AddRouteEvent',
             'ADD_PREFIX': 'AddPrefixEvent',
             'REMOVE_ROUTE': 'RemoveRouteEvent',
             'REQUEST_SPACE': 'RequestSpaceEvent',
+            'REQUEST_BATCH': 'RequestBatchEvent',
             'NEEDS_SPACE': 'NeedsSpaceEvent',
             'GETS_SPACE': 'GetsSpaceEvent',
             'TRADE_SPACE': 'TradeSpaceEvent',
@@ -54,6 +55,9 @@ _EVENTS = { 'ADD_ROUTE': 'AddRouteEvent',
             'RIR_EXHAUSTED' : 'EntityExhaustedEvent',
             'LIR_EXHAUSTED' : 'EntityExhaustedEvent',
             'LIR_BLOCKED' : 'EntityBlockedEvent',
+            'SPACE_EXHAUSTED' : 'SpaceExhaustedEvent',
+            'SPACE_THRESHOLD' : 'SpaceThresholdEvent',
+            'SPACE_DELTA' : 'SpaceDeltaEvent',
             'RIR_BLOCKED' : 'EntityBlockedEvent',
             'FINISHED_READIN' : 'FinishedReadinEvent',
             'FINISHED_SETUP' : 'FinishedSetupEvent'}
@@ -78,6 +82,7 @@ class event_processor:
     self.args = {}
     self.mode = mode
     self.proc = None
+    self.subscribers = {}
 
     if self.mode == constants.defines._INSTRUMENTATION_MODES['stdout']:
       self.proc = text_event_processor(verbosity)
@@ -94,18 +99,42 @@ class event_processor:
     else:
       raise ValueError, "event_processor without defined mode!"
 
+  def __getstate__(self):
+    """Subscribers belong to whoever is running now; don't pickle them."""
+    state = self.__dict__.copy()
+    state['subscribers'] = {}
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self.subscribers = {}
+
+  def Subscribe(self, event, callback):
+    """Call callback(*args) with the args of every event of this kind we
+    receive, after it has been processed as usual."""
+    if event not in _EVENTS:
+      raise EventError(event)
+    self.subscribers.setdefault(event, []).append(callback)
+
+  def Unsubscribe(self, event, callback):
+    self.subscribers[event].remove(callback)
+
   def ReceiveEvent(self, event, *varargs):
     """Receive an event from related objects. Check the event is something we know about.
-    If so, record it or log it or similar. If not, discard with error. """
+    If so, record it or log it or similar, and pass it on to any subscribers.
+    If not, discard with error. """
     if self.mode == constants.defines._INSTRUMENTATION_MODES['stdout']:
       func = getattr(self.proc, _EVENTS[event])
-      return func(varargs)
+      result = func(varargs)
     elif self.mode == constants.defines._INSTRUMENTATION_MODES['syslog']:
-      return getattr(self.proc,_EVENTS[event])(varargs)
+      result = getattr(self.proc,_EVENTS[event])(varargs)
     elif self.mode == constants.defines._INSTRUMENTATION_MODES['gui']:
       raise ValueError, "gui mode not implemented yet"
     else:
       raise ValueError, "mode not implemented yet"
+    for callback in self.subscribers.get(event, ()):
+      callback(*varargs)
+    return result
 
 class text_event_processor:
   """The default, stdio output class."""
@@ -149,6 +178,12 @@ class text_event_processor:
         (args[0], args[1], args[2])
     return args
 
+  def RequestBatchEvent(self, args):
+    if self.verbosity > 0:
+      print "*** REQUEST BATCH EVENT at '%s' serving '%s' requests on '%s'" % \
+        (args[0], args[1], args[2])
+    return args
+
   def GenerateNameEvent(self, args): # FIXME
     if self.verbosity > 1:
       print "*** GENERATE NAME EVENT generated '%s'" % args[0]
@@ -227,6 +262,23 @@ class text_event_processor:
       print "*** ADD EVENT TO TIMELINE at date [%s]" % args[0]
     return args
 
+  def SpaceExhaustedEvent(self, args):
+    if self.verbosity > 1:
+      print "*** SPACE EXHAUSTED for '%s'" % args[0].name
+    return args
+
+  def SpaceThresholdEvent(self, args):
+    if self.verbosity > 1:
+      print "*** SPACE THRESHOLD for '%s' now [%s] percent free" % \
+        (args[0].name, args[1])
+    return args
+
+  def SpaceDeltaEvent(self, args):
+    if self.verbosity > 1:
+      print "*** SPACE DELTA for '%s' span [%s] used [%s]" % \
+        (args[0].name, args[1], args[2])
+    return args
+
   def LostSpaceEvent(self, args):
     if self.verbosity > 0:
       print "*** ENTITY [%s] FREE SPACE CHANGE to [%s] percent free at date [%s]" % \
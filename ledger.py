@@ -0,0 +1,381 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+ledger.py - column-oriented records of address allocations.
+
+Every address holder keeps two ledgers: the prefixes it has registered
+(been given) and the requests it has fulfilled (given out). A ledger
+stores one row per prefix, in four parallel arrays:
+
+  days      date as a proleptic Gregorian ordinal
+  networks  first address of the prefix as an integer
+  lengths   prefix length
+  parties   the counterparty, as an index into the ledger's party names
+            (-1 for unknown)
+
+Appending is O(1). Rows are kept sorted by day, stably, so rows for one
+day stay in the order they were appended; an out of order append just
+marks the ledger for sorting, which happens the next time it is read.
+Window() finds the rows for a range of days by bisection and hands back
+a view over them rather than a copy. A running total of the addresses
+the rows cover is kept alongside, so the span of any window, and so
+"how much did we get between these dates", is two binary searches and
+a subtraction. Remove() takes a row back out, in O(n), for the rare
+delegated line that is withdrawn after a holder was given it.
+
+Has() and Overlaps() answer "is this exact prefix in the ledger" and
+"does anything in the ledger overlap this prefix" from a hash of
+(network, length) and a sorted array of network addresses. CIDR blocks
+either nest or are disjoint, so an overlap is either something holding
+the prefix, found by looking up each shorter length we have rows for,
+or something starting inside it, found by bisection. Appends leave new
+network addresses in an unsorted tail, sorted in the next time Overlaps()
+needs them, so appending stays O(1); unpickling rebuilds the indices in
+one pass and one sort.
+
+ByDate() and ByPrefix() rebuild the dicts of lists that holders used to
+keep (registered_prefixes_by_date and friends), with prefixes and dates
+spelled as before.
+
+Typical use case:
+  given = ledger.Ledger()
+  given.Append('10.0.0.0/8', '19950101', 'RIPE')
+  print given.Window(ledger.DayOrdinal('19950101'),
+                     ledger.DayOrdinal('19951231')).Span()
+"""
+
+import delegated
+
+import array
+import bisect
+import datetime
+import IPy
+
+# YYYYMMDD to day ordinal and back, memoised: a run sees few distinct dates
+# but a great many rows.
+_ORDINALS = dict()
+_DATES = dict()
+
+# Netmask for each prefix length, as an integer.
+_MASKS = [(0xffffffff << (32 - length)) & 0xffffffff for length in range(33)]
+
+def DayOrdinal(date):
+  """A YYYYMMDD string to a day ordinal."""
+  ordinal = _ORDINALS.get(date)
+  if ordinal is None:
+    ordinal = datetime.date(int(date[0:4]), int(date[4:6]),
+                            int(date[6:8])).toordinal()
+    _ORDINALS[date] = ordinal
+    _DATES[ordinal] = date
+  return ordinal
+
+def OrdinalDate(ordinal):
+  """A day ordinal to a YYYYMMDD string."""
+  date = _DATES.get(ordinal)
+  if date is None:
+    date = datetime.date.fromordinal(ordinal).strftime("%Y%m%d")
+    _DATES[ordinal] = date
+    _ORDINALS[date] = ordinal
+  return date
+
+def ParsePrefix(prefix):
+  """'a.b.c.d/len' (or a bare address, meaning /32) to (network, length)."""
+  (address, slash, length) = prefix.partition('/')
+  if address.count('.') != 3:
+    ip = IPy.IP(prefix)
+    return (ip.int(), ip.prefixlen())
+  if slash:
+    return (delegated.AddressToInt(address), int(length))
+  return (delegated.AddressToInt(address), 32)
+
+def SpellPrefix(network, length):
+  """(network, length) to a prefix string, spelt as IPy spells it."""
+  if length == 32:
+    return delegated.IntToAddress(network)
+  return delegated.PrefixString(network, length)
+
+class Ledger(object):
+  """A day sorted table of prefixes and counterparties, appended to."""
+
+  # Every holder has two, so no __dict__ each.
+  __slots__ = ('days', 'networks', 'lengths', 'parties', 'party_names',
+               'party_ids', 'unsorted', 'cumulative', 'date_items', 'exact',
+               'starts', 'tail', 'held_lengths')
+
+  def __init__(self):
+    self.days = array.array('l')
+    self.networks = array.array('L')
+    self.lengths = array.array('B')
+    self.parties = array.array('l')
+    self.party_names = []
+    self.party_ids = dict()
+    self.unsorted = False
+    self.cumulative = [0]  # Addresses covered by the rows before each row
+    self.date_items = None  # ByDateItems() cache
+    self.exact = dict()  # (network, length) to how many rows have it
+    self.starts = array.array('L')  # Sorted networks of the exact keys...
+    self.tail = []  # ...apart from those added since, unsorted
+    self.held_lengths = 0  # Bit n set if we have a row for a /n
+
+  def __len__(self):
+    return len(self.days)
+
+  def __getstate__(self):
+    state = dict()
+    for name in ('days', 'networks', 'lengths', 'parties', 'party_names',
+                 'party_ids', 'unsorted'):
+      state[name] = getattr(self, name)
+    state['date_items'] = None
+    return state
+
+  def __setstate__(self, state):
+    for (name, value) in state.items():
+      setattr(self, name, value)
+    self._Accumulate()
+    self._Reindex()
+
+  def _Accumulate(self):
+    """Rebuild the running totals from the lengths column."""
+    total = 0
+    self.cumulative = [0]
+    for length in self.lengths:
+      total += 1 << (32 - length)
+      self.cumulative.append(total)
+
+  def _PartyId(self, party):
+    if party is None:
+      return -1
+    party_id = self.party_ids.get(party)
+    if party_id is None:
+      party_id = len(self.party_names)
+      self.party_names.append(party)
+      self.party_ids[party] = party_id
+    return party_id
+
+  def _Index(self, network, length):
+    """Add a row's prefix to the membership and overlap indices."""
+    key = (network & _MASKS[length], length)
+    count = self.exact.get(key, 0)
+    self.exact[key] = count + 1
+    if count == 0:
+      self.tail.append(key[0])
+      self.held_lengths |= 1 << length
+
+  def _Reindex(self):
+    """Rebuild the membership and overlap indices from the columns."""
+    exact = dict()
+    held_lengths = 0
+    for (network, length) in zip(self.networks, self.lengths):
+      key = (network & _MASKS[length], length)
+      exact[key] = exact.get(key, 0) + 1
+      held_lengths |= 1 << length
+    self.exact = exact
+    self.held_lengths = held_lengths
+    self.starts = array.array('L', sorted(set([network for (network, length)
+                                               in exact])))
+    self.tail = []
+
+  def _Starts(self):
+    """The sorted networks of the exact keys, with the tail sorted in."""
+    if self.tail:
+      # One sorted run and one short one, which sorted() merges cheaply.
+      self.starts.extend(self.tail)
+      self.starts = array.array('L', sorted(self.starts))
+      self.tail = []
+    return self.starts
+
+  def Append(self, prefix, date, party = None):
+    """Record prefix, on YYYYMMDD date, with counterparty name party."""
+    (network, length) = ParsePrefix(prefix)
+    day = DayOrdinal(date)
+    if self.days and day < self.days[-1]:
+      self.unsorted = True
+    self.days.append(day)
+    self.networks.append(network)
+    self.lengths.append(length)
+    self.parties.append(self._PartyId(party))
+    self.cumulative.append(self.cumulative[-1] + (1 << (32 - length)))
+    self._Index(network, length)
+    if self.unsorted:
+      self.date_items = None
+    elif self.date_items is not None:
+      # Keep the cache up to date, without touching lists handed out.
+      prefix = SpellPrefix(network, length)
+      if self.date_items and self.date_items[-1][0] == date:
+        self.date_items[-1] = (date, self.date_items[-1][1] + [prefix])
+      else:
+        self.date_items.append((date, [prefix]))
+
+  def Remove(self, prefix, date):
+    """Take out the last row for prefix on YYYYMMDD date.
+
+    Raises:
+      KeyError if there is no such row."""
+    (network, length) = ParsePrefix(prefix)
+    day = DayOrdinal(date)
+    for i in xrange(len(self.days) - 1, -1, -1):
+      if self.networks[i] == network and self.lengths[i] == length and \
+         self.days[i] == day:
+        break
+    else:
+      raise KeyError, prefix
+    for name in ('days', 'networks', 'lengths', 'parties'):
+      del getattr(self, name)[i]
+    self._Accumulate()
+    self.date_items = None
+    key = (network & _MASKS[length], length)
+    if self.exact[key] > 1:
+      self.exact[key] -= 1
+      return
+    del self.exact[key]
+    # held_lengths may keep the bit; Overlaps just looks for nothing.
+    for held in xrange(33):
+      if (key[0], held) in self.exact:
+        return
+    starts = self._Starts()
+    del starts[bisect.bisect_left(starts, key[0])]
+
+  def _Sort(self):
+    """Put the rows back in day order, keeping append order within a day."""
+    if not self.unsorted:
+      return
+    order = sorted(range(len(self.days)), key = self.days.__getitem__)
+    for name in ('days', 'networks', 'lengths', 'parties'):
+      column = getattr(self, name)
+      setattr(self, name, array.array(column.typecode,
+                                      [column[i] for i in order]))
+    self._Accumulate()
+    self.unsorted = False
+
+  def Window(self, first_day = None, last_day = None):
+    """A view of the rows from first_day to last_day inclusive (day
+    ordinals; None for no bound)."""
+    self._Sort()
+    start = 0
+    stop = len(self.days)
+    if first_day is not None:
+      start = bisect.bisect_left(self.days, first_day)
+    if last_day is not None:
+      stop = bisect.bisect_right(self.days, last_day)
+    return LedgerWindow(self, start, max(start, stop))
+
+  def SpanBetween(self, first_date = None, last_date = None):
+    """(prefixes, addresses) registered from first_date to last_date
+    inclusive (YYYYMMDD; None for no bound)."""
+    if first_date is not None:
+      first_date = DayOrdinal(first_date)
+    if last_date is not None:
+      last_date = DayOrdinal(last_date)
+    window = self.Window(first_date, last_date)
+    return (len(window), window.Span())
+
+  def Rows(self):
+    """Every row as (date, prefix, party), in day order."""
+    return self.Window().Rows()
+
+  def Has(self, prefix):
+    """Is exactly this prefix in the ledger?"""
+    (network, length) = ParsePrefix(prefix)
+    return (network & _MASKS[length], length) in self.exact
+
+  def Overlaps(self, prefix):
+    """Does any prefix in the ledger share an address with this one?"""
+    (network, length) = ParsePrefix(prefix)
+    network &= _MASKS[length]
+    # Something the same size or bigger, holding it...
+    for held in xrange(length + 1):
+      if self.held_lengths >> held & 1 and \
+         (network & _MASKS[held], held) in self.exact:
+        return True
+    # ...or something smaller, starting inside it.
+    starts = self._Starts()
+    i = bisect.bisect_left(starts, network)
+    return i < len(starts) and starts[i] < network + (1 << (32 - length))
+
+  def Count(self):
+    """How many different prefixes are in the ledger?"""
+    return len(self.exact)
+
+  def ByDate(self):
+    """The rows as a dict of YYYYMMDD date to list of prefixes."""
+    result = dict()
+    for (date, prefix, party) in self.Rows():
+      result.setdefault(date, []).append(prefix)
+    return result
+
+  def ByPrefix(self):
+    """The rows as a dict of prefix to list of YYYYMMDD dates."""
+    result = dict()
+    for (date, prefix, party) in self.Rows():
+      result.setdefault(prefix, []).append(date)
+    return result
+
+  def ByDateItems(self):
+    """ByDate().items(), oldest date first, without the dict. Holders
+    hand this to their behaviour on every callback, so it is kept, and
+    appended to as rows arrive in order. The list is the caller's; the
+    prefix lists are shared and must be left alone."""
+    if self.date_items is None:
+      items = []
+      last = None
+      for (date, prefix, party) in self.Rows():
+        if date != last:
+          items.append((date, []))
+          last = date
+        items[-1][1].append(prefix)
+      self.date_items = items
+    return DateItems(self.date_items, self)
+
+class DateItems(list):
+  """What ByDateItems() returns: a list of (date, [prefixes]), to sort or
+  otherwise do with as the caller pleases, that can also answer span
+  queries from the ledger it came from."""
+
+  def __init__(self, items, ledger):
+    list.__init__(self, items)
+    self.ledger = ledger
+
+  def SpanBetween(self, first_date = None, last_date = None):
+    return self.ledger.SpanBetween(first_date, last_date)
+
+class LedgerWindow(object):
+  """Rows start to stop of a ledger. The window refers to the ledger's
+  own columns, so indexing them with range(start, stop) reads the rows
+  without copying anything."""
+
+  def __init__(self, ledger, start, stop):
+    self.ledger = ledger
+    self.start = start
+    self.stop = stop
+
+  def __len__(self):
+    return self.stop - self.start
+
+  def Rows(self):
+    """(date, prefix, party) for each row in the window."""
+    ledger = self.ledger
+    names = ledger.party_names
+    result = []
+    for i in xrange(self.start, self.stop):
+      party = ledger.parties[i]
+      if party < 0:
+        party = None
+      else:
+        party = names[party]
+      result.append((OrdinalDate(ledger.days[i]),
+                     SpellPrefix(ledger.networks[i], ledger.lengths[i]),
+                     party))
+    return result
+
+  def Span(self):
+    """How many addresses the window's prefixes cover between them."""
+    cumulative = self.ledger.cumulative
+    return cumulative[self.stop] - cumulative[self.start]
+
+def FromDicts(by_date):
+  """A ledger holding the rows of an old style by-date dict of lists."""
+  result = Ledger()
+  for date in sorted(by_date.keys()):
+    for prefix in by_date[date]:
+      result.Append(prefix, date)
+  return result
@@ -16,6 +16,7 @@ Created by Niall Murphy on 2007-02-22.
 # Must occur at beginning due to integer division "feature"
 from __future__ import division
 
+import array
 import os
 import sys
 sys.path.append("")
@@ -26,18 +27,56 @@ import time
 import behaviour
 import constants
 import datetime
+import functools
 import IPy
 import instrumentation
+import ledger
 import math
+import timeline
 import tree
 
 from instrumentation import _EVENTS as _EVENTS
 
-class address_holder:
+# Bits 0 to 32: one per IPv4 prefix length.
+_ALL_LENGTHS = (1 << 33) - 1
+
+# Class to the names of every slot its instances have, for pickling.
+_SLOT_NAMES = dict()
+
+def _Span(prefix):
+  """How many addresses prefix, a CIDR string, covers."""
+  return 1 << (32 - ledger.ParsePrefix(prefix)[1])
+
+def _SlotNames(cls):
+  """The slots of cls and all its bases."""
+  names = _SLOT_NAMES.get(cls)
+  if names is None:
+    names = set()
+    for klass in cls.__mro__:
+      names.update(getattr(klass, '__slots__', ()))
+    _SLOT_NAMES[cls] = names
+  return names
+
+class address_holder(object):
   """An address holder is the abstract base class for LIRs, RIRs, etc.
   Address holders hold addresses in Trees, have names, IDs, and
   a current date. Internal methods allow adding, removing and
-  finding spaces."""
+  finding spaces.
+
+  There may be hundreds of thousands of holders, so they keep their
+  attributes in slots rather than a dict each; a subclass adding an
+  attribute must add a slot for it. The ID is a small integer handed
+  out by the simulation the holder is enrolled in (None until then),
+  dense so that per-holder tables can be lists indexed by it.
+
+  A holder's behaviour draws from the holder's own random stream, if the
+  simulation has given it one (see simulation.SeedStreams), so that what
+  it does doesn't depend on the order anyone else draws in."""
+
+  __slots__ = ('id', 'table', 'address_supplier', 'tree', 'behaviour',
+               'registered', 'fulfilled', 'instrument', 'name', 'date',
+               'space_exhausted', 'free', 'fit', 'address_span',
+               'addresses_used', 'debug', 'stream')
 
   def __init__(self,
                supplied_name = None,
@@ -51,14 +90,13 @@ class address_holder:
       supplied_name (default None, means today) 
       supplied_debug (level 0 up)"""
     # Sub object initialisation
+    self.id = None  # See simulation.Enrol
     self.table = None  # We expect this to be initialised later
     self.address_supplier = None  # Remains true only for IANA
     self.tree = tree.Tree(supplied_debug = supplied_debug)  # Cascade debug lvl
     self.behaviour = None  # This is where behaviour is indirected through
-    self.registered_prefixes_by_date = dict()  # Things I've been given...
-    self.registered_prefixes_by_prefix = dict()  # maintained by prefix.
-    self.fulfilled_requests_by_date = dict()  # Things I've been asked for...
-    self.fulfilled_requests_by_prefix = dict()  # maintained by prefix.
+    self.registered = ledger.Ledger()  # Things I've been given...
+    self.fulfilled = ledger.Ledger()  # Things I've been asked for...
     # Assume reasonable defaults if caller hasn't been specific.
     if supplied_inst != None:
       self.instrument = supplied_inst
@@ -76,9 +114,36 @@ class address_holder:
       self.date = self.SetDate(supplied_date) 
     # Address spans and utilisation counters.
     self.space_exhausted = False
+    self.free = array.array('l', [0] * 33)  # Free blocks by length
+    self.fit = 0  # Bit n set while free[n] is non-zero
     self.address_span = 0
     self.addresses_used = 0
     self.debug = supplied_debug
+    self.stream = None  # A timeline.Stream; the random module if None
+
+  def __getstate__(self):
+    """Pickle the slots that are set, as a dict."""
+    state = dict()
+    for name in _SlotNames(type(self)):
+      if hasattr(self, name):
+        state[name] = getattr(self, name)
+    return state
+
+  def __setstate__(self, state):
+    """Take on pickled state: ours, or the __dict__ of a holder from
+    before slots, whose dicts of lists of allocations become ledgers.
+    Anything we no longer keep is dropped."""
+    if 'registered_prefixes_by_date' in state:
+      state = dict(state)
+      state['registered'] = \
+        ledger.FromDicts(state.pop('registered_prefixes_by_date'))
+      state['fulfilled'] = \
+        ledger.FromDicts(state.pop('fulfilled_requests_by_date'))
+    self.id = None  # Unless we had one
+    slots = _SlotNames(type(self))
+    for (name, value) in state.items():
+      if name in slots:
+        setattr(self, name, value)
    
   # Functions related to the global routing table model.
 
@@ -91,21 +156,111 @@ class address_holder:
 
   # The boolean for whether or not our current space is exhausted.
   # This means TOTAL exhaustion, not just all prefixes of a size X
-  # filled; that's a separate function. I want getters and setters
-  # for this because I will put in extra stuff later.
+  # filled; that's what the size argument and CanSatisfy are for. I want
+  # getters and setters for this because I will put in extra stuff later.
 
   def GetSpaceExhausted(self, size = 0):
     """Return boolean describing whether all locally allocatable
-    space has been in fact allocated."""
-    # TODO(niallm): return true if all _contiguous_ space of size
-    # X has been used. i.e we've asked for a /24, but we have dis-contiguous
-    # /25's only - that would return false.
+    space has been in fact allocated. Given a prefix length, say instead
+    whether we know there is no contiguous block that long left: holding
+    only dis-contiguous /25s exhausts us for a /24."""
+    if size:
+      return not self.CanSatisfy(size)
     return self.space_exhausted
 
+  # Contiguous space. free counts the free blocks in our tree by prefix
+  # length (see tree.Tree.FreeAround), and fit has bit n set while there
+  # are any /n blocks. Every insert into our tree goes through
+  # _TreeInsert, which keeps both up to date, so these are all O(1).
+
+  def CanSatisfy(self, size):
+    """Have we room for a /size?"""
+    return (self.fit & ((2 << size) - 1)) != 0
+
+  def LargestAllocatable(self):
+    """The shortest prefix length (largest block) we have room for, or
+    None if we have room for nothing."""
+    if self.fit == 0:
+      return None
+    return (self.fit & -self.fit).bit_length() - 1
+
+  def FitMask(self):
+    """Bitmap with bit n set for each /n we have room for."""
+    if self.fit == 0:
+      return 0
+    return _ALL_LENGTHS & ~((self.fit & -self.fit) - 1)
+
+  def _TreeInsert(self, prefix, data, **flags):
+    """Insert prefix into our tree as tree.Tree.Insert does, with the
+    same flags, and count the free blocks that makes and takes."""
+    (path, before) = self.tree.FreeAround(prefix)
+    result = self.tree.Insert(prefix, data, **flags)
+    self._Free(before, -1)
+    self._Free(self.tree.FreeUnder(path), 1)
+    return result
+
+  def _TreeRemove(self, prefix):
+    """Take prefix out of our tree as tree.Tree.Remove does, and count
+    the free blocks that gives back."""
+    path = self.tree.RemovalPath(prefix)
+    before = self.tree.FreeUnder(path)
+    self.tree.Remove(prefix)
+    self._Free(before, -1)
+    self._Free(self.tree.FreeUnder(path), 1)
+
+  def _Free(self, lengths, delta):
+    """Count delta more free blocks of each of lengths."""
+    for length in lengths:
+      self.free[length] += delta
+      if self.free[length]:
+        self.fit |= 1 << length
+      else:
+        self.fit &= ~(1 << length)
+
+  def _CountFree(self):
+    """Count our free blocks afresh from the whole tree."""
+    self.free = array.array('l', [0] * 33)
+    self.fit = 0
+    self._Free(self.tree.FreeUnder(''), 1)
+
   def _SetSpaceExhausted(self, value = True):
     """Set boolean describing whether all locally allocatable
-    space has been in fact allocated."""
-    self.space_exhausted = value
+    space has been in fact allocated. Running out is published as a
+    SPACE_EXHAUSTED event; timelined.Run() subscribes to these rather
+    than polling every RIR after every callback."""
+    if self.space_exhausted != value:
+      self.space_exhausted = value
+      if value == True:
+        self.instrument.ReceiveEvent('SPACE_EXHAUSTED', self)
+
+  def _Account(self, span, used):
+    """Move our address counters on by span and used addresses, and
+    publish that as a SPACE_DELTA event, for stats.Rollup to total up.
+    If that takes AddressPercentageLeft() across to another value, it is
+    published as a SPACE_THRESHOLD event too, with the new percentage."""
+    if span or used:
+      before = self.AddressPercentageLeft()
+      self.address_span += span
+      self.addresses_used += used
+      self.instrument.ReceiveEvent('SPACE_DELTA', self, span, used)
+      after = self.AddressPercentageLeft()
+      if after != before:
+        self.instrument.ReceiveEvent('SPACE_THRESHOLD', self, after)
+
+  def _Draw(self, method, *args):
+    """Call method, one of our behaviour's, with args, drawing anything
+    random it needs from our stream."""
+    previous = timeline.UseStream(self.stream)
+    try:
+      return method(*args)
+    finally:
+      timeline.UseStream(previous)
+
+  def Region(self):
+    """The name of the RIR whose region we are in, or None."""
+    if self.address_supplier == None:
+      return None
+    return self.address_supplier.Region()
 
   # Methods related to naming.
 
@@ -125,6 +280,18 @@ class address_holder:
     """Return name for this object"""
     return self.name
 
+  def _Note(self, kind, date = None):
+    """What we leave in a tree node for a prefix: (our id, day ordinal of
+    date, default today, and kind), instead of a string per prefix."""
+    if date == None:
+      date = self.GetDate()
+    return (self.id, ledger.DayOrdinal(date), intern(kind))
+
+  def GetCountry(self):
+    """Return the country part of our (country.blah) name. Holders read
+    from the NRO file are named for their country outright."""
+    return self.name.split('.')[0]
+
   # Methods related to dating.
 
   def SetDate(self, supplied_date):
@@ -194,8 +361,8 @@ class address_holder:
     if self.debug >= 2:
       print "lir._add_tree_prefix prefix (%s) note (%s) used (%s) supplied \
 date (%s)" % (prefix, note, used, supplied_date)
-    result = self.tree.Insert(prefix, 
-                              self.GetName() + " " + note, 
+    result = self._TreeInsert(prefix,
+                              self._Note(note, supplied_date),
                               mark_used = used,
                               test_none = False,
                               test_dup = test_dup)
@@ -205,9 +372,11 @@ date (%s)" % (prefix, note, used, supplied_date)
       self.tree.PrintIterableNodes()
     # If it's marked used on reception, we increase both the
     # address span and the used addresses.
-    self.address_span += IPy.IP(prefix).len()
+    span = _Span(prefix)
     if used == True:
-      self.addresses_used += IPy.IP(prefix).len()
+      self._Account(span, span)
+    else:
+      self._Account(span, 0)
     if supplied_date == None:
       self._RegisterPrefix(prefix, self.GetDate())
     else:
@@ -215,21 +384,28 @@ date (%s)" % (prefix, note, used, supplied_date)
     self.instrument.ReceiveEvent('ADD_PREFIX', self.GetName(), prefix, supplied_date)
     return True
 
-  def _RemoveTreePrefix(self, prefix):
-    """Attempt to remove the prefix supplied from registered prefixes.
+  def _RemoveTreePrefix(self, prefix, used = False, supplied_date = None):
+    """Undo _AddTreePrefix(prefix, note, used, supplied_date): take the
+    prefix back out of our tree, address counters and registered ledger,
+    as when a delegated line we were built from is withdrawn.
 
     Args:
       prefix: in CIDR (string) format.
+      used: as given to _AddTreePrefix.
+      supplied_date: the date it was registered on (default today).
 
     Raises:
-      Pass up a KeyError in case of failure."""
-    try:
-      self.tree.Remove(prefix)
-      self._RemovePrefix(prefix)
-    except:
-      raise
+      KeyError if we don't hold the prefix."""
+    if supplied_date == None:
+      supplied_date = self.GetDate()
+    self.registered.Remove(prefix, supplied_date)
+    self._TreeRemove(prefix)
+    span = _Span(prefix)
+    if used == True:
+      self._Account(-span, -span)
     else:
-      return True
+      self._Account(-span, 0)
+    return True
 
   def _IterateTreePrefixes(self):
     """Semi-private method for iterating over the underlying tree nodes."""
@@ -245,18 +421,36 @@ date (%s)" % (prefix, note, used, supplied_date)
   # but tracked separately because we want to keep prefix acquisition history
   # disjoint from current-state-of-tree, due to deaggregation.
 
-  def _RegisterPrefix(self, prefix, date):
-    """Register a prefix as having been allocated. The below
-    is from the python cookbook as a 'map lists to single
-    dict key' recipe, in case we receive two prefixes on
-    the same date. We store both prefix index and date index
-    in the same dict for ease of access."""
-    self.registered_prefixes_by_date.setdefault(date, []).append(prefix)
-    self.registered_prefixes_by_prefix.setdefault(prefix, []).append(date)
+  def _RegisterPrefix(self, prefix, date, party = None):
+    """Register a prefix as having been allocated, on date, by party
+    (default: our address supplier). It goes in the registered ledger,
+    which copes with receiving two prefixes on the same date."""
+    if party == None and self.address_supplier != None:
+      party = self.address_supplier.GetName()
+    self.registered.Append(prefix, date, party)
+
+  # The dicts of lists we used to keep, rebuilt from the ledger on demand.
+  # Prefer the ledger itself where it matters.
+
+  def _RegisteredByDate(self):
+    return self.registered.ByDate()
+  registered_prefixes_by_date = property(_RegisteredByDate)
+
+  def _RegisteredByPrefix(self):
+    return self.registered.ByPrefix()
+  registered_prefixes_by_prefix = property(_RegisteredByPrefix)
+
+  def _FulfilledByDate(self):
+    return self.fulfilled.ByDate()
+  fulfilled_requests_by_date = property(_FulfilledByDate)
+
+  def _FulfilledByPrefix(self):
+    return self.fulfilled.ByPrefix()
+  fulfilled_requests_by_prefix = property(_FulfilledByPrefix)
 
   def _CountRegisteredPrefixes(self):
     """How many prefixes have we registered?"""
-    return len(self.registered_prefixes_by_prefix)
+    return self.registered.Count()
 
   def _RetrieveRegisteredPrefixes(self):
     """What exact prefixes did we receive?"""
@@ -267,10 +461,11 @@ date (%s)" % (prefix, note, used, supplied_date)
 
   def _HaveRegistered(self, prefix):
     """Have I seen this prefix in our list? """
-    for x in self.registered_prefixes_by_prefix:
-      if prefix in x:
-        return True
-    return False
+    return self.registered.Has(prefix)
+
+  def _HaveRegisteredOverlapping(self, prefix):
+    """Have I registered any address in this prefix?"""
+    return self.registered.Overlaps(prefix)
 
   def _RemoveRegisteredPrefix(self, prefix):
     """Never happens... except when it does. FIXME remove _by_date """
@@ -328,55 +523,43 @@ date (%s)" % (prefix, note, used, supplied_date)
       span += IPy.IP(prefix).len()
     return span
 
-  def IETFReservedCount(self):
+  def _KindCount(self, kind):
+    """How many addresses are in prefixes we hold noted as kind, the kind
+    part of the _Note we stored them with."""
     span = 0
-    for prefix in self.tree.IterateNodes(True):
-      if prefix[1] == 'IANA IETF RESERVED':
-        span += IPy.IP(prefix[0]).len()
+    for (prefix, note) in self.tree.IterateNodes(True):
+      if isinstance(note, tuple) and note[2] == kind:
+        span += _Span(prefix)
     return span
 
+  def IETFReservedCount(self):
+    return self._KindCount('IETF RESERVED')
+
   def IANAAssignedCount(self):
-    span = 0
-    for prefix in self.tree.IterateNodes(True):
-      if prefix[1] == 'IANA ASSIGNED':
-        span += IPy.IP(prefix[0]).len()
-    return span
+    return self._KindCount('ASSIGNED')
 
   def IANAVariousCount(self):
-    span = 0
-    for prefix in self.tree.IterateNodes(True):
-      if prefix[1] == 'IANA VARIOUS':
-        span += IPy.IP(prefix[0]).len()
-    return span
-
-  def IANAAssignedCount(self):
-    span = 0
-    for prefix in self.tree.IterateNodes(True):
-      if prefix[1] == 'IANA ASSIGNED':
-        span += IPy.IP(prefix[0]).len()
-    return span
+    return self._KindCount('VARIOUS')
 
   def IANAToRIRCount(self, rir):
-    span = 0
-    for prefix in self.tree.IterateNodes(True):
-      if prefix[1] == 'IANA TO RIR ' + str(rir):
-        span += IPy.IP(prefix[0]).len()
-    return span
+    return self._KindCount('TO RIR ' + str(rir))
 
 class address_supplier(address_holder):
   """Just to make the point that address holders are extensible.."""
 
-  def _FulfillRequest(self, prefix, date):
-    """Record that we have fulfilled a request for this prefix on this date.
+  __slots__ = ()
+
+  def _FulfillRequest(self, prefix, date, party = None):
+    """Record that we have fulfilled a request for this prefix on this date,
+    from party.
     """
-    self.fulfilled_requests_by_date.setdefault(date, []).append(prefix)
-    self.fulfilled_requests_by_prefix.setdefault(prefix, []).append(date)
+    self.fulfilled.Append(prefix, date, party)
 
   # Fulfilled prefixes are those we've given out to others asking.
 
   def _CountFulfilledRequests(self):
     """How many requests have we fulfilled? """
-    return self.fulfilled_requests_by_prefix.len()
+    return self.fulfilled.Count()
 
   def _RetrieveFulfilledRequests(self):
     """Return what prefixes we've given out"""
@@ -384,10 +567,11 @@ class address_supplier(address_holder):
 
   def _HaveGivenOut(self, prefix):
     """Have we given this particular prefix out? """
-    for x in self.fulfilled_requests_by_prefix:
-      if prefix in x:
-        return True
-    return False
+    return self.fulfilled.Has(prefix)
+
+  def _HaveGivenOutOverlapping(self, prefix):
+    """Have we given out any address in this prefix?"""
+    return self.fulfilled.Overlaps(prefix)
 
   # Making a request of us, from <entity> for <size>.
 
@@ -397,66 +581,160 @@ class address_supplier(address_holder):
     allocation size. If we receive a request of _UNSIZED_DEFAULT_REQUEST, we
     substitute our 'default' size. All of these are defined in behaviour object"""
     name = entity.name
-    space = None
+    size = self._ResolveSize(size)
+    self.instrument.ReceiveEvent('REQUEST_SPACE', name, size, self.name)
+    space = self._FindSpace(entity, size)
+    if space == None:
+      self._Exhausted(size)
+      return None
+    self._Allocated(self.SpanForSize(size))
+    self._SetSpaceExhausted(False)
+    return space
+
+  def _ResolveSize(self, size):
+    """Substitute our behaviour's sizes for the unsized requests."""
     if size == constants.defines._UNSIZED_INIT_REQUEST:
       size = self.behaviour.GetInitialSize(self.GetDate())
     elif size == constants.defines._UNSIZED_DEFAULT_REQUEST:
       size = self.behaviour.GetDefaultSize(self.GetDate())
-    self.instrument.ReceiveEvent('REQUEST_SPACE', name, size, self.name)
-    # Important to sort these for principle of least surprise.
+    return size
+
+  def _FindSpace(self, entity, size):
+    """Find and take a block of size size for entity from our IANA prefixes,
+    leaving the address counters to the caller. Returns None if there is
+    no room."""
+    # Important to sort these for principle of least surprise. If no
+    # block has room we know it already, and go straight upstream.
     for prefix in self.iana_prefixes:
+      if not self.CanSatisfy(size):
+        break
+      # Blocks fill up until something in them is removed, when
+      # _RemoveTreePrefix forgets what we knew of them. Until then, one that
+      # had no room for a prefix this long has none for it, or anything
+      # bigger, now either.
+      if size <= self.capacity.get(prefix, 0):
+        continue
       if self.debug >= 2:
         print "lir.addr_supp.request finds gap from (%s)" % prefix
       space = self.tree.FindGapFrom(prefix, size)
-      if space != None:
-        self._FulfillRequest(space, self.GetDate())
-        self.tree.Insert(space, name + self.GetDate())
-        self.address_span += self.SpanForSize(size)
-        self.addresses_used += self.SpanForSize(size)
-        self.instrument.ReceiveEvent('RIR_FREE_SPACE_CHANGE', self,
-                                      self.AddressPercentageLeft(),
-                                      self.GetDate())
-        self.space_exhausted = False
+      if space == None:
+        self.capacity[prefix] = size
+      else:
+        self._FulfillRequest(space, self.GetDate(), entity.name)
+        # The gap may be a whole block of ours, inserted already.
+        self._TreeInsert(space, entity._Note('allocated', self.GetDate()),
+                         test_dup = False)
+        if self.debug >= 2:
+          print "lir.addr_supp.request finds space (%s)" % space
         return space
-    # We've not found free space... so we're exhausted
-    if space == None:
-      if self.debug >= 1:
-        print "lir.addr_supp.request is exhausted at size (%s)" % size
+    return None
+
+  def _Allocated(self, span):
+    """Account for span addresses handed out, and tell the world."""
+    self._Account(span, span)
+    self.instrument.ReceiveEvent('RIR_FREE_SPACE_CHANGE', self,
+                                  self.AddressPercentageLeft(),
+                                  self.GetDate())
+
+  def _Exhausted(self, size):
+    """We've not found free space for a /size... so we're exhausted, and
+    try to get some more from upstream."""
+    if self.debug >= 1:
+      print "lir.addr_supp.request is exhausted at size (%s)" % size
+    self._SetSpaceExhausted(True)
+    # Try to get some more space FIXME
+    if self.address_supplier == None:
+      # Error condition I don't fully understand
+      print "NO ADDRESS SUPPLIER!!"
+      print "I AM ", self.name
+      sys.exit(2)
+    if self.address_supplier.GetSpaceExhausted() != True:
+      new_prefix = self.address_supplier.Request(self, 
+                                                 constants.defines._UNSIZED_DEFAULT_REQUEST)
+      if new_prefix != None:
+        if self.debug >= 1:
+          print "*** New prefix", new_prefix
+        self._AddTreePrefix(new_prefix, 
+                              "OBTAINED FROM [%s] ON [%s]" % (self.address_supplier.GetName(), 
+                                                            self.GetDate()))
+        self._Account(self.PrefixToSpan(new_prefix), 0)
+        self._SetSpaceExhausted(False)
+    else:
+      # FIXME raise something here?
+      # Can't get space from upstream. So just...
       self._SetSpaceExhausted(True)
-      # Try to get some more space FIXME
-      if self.address_supplier == None:
-        # Error condition I don't fully understand
-        print "NO ADDRESS SUPPLIER!!"
-        print "I AM ", self.name
-        sys.exit(2)
-      if self.address_supplier.GetSpaceExhausted() != True:
-        new_prefix = self.address_supplier.Request(self, 
-                                                   constants.defines._UNSIZED_DEFAULT_REQUEST)
-        if new_prefix != None:
-          if self.debug >= 1:
-            print "*** New prefix", new_prefix
-          self._AddTreePrefix(new_prefix, 
-                                "OBTAINED FROM [%s] ON [%s]" % (self.address_supplier.GetName(), 
-                                                              self.GetDate()))
-          self.address_span += self.PrefixToSpan(new_prefix)
-          self.space_exhausted = False
+      self.instrument.ReceiveEvent('RIR_EXHAUSTED', 
+                                    self.name,
+                                    size,
+                                    self.GetDate())
+
+  # Batched requests. Rather than each requester calling Request() in
+  # turn, requests made on one date can be queued and served in a single
+  # sweep at the end of it, in the order _RIR_REQUEST_POLICY says.
+
+  def QueueRequest(self, entity, size, timeline, served):
+    """Queue a request from entity for a block of size size, to be served
+    along with every other request made of us on entity's current date by
+    ServeRequests(). served is called with the prefix, or None, once it
+    has been."""
+    self.request_queue.append((entity, size, served))
+    timeline.RegisterCallbackAtDate(entity.GetDate(),
+                                    [self.ServeRequests],
+                                    (self, 'ServeRequests'))
+
+  def ServeRequests(self, timeline):
+    """Timeline callback serving the queued requests. Sizes are resolved
+    once per kind of request, the address counters and free space event
+    are updated once for the whole sweep, and requesters only hear back
+    once everyone has been served.
+
+    Raises:
+      ValueError if _RIR_REQUEST_POLICY is not fifo, largest or random."""
+    try:
+      current_date = timeline.GetCurrentDate()
+    except:
+      current_date = self.GetDate()
+    self.SetDate(current_date)
+    sizes = dict()
+    queue = []
+    for (entity, size, served) in self.request_queue:
+      if size not in sizes:
+        sizes[size] = self._ResolveSize(size)
+      queue.append((entity, sizes[size], served))
+    self.request_queue = []
+    policy = constants.defines._RIR_REQUEST_POLICY
+    if policy == 'largest':
+      queue.sort(key = lambda request: request[1])  # Shortest length first
+    elif policy == 'random':
+      (self.stream or random).shuffle(queue)
+    elif policy != 'fifo':
+      raise ValueError, "Unknown request policy %s" % policy
+    self.instrument.ReceiveEvent('REQUEST_BATCH', self.name, len(queue),
+                                 current_date)
+    span = 0
+    answers = []
+    for (entity, size, served) in queue:
+      space = self._FindSpace(entity, size)
+      if space == None:
+        self._Exhausted(size)
       else:
-        # FIXME raise something here?
-        # Can't get space from upstream. So just...
-        self._SetSpaceExhausted(True)
-        self.instrument.ReceiveEvent('RIR_EXHAUSTED', 
-                                      self.name,
-                                      size,
-                                      self.GetDate())
-        return None
-    # Hand back the prefix
-    if self.debug >= 2:
-      print "lir.addr_supp.request finds space (%s)" % space
-    return space
+        span += self.SpanForSize(size)
+      answers.append((served, space))
+    if span:
+      self._Allocated(span)
+    # As if they had come one at a time: the last answer says whether
+    # we are exhausted.
+    if answers and answers[-1][1] != None:
+      self._SetSpaceExhausted(False)
+    for (served, space) in answers:
+      served(space)
 
 class iana(address_supplier):
   """IANA is the top level registrar. It has a requesting RIR population - 
   albeit a small one."""
+
+  __slots__ = ('rir_population',)
+
   def __init__( self,
                 supplied_name = "IANA",
                 supplied_date = None, 
@@ -495,13 +773,14 @@ class iana(address_supplier):
                      supplied_date = None,
                      test_dup = True):
     """IANA-specific method for adding tree prefix."""
-    result  =self.tree.Insert(prefix, self.name + " " + note, mark_used = used,
+    result = self._TreeInsert(prefix, self._Note(note, supplied_date),
+                              mark_used = used,
                               test_none = False, test_dup = test_dup)
     if result == False:
       return False
     # Only increase addresses used.
     if used == True:
-      self.addresses_used += IPy.IP(prefix).len()
+      self._Account(0, IPy.IP(prefix).len())
     if supplied_date == None:
       self._RegisterPrefix(prefix, self.GetDate())
     else:
@@ -509,6 +788,16 @@ class iana(address_supplier):
     self.instrument.ReceiveEvent('ADD_PREFIX', self.name, prefix, supplied_date)
     return True
 
+  def _RemoveTreePrefix(self, prefix, used = False, supplied_date = None):
+    """IANA-specific method for removing tree prefix."""
+    if supplied_date == None:
+      supplied_date = self.GetDate()
+    self.registered.Remove(prefix, supplied_date)
+    self._TreeRemove(prefix)
+    if used == True:
+      self._Account(0, -_Span(prefix))
+    return True
+
   def PrintStats(self):
     """Print out a snapshot of our address consumption, etc."""
     # TODO(niallm): should be moved to instrumental model with GUI.
@@ -529,7 +818,7 @@ class iana(address_supplier):
       size = self.behaviour.GetDefaultSize(self.GetDate())
     self.instrument.ReceiveEvent('REQUEST_SPACE', name, size, self.name)
     # Important to sort these for principle of least surprise.
-    if self.space_exhausted != True:
+    if self.space_exhausted != True and self.CanSatisfy(size):
       space = self.tree.FindGap(size)
     else:
       self.instrument.ReceiveEvent('RIR_BLOCKED',
@@ -540,9 +829,10 @@ class iana(address_supplier):
       print "addr_supp.request looking for space size (%s)" % size
     if space != None:
       # We got it! Hooray.
-      self._FulfillRequest(space, self.GetDate())
-      self.tree.Insert(space, name + self.GetDate())
-      self.addresses_used += self.SpanForSize(size)
+      self._FulfillRequest(space, self.GetDate(), name)
+      self._TreeInsert(space, entity._Note('allocated', self.GetDate()),
+                       test_dup = False)
+      self._Account(0, self.SpanForSize(size))
       self.instrument.ReceiveEvent('IANA_FREE_SPACE_CHANGE', self,
                                     self.AddressPercentageLeft(), 
                                     self.GetDate())
@@ -565,6 +855,9 @@ class rir(address_supplier):
       stored in a radix tree. When an RIR is within some determinable 
       limit of running close to exhaustion, this triggers
       a replenishment event with the upstream"""
+
+  __slots__ = ('iana_prefixes', 'capacity', 'request_queue', 'util', 'left')
+
   def __init__(self,
                supplied_name = constants.defines._DEFAULT_RIR_NAME,
                supplied_date = None,
@@ -579,6 +872,11 @@ class rir(address_supplier):
                             supplied_debug)
     # RIR specific initialisation
     self.iana_prefixes = [] # Prefixes we can allocate from, via IANA
+    # Capacity index: the longest prefix length each IANA prefix is known
+    # to have no room for, since we last removed anything from it. Its
+    # largest free block is shorter than that.
+    self.capacity = dict()
+    self.request_queue = [] # Requests to serve today; see QueueRequest
     self.util = dict() # Utilisation percentages per IANA prefix
     self.left = dict() # Addresses left per IANA prefix
     if requested_behaviour != None:
@@ -595,6 +893,7 @@ class rir(address_supplier):
       current_date = self.GetDate()
     if self.debug >= 2:
       print "rir.ActivityCallback called at: [%s]" % current_date
+    key = (self, 'ActivityCallback')
     # Set our clock
     self.SetDate(current_date)
     # For testing purposes, let's print out our stats if the debug level's high enough.
@@ -603,7 +902,8 @@ class rir(address_supplier):
     avail = self.AddressesAvailable()
     # Now invoke behaviour object. 
     (reqsz, ask_again_date) = \
-      self.behaviour.CalculateReqs(avail, self.iana_prefixes, current_date)
+      self._Draw(self.behaviour.CalculateReqs, avail, self.iana_prefixes,
+                 current_date)
     # reqsz can be a list in the new world order
     for elem in reqsz:
       # If reqsz non-zero, request from supplier
@@ -620,27 +920,33 @@ class rir(address_supplier):
                                         current_date)
           # I've failed; whether I try again or not is up to the behaviour
           # module.
-          self.behaviour.Failed(current_date, timeline, [self.ActivityCallback])
+          self._Draw(self.behaviour.Failed, current_date, timeline,
+                     [self.ActivityCallback], key)
         else:
           self._AddTreePrefix(space, "note FIXME", True, self.GetDate())
-    # Register our callback
-    timeline.RegisterCallbackAtDate(ask_again_date, [self.ActivityCallback])
+    # Register our callback; keyed, so this supersedes any retry above.
+    timeline.RegisterCallbackAtDate(ask_again_date, [self.ActivityCallback],
+                                    key)
+
+  def Region(self):
+    """Our own name: an RIR's region is its own."""
+    return self.name
 
   def UpdateStats(self):
     """Update the free versus held per-prefix stats, and the
     total addresses_used versus spanned, etc."""
-    self.address_span = 0
-    self.addresses_used = 0
+    address_span = 0
+    addresses_used = 0
     for prefix in self.iana_prefixes:
-      block_size = IPy.IP(prefix).len()
-      span = 0
-      for thing in self.tree.IterateNodesUnderOnlySupernets(prefix):
-        span += IPy.IP(thing).len()
+      block_size = _Span(prefix)
+      span = self.tree.UsedSpanUnder(prefix)
       putil = span/block_size * 100/1
       self.util[prefix] = putil
       self.left[prefix] = block_size - span
-      self.address_span += block_size
-      self.addresses_used += span
+      address_span += block_size
+      addresses_used += span
+    self._Account(address_span - self.address_span,
+                  addresses_used - self.addresses_used)
 
   def PrintStats(self):
     """Print out a snapshot of our address consumption, etc"""
@@ -662,14 +968,16 @@ class rir(address_supplier):
     if self.debug >= 2:
       print "rir._add_tree_prefix prefix (%s) note (%s) used (%s) supplied \
 date (%s)" % (prefix, note, used, supplied_date)
-    if self.tree.Insert(prefix, self.name + " " + note, mark_used = used,
-                       test_used = True, test_none = False) != False:
+    if self._TreeInsert(prefix, self._Note(note, supplied_date),
+                        mark_used = used, test_used = True,
+                        test_none = False) != False:
       # If it's marked used on reception, we increase both the
       # address span and the used addresses.
-      self.address_span += IPy.IP(prefix).len()
+      span = _Span(prefix)
       if used == True:
-        self.addresses_used += IPy.IP(prefix).len()
+        self._Account(span, span)
       else: # If marked un-used, coming from IANA equiv for allocation
+        self._Account(span, 0)
         self.iana_prefixes.append(prefix)
       if supplied_date == None:
         self._RegisterPrefix(prefix, self.GetDate())
@@ -681,12 +989,31 @@ date (%s)" % (prefix, note, used, supplied_date)
     self.instrument.ReceiveEvent('ADD_PREFIX', self.name, prefix, supplied_date)
     return True
 
+  def _RemoveTreePrefix(self, prefix, used = True, supplied_date = None):
+    """Undo _AddTreePrefix, as address_holder._RemoveTreePrefix does; a
+    block we allocated from is no longer one of our IANA prefixes."""
+    address_holder._RemoveTreePrefix(self, prefix, used, supplied_date)
+    if used != True:
+      self.iana_prefixes.remove(prefix)
+    # Whichever block it was in has room it didn't have before.
+    (network, length) = ledger.ParsePrefix(prefix)
+    for block in self.capacity.keys():
+      (block_network, block_length) = ledger.ParsePrefix(block)
+      shift = 32 - block_length
+      if (length >= block_length and
+          network >> shift == block_network >> shift):
+        del self.capacity[block]
+    return True
+
 class lir(address_supplier):
   """Local Internet Registry (in RIPE terminology.) The folks who deal with
   the customers. LIRs have a customer base, a scaling model (which determines
   how that customer base grows), an internal clock in YYYYMMDD format, and a
   way of keeping track which allocations they have received over time.
   """
+
+  __slots__ = ()
+
   def __init__( self, 
                 supplied_name = constants.defines._DEFAULT_LIR_NAME, 
                 supplied_date = None,
@@ -725,39 +1052,66 @@ class lir(address_supplier):
       current_date = self.GetDate()
     if self.debug >= 2:
       print "lir.ActivityCallback called at: [%s]" % current_date
+    key = (self, 'ActivityCallback')
     # Pip our clock just to be safe
     self.SetDate(current_date)
     # Get our request size and callback re-registration date.
     (reqsz, ask_again_date) = \
-      self.behaviour.CalculateReqs(self.registered_prefixes_by_date.items(), 
-                                   self.GetDate())
+      self._Draw(self.behaviour.CalculateReqs, self.registered.ByDateItems(),
+                 self.GetDate())
     if self.debug >= 2:
         print "lir.ActivityCallback ask_again_day [%s]" % ask_again_day
         print "lir.ActivityCallback len reqsz is [%s]" % len(reqsz)
+    # Requests we are waiting to hear back about; see _Served.
+    batch = [0, ask_again_date]
     # req_sz could be a list in the new world order.
     for elem in reqsz:
       self.instrument.ReceiveEvent('CALC_REQS', self.name, reqsz)
       if elem > 2 ** 8: # FIXME DEFINE AS STATIC
         # What is the closest larger power of two to this?
         len = 32 - int(math.ceil(math.log(elem)/math.log(2)))
-        # Make that the request
-        space = self.address_supplier.Request(self, len)
-        # Success or failure?
-        if space == None:
-          self.instrument.ReceiveEvent('LIR_BLOCKED',
-                                        self.name,
-                                        elem,
-                                        current_date)
-          # I've failed; whether I try again or not is up to the behaviour
-          # module.
-          self.behaviour.Failed(current_date, timeline, [self.ActivityCallback])
+        # Make that the request; batched, we hear back at the end of
+        # the date.
+        if constants.defines._RIR_REQUEST_POLICY != None:
+          batch[0] += 1
+          self.address_supplier.QueueRequest(self, len, timeline,
+                                             functools.partial(self._Served,
+                                                               timeline,
+                                                               current_date,
+                                                               elem, key,
+                                                               batch = batch))
         else:
-          self._AddTreePrefix(space, "note FIXME", True, self.GetDate())
-          # Register our callback
-          timeline.RegisterCallbackAtDate(ask_again_date, [self.ActivityCallback])
+          self._Served(timeline, current_date, elem, key,
+                       self.address_supplier.Request(self, len))
       else:
         # You won't get a /24 or shorter from an RIR. Let's wait until the next
         # time.
         continue
-    # Register our callback
-    timeline.RegisterCallbackAtDate(ask_again_date, [self.ActivityCallback])
+    # Register our callback. It is keyed on us, so there is only ever one
+    # pending, however many requests we made above. If they were batched,
+    # the last answer registers it instead, so that it comes after any
+    # retry the behaviour registered, as it would have unbatched.
+    if batch[0] == 0:
+      timeline.RegisterCallbackAtDate(ask_again_date,
+                                      [self.ActivityCallback], key)
+
+  def _Served(self, timeline, current_date, elem, key, space, batch = None):
+    """Deal with the answer to our request for elem addresses. batch is
+    [answers still to come, ask again date] for a batched request."""
+    # Success or failure?
+    if space == None:
+      self.instrument.ReceiveEvent('LIR_BLOCKED',
+                                    self.name,
+                                    elem,
+                                    current_date)
+      # I've failed; whether I try again or not is up to the behaviour
+      # module.
+      self._Draw(self.behaviour.Failed, current_date, timeline,
+                 [self.ActivityCallback], key)
+    else:
+      self._AddTreePrefix(space, "note FIXME", True, self.GetDate())
+    if batch != None:
+      batch[0] -= 1
+      if batch[0] == 0:
+        timeline.RegisterCallbackAtDate(batch[1], [self.ActivityCallback],
+                                        key)
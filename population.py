@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+population.py - one LIR per organisation, each made only when needed.
+
+The extended delegated format gives each line the opaque id of the
+organisation holding it, so rather than one LIR per country we can have
+one per organisation: tens of thousands of them, most of which will not
+ask for anything for a long while. A Population keeps each organisation
+as a few array entries (its country, its RIR, how many lines it has)
+and its prefixes as rows of parallel arrays:
+
+  orgs      the organisation, as an index into names
+  networks  first address of the prefix as an integer
+  lengths   prefix length
+  days      date as a proleptic Gregorian ordinal
+
+An organisation's lir.lir is only made, and its tree and ledger filled
+in from its rows, when it is first needed: when it is looked up by
+name, or when its first callback is due. Its RIR is given every row as
+it is added, so the RIRs are complete from the start.
+
+Schedule() draws the first callback date of every organisation not yet
+made in one go per RIR (see timeline.CalculatePeriodsLater) and registers
+a single event per RIR and date, Wake(), which makes and calls back
+whoever of the RIR's is due that day. After SeedStreams(), each RIR's
+dates are drawn from a stream of its own, and each LIR made gets one too,
+so a region schedules the same way whether or not the others are there.
+Organisations are made quietly, so what their rows add to their counters
+is not reported as it happens; Seed() adds it all to a stats.Rollup up
+front instead.
+
+LIRs are named country.orgid, in the (country.blah) form of RIPE LIR
+names that address_holder.GetCountry() understands.
+
+Typical use case:
+  sim.FromOrgProcess()
+  print "%s organisations" % len(sim.population)
+  sim.Run()
+"""
+
+import behaviour
+import instrumentation
+import ledger
+import lir
+import stats
+import timeline
+
+import array
+import datetime
+import functools
+import random
+
+class Population(object):
+  """The organisations of an extended delegated file, and their rows."""
+
+  def __init__(self, lir_behave = None):
+    self.world = None  # The simulation LIRs are made in; see Attach
+    self.quiet = None  # Event processor LIRs are filled in with
+    self.behave = lir_behave  # Behaviour spec for the LIRs we make
+    self.registry = None  # If set, only its organisations are scheduled
+    self.names = []  # LIR name per organisation
+    self.ids = dict()  # Opaque organisation id to index into names
+    self.strings = []  # Countries and RIR names
+    self.string_ids = dict()
+    self.countries = array.array('l')  # Per organisation, into strings
+    self.registries = array.array('l')  # Per organisation, into strings
+    self.lines = array.array('l')  # Per organisation
+    self.orgs = array.array('l')  # Per row
+    self.networks = array.array('L')
+    self.lengths = array.array('B')
+    self.days = array.array('l')
+    self.grouped = None  # See _Grouped
+    self.due = dict()  # (RIR name, day ordinal) to organisations to wake
+    self.seed = None  # Master seed for streams; see SeedStreams
+
+  def __len__(self):
+    return len(self.names)
+
+  def __getstate__(self):
+    state = self.__dict__.copy()
+    for name in ('world', 'quiet', 'grouped'):
+      state[name] = None
+    return state
+
+  def Attach(self, world):
+    """Make our LIRs in, and enrol them with, simulation world."""
+    self.world = world
+
+  def SeedStreams(self, master_seed):
+    """Draw wakes, and have the LIRs we make draw, from streams derived
+    from master_seed, as simulation.SeedStreams does for made holders."""
+    self.seed = master_seed
+
+  def _Stream(self, name):
+    """A fresh stream for name, or None if we haven't been seeded."""
+    if self.seed is None:
+      return None
+    return timeline.Stream(timeline.StreamSeed(self.seed, name))
+
+  def _Intern(self, string):
+    string_id = self.string_ids.get(string)
+    if string_id is None:
+      string_id = len(self.strings)
+      self.strings.append(string)
+      self.string_ids[string] = string_id
+    return string_id
+
+  def Add(self, org, country, registry, start, plen, date, first):
+    """Add a delegated.Parse() style row for organisation id org. The
+    LIR is named for the country of the organisation's first row; its
+    RIR is that of its last.
+
+    Returns:
+      the organisation's index."""
+    number = self.ids.get(org)
+    if number is None:
+      number = len(self.names)
+      self.ids[org] = number
+      self.names.append("%s.%s" % (country, org))
+      self.countries.append(self._Intern(country))
+      self.registries.append(0)
+      self.lines.append(0)
+    self.registries[number] = self._Intern(registry)
+    self.lines[number] += first
+    self.orgs.append(number)
+    self.networks.append(start)
+    self.lengths.append(plen)
+    self.days.append(ledger.DayOrdinal(date))
+    self.grouped = None
+    return number
+
+  def Made(self, number):
+    """Has organisation number's LIR been made?"""
+    return self.names[number] in self.world.lirs
+
+  def _Grouped(self):
+    """(offsets, rows): rows[offsets[n]:offsets[n + 1]] are the rows of
+    organisation n, in the order they were added. Counted out in two
+    passes over the rows the first time they are needed after an Add."""
+    if self.grouped is None:
+      offsets = array.array('l', [0]) * (len(self.names) + 1)
+      for number in self.orgs:
+        offsets[number + 1] += 1
+      for number in xrange(len(self.names)):
+        offsets[number + 1] += offsets[number]
+      fill = array.array('l', offsets)
+      rows = array.array('l', [0]) * len(self.orgs)
+      for row in xrange(len(self.orgs)):
+        number = self.orgs[row]
+        rows[fill[number]] = row
+        fill[number] += 1
+      self.grouped = (offsets, rows)
+    return self.grouped
+
+  def Materialise(self, number, supplied_date = None):
+    """Organisation number's LIR, made (with supplied_date as its date,
+    default today) and enrolled with the world if it hasn't been yet."""
+    world = self.world
+    name = self.names[number]
+    props = world.lirs.get(name)
+    if props != None:
+      return props['obj']
+    supplier = world.GetRIRByName(self.strings[self.registries[number]])
+    if self.quiet is None:
+      self.quiet = instrumentation.event_processor(verbosity = 0)
+    new_lir = lir.lir(supplied_name = name,
+                      supplied_date = supplied_date,
+                      supplied_inst = self.quiet,
+                      supplied_debug = world.debug)
+    new_lir.address_supplier = supplier
+    new_lir.stream = self._Stream(name)
+    if self.behave != None:
+      new_lir.behaviour = behaviour.Shared(self.behave)
+    (offsets, rows) = self._Grouped()
+    for row in rows[offsets[number]:offsets[number + 1]]:
+      new_lir._AddTreePrefix(ledger.SpellPrefix(self.networks[row],
+                                                self.lengths[row]),
+                             "sim.from_rir_process", True,
+                             ledger.OrdinalDate(self.days[row]))
+    # Without a shared event processor, use the RIR's, which a run is
+    # already listening to.
+    new_lir.instrument = world.instrument
+    if new_lir.instrument == None:
+      new_lir.instrument = supplier.instrument
+    world.Enrol(new_lir)
+    world.lirs[name] = {'obj': new_lir, 'count': self.lines[number]}
+    return new_lir
+
+  def Lookup(self, name):
+    """The LIR called name, made if need be, or None if there is no such
+    organisation."""
+    (country, dot, org) = name.partition('.')
+    number = self.ids.get(org)
+    if number is None or self.names[number] != name:
+      return None
+    return self.Materialise(number)
+
+  def Seed(self, rollup):
+    """Count what the organisations not yet made hold in a stats.Rollup,
+    once, as Rollup.Seed() does for holders."""
+    made = [self.Made(number) for number in xrange(len(self.names))]
+    spans = dict()  # (registry, country) to addresses
+    for row in xrange(len(self.orgs)):
+      number = self.orgs[row]
+      if not made[number]:
+        key = (self.registries[number], self.countries[number])
+        spans[key] = spans.get(key, 0) + (1 << (32 - self.lengths[row]))
+    for ((registry, country), span) in spans.items():
+      rollup.AddToGroups(stats.LIRGroups(self.strings[registry],
+                                         self.strings[country]),
+                         span, span)
+
+  def Schedule(self, supplied_timeline, supplied_date = None, upperbound = 6,
+               registry = None):
+    """Register the first callback of every organisation not yet made,
+    each 1 to upperbound days after supplied_date: by default the
+    timeline's current date, or failing that today, which is where an
+    LIR's own first callback would fall.
+
+    Only registry's organisations are scheduled if it (or failing that
+    our own registry) is set; otherwise every RIR's are, in name order.
+    Each RIR's dates are drawn together, from a generator seeded from its
+    stream (or from random, unseeded) so seeded runs repeat, and each gets
+    one event however many of its organisations are due on it.
+
+    Returns:
+      how many organisations were scheduled."""
+    if supplied_date is None:
+      try:
+        supplied_date = supplied_timeline.GetCurrentDate()
+      except AttributeError:
+        supplied_date = datetime.date.today().strftime("%Y%m%d")
+    if registry is None:
+      registry = self.registry
+    waiting = dict()  # RIR name to its organisations
+    for number in xrange(len(self.names)):
+      name = self.strings[self.registries[number]]
+      if (registry is None or name == registry) and not self.Made(number):
+        waiting.setdefault(name, array.array('l')).append(number)
+    for key in self.due.keys():
+      if registry is None or key[0] == registry:
+        del self.due[key]
+    day = ledger.DayOrdinal(supplied_date)
+    for name in sorted(waiting.keys()):
+      numbers = waiting[name]
+      draw = self._Stream("population.%s" % name) or random
+      if timeline.numpy is not None:
+        jitter = timeline.JitterSource(draw.randint(0, 2 ** 31 - 1),
+                                       upperbound)
+        wakes = timeline.CalculatePeriodsLater([day] * len(numbers), 0,
+                                               jitter).tolist()
+      else:
+        wakes = [day + draw.randint(1, upperbound) for number in numbers]
+      for (number, wake) in zip(numbers, wakes):
+        due = self.due.get((name, wake))
+        if due is None:
+          due = self.due[(name, wake)] = array.array('l')
+        due.append(number)
+      for wake in sorted(set(wakes)):
+        supplied_timeline.RegisterCallbackAtDate(
+          ledger.OrdinalDate(wake),
+          [functools.partial(self.Wake, registry = name)],
+          (self, 'Wake', wake, name))
+    return sum([len(numbers) for numbers in waiting.values()])
+
+  def Wake(self, supplied_timeline, registry = None):
+    """Timeline callback: make registry's organisations due today, and
+    give each its first ActivityCallback."""
+    current_date = supplied_timeline.GetCurrentDate()
+    for number in self.due.pop((registry, ledger.DayOrdinal(current_date)),
+                               ()):
+      new_lir = self.Materialise(number, current_date)
+      new_lir.ActivityCallback(supplied_timeline)
@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+shard.py - run a timelined simulation with one process per RIR.
+
+RIR regions only interact through requests to the IANA. In sharded mode
+each RIR, together with the LIRs it supplies and a timeline of its own,
+runs in a separate worker process, and the IANA lives in a coordinating
+process which serves its allocations over queues.
+
+Shards are kept in step conservatively: the coordinator finds the earliest
+date any shard has work for, lets every shard with work on that date
+process it, and only moves on once they have all finished it. Requests to
+the IANA made on the same date (and questions about whether it is
+exhausted) are served one at a time, and only once every shard still
+working on that date is either blocked on one or done; the lowest-named
+RIR goes first.
+
+That is the order a single-process run asks in too: its timeline walks
+each date a region at a time, in RIR name order (see
+simulation.EventRegion), and every entity draws from a random stream of
+its own, seeded from the master seed and its name (see
+simulation.SeedStreams). So a sharded run gives the same exhaustion
+dates, allocations and series as ensemble.RunSeeded() with that seed,
+whatever the process scheduling.
+
+Typical use case:
+  ./shard.py --seed 42
+"""
+
+import constants
+import instrumentation
+import simulation
+import timeline
+
+import getopt
+import multiprocessing
+import random
+import sys
+import traceback
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+# The loaded world, inherited by forked shards; see RunSharded.
+_WORLD = None
+
+class IANAProxy(object):
+  """Stands in for the IANA inside a shard, forwarding Requests, and
+  questions about exhaustion, to the coordinator. Only what RIRs and
+  timelined.Run ask of the IANA is here."""
+  def __init__(self, shard, requests, replies):
+    self.name = "IANA"
+    self.shard = shard
+    self.requests = requests
+    self.replies = replies
+    self.space_exhausted = False
+    self.percentage_left = 100
+
+  def Update(self, state):
+    """Take on the IANA state the coordinator sent us."""
+    (self.space_exhausted, self.percentage_left) = state
+
+  def Request(self, entity, size):
+    """Ask the coordinator for space, and wait for the answer."""
+    self.requests.put(('REQUEST', self.shard, size))
+    (kind, prefix, state) = self.replies.get()
+    self.Update(state)
+    return prefix
+
+  def GetSpaceExhausted(self, size = 0):
+    """Whether the IANA is exhausted. Once it is, it stays so; until then
+    other regions may be using it up, so we wait our turn to ask."""
+    if not self.space_exhausted:
+      self.requests.put(('REQUEST', self.shard, None))
+      (kind, prefix, state) = self.replies.get()
+      self.Update(state)
+    return self.space_exhausted
+
+  def AddressPercentageLeft(self):
+    return self.percentage_left
+
+  def GetName(self):
+    return self.name
+
+  def SetDate(self, supplied_date):
+    pass
+
+def _IANAState(iana):
+  return (iana.GetSpaceExhausted(), iana.AddressPercentageLeft())
+
+def _NextDate(sim):
+  """The first date this shard's (streaming) timeline has work for."""
+  if sim.timeline.head == None:
+    return None
+  return sim.timeline.head.date
+
+def _CutDownWorld(sim, name, requests, replies):
+  """Turn a forked copy of the world into a single region."""
+  rir = sim.GetRIRByName(name)
+  sim.rirs = {name: sim.rirs[name]}
+  lirs = dict()
+  for (lir_name, props) in sim.lirs.items():
+    if props['obj'].address_supplier is rir:
+      lirs[lir_name] = props
+  sim.lirs = lirs
+  if sim.population != None:
+    sim.population.registry = name
+  sim.iana = rir.address_supplier = IANAProxy(name, requests, replies)
+  sim.timeline = timeline.Timeline(supplied_debug = sim.debug,
+                                   instrumentation = sim.instrument,
+                                   streaming = True,
+                                   archive = False,
+                                   rank = simulation.EventRegion)
+  sim.result = None
+  return sim
+
+def _ShardMain(name, master_seed, requests, replies, lir_behave,
+               rir_behave):
+  """Shard process: set up one region, then run dates as instructed."""
+  try:
+    sim = _CutDownWorld(_WORLD, name, requests, replies)
+    random.seed(master_seed)
+    if numpy is not None:
+      numpy.random.seed(master_seed)
+    sim.SeedStreams(master_seed)
+    sim.Setup(lir_behave, rir_behave)
+    # How the RIR stands before anything is walked; see RunSharded.
+    rir = sim.GetRIRByName(name)
+    requests.put(('READY', name, _NextDate(sim),
+                  (rir.GetSpaceExhausted(), rir.AddressPercentageLeft())))
+    while True:
+      message = replies.get()
+      if message[0] == 'STOP':
+        requests.put(('RESULT', name, sim.result))
+        return
+      (kind, date, state) = message
+      sim.iana.Update(state)
+      try:
+        sim.Run(until = date, stop_condition = None)
+        next_date = _NextDate(sim)
+      except ValueError:
+        # Something wanted to schedule past _YEAR_MAX_END; we're done.
+        sim.result.stopped_by = 'horizon'
+        next_date = None
+      requests.put(('DONE', name, next_date,
+                    dict(sim.result.exhaustion_dates)))
+  except Exception:
+    requests.put(('ERROR', name, traceback.format_exc()))
+
+def RunSharded(world, master_seed = 0, until = None, lir_behave = None,
+               rir_behave = None,
+               stop_condition = simulation.AllRIRsExhausted):
+  """Run world with one process per RIR, the IANA served from here.
+
+  Args:
+    world: a loaded but not yet started simulation.timelined. Its IANA
+      is the one allocations are made from, so it is changed by the run.
+    master_seed: seed from which every entity's stream is derived.
+    until: optional YYYYMMDD date at which to stop.
+    lir_behave, rir_behave: behaviour overrides, as for timelined.Run.
+    stop_condition: callable(world, result), checked between dates.
+
+  Returns:
+    a simulation.RunResult for the whole world.
+
+  Raises:
+    RuntimeError if a shard fails."""
+  global _WORLD
+  _WORLD = world
+  names = world.GetRIRNames()
+  result = simulation.RunResult()
+  requests = multiprocessing.Queue()
+  replies = dict([(name, multiprocessing.Queue()) for name in names])
+  shards = []
+  for name in names:
+    shard = multiprocessing.Process(target = _ShardMain,
+                                    args = (name, master_seed, requests,
+                                            replies[name], lir_behave,
+                                            rir_behave))
+    shard.start()
+    shards.append(shard)
+  _WORLD = None
+  failure = None
+  next_dates = dict()
+  # Each RIR as its shard set it up: (exhausted, percentage free). A
+  # single-process run sees them on its first date, whichever region
+  # has work then.
+  set_up = dict()
+  def Serve(running):
+    """Field messages until running shards have reported DONE, serving
+    IANA requests deterministically on the way."""
+    waiting = dict()
+    while running:
+      message = requests.get()
+      if message[0] == 'ERROR':
+        raise RuntimeError, "shard %s failed:\n%s" % (message[1], message[2])
+      elif message[0] == 'REQUEST':
+        (kind, name, size) = message
+        waiting[name] = size
+      else:
+        (kind, name, next_date, reported) = message
+        next_dates[name] = next_date
+        if kind == 'READY':
+          set_up[name] = reported
+        else:
+          for (entity, exhausted_on) in reported.items():
+            if entity != 'iana':
+              result.exhaustion_dates.setdefault(entity, exhausted_on)
+        running -= 1
+      # Only serve the IANA once nobody else can still ask on this date.
+      if waiting and len(waiting) == running:
+        name = min(waiting.keys())
+        size = waiting.pop(name)
+        prefix = None
+        if size != None:  # None only asks after the IANA's state
+          prefix = world.iana.Request(world.GetRIRByName(name), size)
+        replies[name].put(('GRANT', prefix, _IANAState(world.iana)))
+  try:
+    # Every shard reports in once it has set up, which may involve the
+    # RIR asking the IANA for space.
+    Serve(len(names))
+    while True:
+      dates = [d for d in next_dates.values() if d != None]
+      if not dates:
+        result.stopped_by = 'timeline'
+        break
+      date = min(dates)
+      if until != None and date > until:
+        result.stopped_by = 'until'
+        break
+      if stop_condition != None and stop_condition(world, result):
+        if stop_condition == simulation.AllRIRsExhausted:
+          result.stopped_by = 'exhaustion'
+        else:
+          result.stopped_by = 'stop_condition'
+        break
+      world.iana.SetDate(date)
+      if result.start_date == None:
+        result.start_date = date
+        for (name, (exhausted, percentage)) in set_up.items():
+          if exhausted:
+            result.exhaustion_dates[name] = date
+      result.counters['dates'] += 1
+      active = [name for name in names if next_dates[name] == date]
+      for name in active:
+        replies[name].put(('RUN', date, _IANAState(world.iana)))
+      Serve(len(active))
+      result._Record('iana', date, world.iana.AddressPercentageLeft())
+      if world.iana.AddressPercentageLeft() <= 0.0 and \
+            'iana' not in result.exhaustion_dates:
+        result.exhaustion_dates['iana'] = date
+      result.end_date = date
+  except:
+    failure = sys.exc_info()
+  # Collect the shards' own results, then tidy up.
+  if failure == None:
+    for name in names:
+      replies[name].put(('STOP',))
+    for i in range(len(names)):
+      (kind, name, shard_result) = requests.get()
+      # A shard starts its series on its own first date; a single-process
+      # run starts everyone's on the first date of all.
+      series = shard_result.series.get(name, [])
+      if result.start_date != None and \
+            (not series or series[0][0] != result.start_date):
+        result._Record(name, result.start_date, set_up[name][1])
+      for (date, percentage) in series:
+        result._Record(name, date, percentage)
+      result.counters['callbacks'] += shard_result.counters['callbacks']
+  for shard in shards:
+    if failure != None:
+      shard.terminate()
+    shard.join()
+  if failure != None:
+    raise failure[0], failure[1], failure[2]
+  return result
+
+def Usage():
+  """Instructions for usage."""
+  print "Run an address allocation simulation with one process per RIR."
+  print
+  print "--help: this help"
+  print "--seed: master seed from which every entity's stream is derived (default 0)"
+  print "--until: stop at this YYYYMMDD date"
+  print "--checkpoint: generate or use a previously generated checkpoint file"
+  print "--lir_behave: select a particular kind of LIR behaviour from available classes"
+  print "--rir_behave: select a particular kind of RIR behaviour from available classes"
+  print "--debug: set integer debug level"
+
+if __name__ == '__main__':
+  try:
+    opts, args = getopt.getopt(sys.argv[1:], "hs:u:cl:r:d:", ["help",
+                               "seed=",
+                               "until=",
+                               "checkpoint",
+                               "lir_behave=",
+                               "rir_behave=",
+                               "debug="])
+  except getopt.GetoptError:
+    Usage()
+    sys.exit(2)
+  master_seed = 0
+  until = None
+  cp = False
+  cur_debug = 0
+  lir_behave = constants.defines._DEFAULT_LIR_BEHAVIOUR
+  rir_behave = constants.defines._DEFAULT_RIR_BEHAVIOUR
+  for opt, arg in opts:
+    if opt in ("-h", "--help"):
+      Usage()
+      sys.exit()
+    elif opt in ("-s", "--seed"):
+      master_seed = int(arg)
+    elif opt in ("-u", "--until"):
+      until = arg
+    elif opt in ("-c", "--checkpoint"):
+      cp = True
+    elif opt in ("-l", "--lir_behave"):
+      lir_behave = arg
+    elif opt in ("-r", "--rir_behave"):
+      rir_behave = arg
+    elif opt in ("-d", "--debug"):
+      cur_debug = int(arg)
+  eventp = instrumentation.event_processor()
+  world = simulation.timelined(supplied_debug = cur_debug,
+                               supplied_inst = eventp)
+  world.LoadStartupWorld(lir_behave, rir_behave, cp)
+  result = RunSharded(world, master_seed, until, lir_behave, rir_behave)
+  print "Run ended [%s] at [%s]" % (result.stopped_by, result.end_date)
+  print result.exhaustion_dates
@@ -15,15 +15,19 @@ Created by Niall Murphy on 2007-08-28.
 """
 
 import behaviour
+import checkpoint
 import constants
+import delegated
+import ingest
 import instrumentation
 import lir
+import population
+import stats
 import timeline
 
 
 import cPickle
 import datetime
-import fileinput
 import IPy
 import getopt
 import math
@@ -32,6 +36,33 @@ import re
 import string
 import sys
 
+def EventRegion(key):
+  """Timeline rank of an event keyed (entity, action, ...): the region of
+  the holder it is for, or of the population's organisations it wakes.
+  Each date is walked a region at a time, as a sharded run does; see
+  shard.py."""
+  entity = key[0]
+  if isinstance(entity, lir.address_holder):
+    return entity.Region()
+  if isinstance(entity, population.Population):
+    return key[3]
+  return None
+
+class _Unstarted(object):
+  """The timeline as Setup shows it to the holders' first callbacks: theirs
+  to register on, but with no current date yet, so that each goes by its
+  own clock rather than by whatever someone set up before it registered
+  first. That would depend on who went first, and a shard only sets up
+  its own region."""
+  def __init__(self, supplied_timeline):
+    self.timeline = supplied_timeline
+
+  def GetCurrentDate(self):
+    raise AttributeError, "The timeline has not started"
+
+  def __getattr__(self, name):
+    return getattr(self.timeline, name)
+
 class simulation:
   """ The simulation class wraps creation of IANA, RIRs and LIRs in an
     extendable way.
@@ -41,16 +72,66 @@ class simulation:
   a debug setting, an instrumentation object, and a timeline.
 
   The RIRs look like this: rirs{'ripencc': {'count': 20, 'obj': <objectref> }}
-  and similarly for the LIRs.
+  and similarly for the LIRs. Every holder is also enrolled under a
+  dense integer id: holders[id] is the holder with that id. A world
+  read with one LIR per organisation (see FromOrgProcess) also has a
+  population.Population, whose LIRs join lirs as they are needed.
   """
   def __init__(self, supplied_debug = 0, supplied_inst = None):
     self.iana = lir.iana(supplied_inst = supplied_inst)
     self.rirs = dict()
     self.lirs = dict()
+    self.holders = []  # Indexed by holder id; see Enrol
+    self.Enrol(self.iana)
     self.debug = supplied_debug
     self.instrument = supplied_inst
-    self.timeline = timeline.Timeline(supplied_debug = supplied_debug,
-                                      instrumentation = supplied_inst)
+    self.result = None  # RunResult of the current timelined.Run()
+    self.applied = None  # Delegated lines we were built from; see ingest.py
+    self.population = None  # LIRs per organisation; see FromOrgProcess
+    self.timeline = timeline.Timeline(
+      supplied_debug = supplied_debug,
+      instrumentation = supplied_inst,
+      streaming = constants.defines._TIMELINE_STREAMING,
+      archive = constants.defines._TIMELINE_ARCHIVE,
+      rank = EventRegion)
+
+  def Enrol(self, holder):
+    """Give holder the next id, and return it."""
+    holder.id = len(self.holders)
+    self.holders.append(holder)
+    return holder
+
+  def SeedStreams(self, master_seed):
+    """Give the IANA, every RIR and LIR, and the LIRs the population has
+    yet to make, a random stream of their own, seeded from master_seed and
+    their name. What an entity draws then depends only on the master seed
+    and what it does itself, not on who else is in the world."""
+    for holder in [self.iana] + list(self.GetRIRs()) + list(self.GetLIRs()):
+      holder.stream = timeline.Stream(timeline.StreamSeed(master_seed,
+                                                          holder.name))
+    if self.population != None:
+      self.population.SeedStreams(master_seed)
+
+  def GetHolder(self, holder_id):
+    """Given a holder id, return a reference to the holder."""
+    return self.holders[holder_id]
+
+  def ReindexHolders(self):
+    """Rebuild holders from the IANA, RIRs and LIRs, once they have been
+    replaced wholesale (by reading a checkpoint, say). Holders keep their
+    ids; any without one, from before there were ids, are enrolled."""
+    everyone = [self.iana] + \
+      [self.rirs[name]['obj'] for name in sorted(self.rirs.keys())] + \
+      [self.lirs[name]['obj'] for name in sorted(self.lirs.keys())]
+    size = max([holder.id for holder in everyone if holder.id != None] +
+               [-1]) + 1
+    self.holders = [None] * size
+    for holder in everyone:
+      if holder.id != None:
+        self.holders[holder.id] = holder
+    for holder in everyone:
+      if holder.id == None:
+        self.Enrol(holder)
 
   def GetRIRByName(self, supplied_name):
     """Given an RIR name, return a reference to the object."""
@@ -61,8 +142,11 @@ class simulation:
       return None
 
   def GetLIRByName(self, supplied_name):
-    """Given an LIR name, return a reference to the object."""
+    """Given an LIR name, return a reference to the object, making it
+    first if it belongs to an organisation that hasn't needed it yet."""
     ref = self.lirs.get(supplied_name, None)
+    if ref == None and self.population != None:
+      return self.population.Lookup(supplied_name)
     try:
       return ref['obj']
     except:
@@ -106,94 +190,71 @@ class simulation:
     return population
 
 
-  def FromIANAProcess(self, filename = "data/delegated-iana-latest",
+  def FromIANAProcess(self, filename = constants.defines._IANA_DATA,
                         lir_behave = None, rir_behave = None):
     """ Read in the historical data from Geoff/RIR-aggregate file;
     use this to populate our IANA and RIR objects. """
-    linecount = 0
-    non_v4 = 0
-    iana_count = 0
-    alloc = dict()
-    rolling_total = 0
-
-    for line in fileinput.input(filename):
-      if line.startswith("#"):  # Quick way to comment out non-conforming records
-        continue
-      if self.debug >= 2:
-        print "sim.from_iana.line: ", line.rstrip()
-
-      linecount += 1
-      elements = line.split('|')
-      if line.startswith("2"):  # Ignore status lines
-        continue
-      if len(elements) == 6:  # Same again
-        continue
-      else:
-        alloc['assigning_entity'] = elements[0]
-        alloc['country'] = elements[1]
-        alloc['addr_type'] = elements[2]
-        alloc['prefix'] = elements[3]
-        alloc['size'] = elements[4]
-        alloc['date'] = elements[5]
-        alloc['status'] = elements[6].rstrip()
-
-      # Handy aliases.
-      assigner = alloc['assigning_entity']
-      assignee = alloc['status']
+    counts = dict()
+    iana_count = self.ApplyIANARecords(delegated.ParseFile(filename,
+                                                           counts = counts),
+                                       rir_behave)
+    # Report act
+    if self.debug >= 1:
+      print "sim.from_iana_process: finished reading file (%s)" % filename
+      print "Read (%s) lines, found (%s) non-ipv4 records, (%s) RIRs, and\n\
+(%s) IANA-based assignments." % (counts['lines'], counts['skipped'],
+                                 len(self.rirs.keys()), iana_count)
 
+  def ApplyIANARecords(self, records, rir_behave = None):
+    """Populate our IANA and RIR objects from delegated.Parse() style
+    tuples. Returns the number of IANA assignments (lines) seen."""
+    iana_count = 0
+    for (assigner, country, status, start, plen, date, first) in records:
       # For the immediate purposes of this routine, we're interested
       # in IANA IPv4 assignments to RIRs or end users only.
-      if alloc['addr_type'] != "ipv4" or assigner != 'iana':
-        non_v4 += 1
+      if assigner != 'iana':
         continue
-      else:
+      prefix = delegated.PrefixString(start, plen)
+      if first:
         iana_count += 1
-        # Convert assignment to CIDR.
-        amount = int(alloc['size'])
-        array = self.DecomposeAmountToPrefixes(amount)
-        if len(array) > 1 and self.debug >= 2:
-          print "sim.from_iana_process decomposes to [%s] POWERS FOR [%s]" % (len(array), alloc['prefix'])
-        prefixes = self.ProvideSeriesFromPrefixesAndLengths(alloc['prefix'], array)
-
-        if (alloc['status'] not in ['assigned', 'ietf', 'various']):
-          # We now have an RIR as assignee. Create it and add the prefix,
-          # marked as used in the iana.
-          rir = self.CreateRIRIfNotSeen(alloc['status'],
-                                        self.instrument,
-                                        rir_behave)
-          # Insert them as *unused* because we want to allocate from them.
-          for elem in prefixes:
-            rir._AddTreePrefix(elem, "TO RIR %s" % assignee,
-                                 False, alloc['date'])
-            self.iana._AddTreePrefix(elem, "TO RIR %s" % assignee,
-                                       True, alloc['date'])
-          rir.address_supplier = self.iana
-        elif (alloc['status'] == 'ietf'):
-          # If it's an IETF assignment we have to mark it used (unusable in theory)
-          for elem in prefixes:
-            self.iana._AddTreePrefix(elem, "IETF RESERVED", True, alloc['date'])
-        elif (alloc['status'] == 'assigned'):
-          # If it's assigned or various, it could be in one of many actual states,
-          # but for the purposes of this simulation we'll declare it used too.
-          for elem in prefixes:
-            self.iana._AddTreePrefix(elem, "ASSIGNED", True, alloc['date'])
-        elif (alloc['status'] == 'various'):
-          for elem in prefixes:
-            self.iana._AddTreePrefix(elem, "VARIOUS", True, alloc['date'])
-        else:
-          for elem in prefixes:
-            self.iana._AddTreePrefix(elem, "RESERVED", True, alloc['date'])
-      # Progress meter
-      if linecount % 100 == 0:
-        sys.stdout.write(".")
-    # We've read all the lines in the file; now tidy-up work
-    # Report act
-    if self.debug >= 1:
-      print "sim.from_iana_process: finished reading file (%s)" % filename
-      print "Read (%s) lines, found (%s) non-ipv4 records, (%s) RIRs, and\n\
-(%s) IANA-based assignments." % (linecount, non_v4, len(self.rirs.keys()),
-                                 iana_count)
+        if self.debug >= 2:
+          print "sim.from_iana_process: [%s] [%s] [%s]" % (prefix, date,
+                                                           status)
+      if (status not in ['assigned', 'ietf', 'various']):
+        # We now have an RIR as assignee. Create it and add the prefix,
+        # marked as used in the iana.
+        if first:
+          rir = self.CreateRIRIfNotSeen(status, self.instrument, rir_behave)
+        # Insert them as *unused* because we want to allocate from them.
+        rir._AddTreePrefix(prefix, "TO RIR %s" % status, False, date)
+        self.iana._AddTreePrefix(prefix, "TO RIR %s" % status, True, date)
+        rir.address_supplier = self.iana
+      elif (status == 'ietf'):
+        # If it's an IETF assignment we have to mark it used (unusable in theory)
+        self.iana._AddTreePrefix(prefix, "IETF RESERVED", True, date)
+      elif (status == 'assigned'):
+        # If it's assigned or various, it could be in one of many actual states,
+        # but for the purposes of this simulation we'll declare it used too.
+        self.iana._AddTreePrefix(prefix, "ASSIGNED", True, date)
+      else:
+        self.iana._AddTreePrefix(prefix, "VARIOUS", True, date)
+    return iana_count
 
+  def WithdrawIANARecords(self, records):
+    """Undo ApplyIANARecords for delegated.Parse() style tuples it was
+    given before. RIRs are kept, even with nothing left.
+
+    Raises:
+      KeyError if a record was never applied."""
+    for (assigner, country, status, start, plen, date, first) in records:
+      if assigner != 'iana':
+        continue
+      prefix = delegated.PrefixString(start, plen)
+      if status not in ['assigned', 'ietf', 'various']:
+        if first:
+          self.rirs[status]['count'] -= 1
+        self.GetRIRByName(status)._RemoveTreePrefix(prefix, False, date)
+      self.iana._RemoveTreePrefix(prefix, True, date)
 
   def FromRIRProcess(self, filename = constants.defines._NRO_DATA,
                        lir_behave = None, rir_behave = None):
@@ -209,110 +270,127 @@ class simulation:
     lacnic|MX|ipv4|204.126.140.0|512|19950114|assigned
 
     """
-    # Counters and useful dictionaries.
-    non_v4 = 0
-    rir_names = dict()
-    lir_names = dict()
-    iana_activity = dict()
-    array = []
+    counts = dict()
+    # If the date is unknown ("00000000") then for the purposes
+    # of simulation, we set it to a known constant.
+    records = delegated.ParseFile(filename,
+                                  constants.defines._DEFAULT_NON_ZERO_DATE,
+                                  counts)
+    iana_count = self.ApplyRIRRecords(records, lir_behave, rir_behave)
+    # Activity report
+    if self.debug >= 1:
+      print "sim.from_rir_process: finished reading file (%s)" % filename
+      print "Read (%s) lines, found (%s) non-ipv4 records, (%s) RIRs, \n\
+(%s) IANA-based assignments, and (%s) LIR equivalents." % (counts['lines'],
+                                                           counts['skipped'],
+                                                           len(self.rirs.keys()),
+                                                           iana_count,
+                                                           len(self.lirs.keys()))
+
+  def ApplyRIRRecords(self, records, lir_behave = None, rir_behave = None):
+    """Populate our RIR and LIR objects from delegated.Parse() style
+    tuples, mapping each country to an LIR. Returns the number of IANA
+    assignments (lines) seen, which are left to ApplyIANARecords."""
     iana_count = 0
-    count = 0
-
-    # Info about the individual allocation we're looking at.
-    alloc = dict()
-
-    for line in fileinput.input(filename):
-      # Progress metre
-      if count % 100 == 0:
-        sys.stdout.write(".")
-        sys.stdout.flush()
-      if line.startswith("#"): # Quick way to comment out non-conforming records
-        continue
-      if self.debug >= 10:
-        print "sim.from_rir.line: ", line.rstrip()
-      count += 1
-      elements = line.split('|')
-      if len(elements) == 7:
-        alloc['assigning_entity'] = elements[0]
-        alloc['country'] = elements[1]
-        alloc['addr_type'] = elements[2]
-        alloc['prefix'] = elements[3]
-        alloc['size'] = elements[4]
-        alloc['date'] = elements[5]
-        alloc['status'] = elements[6].rstrip()
-      else:
+    the_rir = None
+    the_lir = None
+    for (assigner, assignee, status, start, plen, date, first) in records:
+      # If we have an assigner of iana, this is from IANA to
+      # an RIR, or to legacy-land, or to IETF. These assignments
+      # over-ride standard RIR->LIR assignments.
+      if assigner == 'iana':
+        iana_count += first
         continue
-
-      # Handy aliases.
-      assigner = alloc['assigning_entity']
-      assignee = alloc['country']
-
-      # If the date is unknown ("00000000") then for the purposes
-      # of simulation, we set it to a known constant.
-      if alloc['date'] == "00000000":
-        alloc['date'] = constants.defines._DEFAULT_NON_ZERO_DATE
-
-      # For the immediate purposes of this simulator, we are
-      # interested in IPv4 assignments only.
-      if alloc['addr_type'] != "ipv4":
-        non_v4 += 1
+      if first:
+        # It's RIR->LIR, LIR being in this case a country.
+        the_rir = self.CreateRIRIfNotSeen(assigner,
+                                          self.instrument,
+                                          rir_behave)
+        the_lir = self.CreateLIRIfNotSeen(assignee,
+                                          self.instrument,
+                                          lir_behave)
+        # We assume that one country has one RIR for this model,
+        # and the last one wins.
+        the_lir.address_supplier = the_rir
+      prefix = delegated.PrefixString(start, plen)
+      if self.debug >= 3:
+        print "sim.from_rir_process adding prefix [%s]" % prefix
+      # Register with the relevant entities in any case.
+      the_lir._AddTreePrefix(prefix,
+                             "sim.from_rir_process",
+                             True, date)
+      the_rir._AddTreePrefix(prefix,
+                             "sim.from_rir_process",
+                             True, date)
+    return iana_count
+
+  def WithdrawRIRRecords(self, records):
+    """Undo ApplyRIRRecords for delegated.Parse() style tuples it was
+    given before. LIRs are kept, even with nothing left, and keep their
+    address supplier.
+
+    Raises:
+      KeyError if a record was never applied."""
+    for (assigner, assignee, status, start, plen, date, first) in records:
+      if assigner == 'iana':
         continue
-      else:
-        if self.debug >= 2:
-          print "sim.from_rir.line: ", line.rstrip()
-        # Take the assignment, convert it into CIDR.
-        # It's possible for the amount to be a sum of powers,
-        # so decompose it where possible.
-        amount = int(alloc['size'])
-        array = self.DecomposeAmountToPrefixes(amount)
-        if len(array) > 1 and self.debug >= 2:
-          print "sim.from_rir_process decomposes to [%s] powers for [%s]" % (len(array), alloc['prefix'])
-        prefixes = []
-        prefixes = self.ProvideSeriesFromPrefixesAndLengths(alloc['prefix'], array)
-
-        # If we have an assigner of iana, this is from IANA to
-        # an RIR, or to legacy-land, or to IETF. These assignments
-        # over-ride standard RIR->LIR assignments.
-        if assigner == 'iana':
-          iana_count += 1
-          # Not relevant, done in other routine
-          continue
-        else: 
-          # A non-IANA assigner.
-          # Outside scope variables
-          the_lir = None
-          the_rir = None
-          # It's RIR->LIR, LIR being in this case a country.
-          the_rir = self.CreateRIRIfNotSeen(assigner,
-                                            self.instrument,
-                                            rir_behave)
-          the_lir = self.CreateLIRIfNotSeen(assignee,
-                                            self.instrument,
-                                            lir_behave)
-          """
-          if self.debug >= 2:
-            print "sim.from_rir_process rir->assigner: (%s) (%s)" % (the_rir, assigner)
-            print "sim.from_rir_process lir->assignee: (%s) (%s)" % (the_lir, assignee) """
-          # Register with the relevant entities in any case.
-          for prefix in prefixes:
-            if self.debug >= 3:
-              print "sim.from_rir_process adding prefix [%s]", prefix
-            the_lir._AddTreePrefix(prefix, 
-                                   "sim.from_rir_process",
-                                   True, alloc['date'])
-            the_rir._AddTreePrefix(prefix,
-                                   "sim.from_rir_process",
-                                   True, alloc['date'])
-          # We assume that one country has one RIR for this model,
-          # and the first one wins.
-          the_lir.address_supplier = the_rir
-    # Read all lines in file; tidy-up work
-    # Activity report
+      if first:
+        self.rirs[assigner]['count'] -= 1
+        self.lirs[assignee]['count'] -= 1
+      prefix = delegated.PrefixString(start, plen)
+      self.GetLIRByName(assignee)._RemoveTreePrefix(prefix, True, date)
+      self.GetRIRByName(assigner)._RemoveTreePrefix(prefix, True, date)
+
+  def FromOrgProcess(self, filename = constants.defines._NRO_EXTENDED_DATA,
+                     lir_behave = None, rir_behave = None):
+    """Read in the extended NRO file, which says which organisation
+    holds each line, and populate our RIRs and our population of LIRs,
+    one per organisation, from it. The IANA and RIRs still come from
+    FromIANAProcess, which should be run first."""
+    counts = dict()
+    records = delegated.ParseFile(filename,
+                                  constants.defines._DEFAULT_NON_ZERO_DATE,
+                                  counts, extended = True)
+    iana_count = self.ApplyOrgRecords(records, lir_behave, rir_behave)
     if self.debug >= 1:
-      print "sim.from_rir_process: finished reading file (%s)" % filename
+      print "sim.from_org_process: finished reading file (%s)" % filename
       print "Read (%s) lines, found (%s) non-ipv4 records, (%s) RIRs, \n\
-(%s) IANA-based assignments, and (%s) LIR equivalents." % (count, non_v4, len(self.rirs.keys()),
-                                                           iana_count, len(self.lirs.keys()))
+(%s) IANA-based assignments, and (%s) organisations." % (counts['lines'],
+                                                         counts['skipped'],
+                                                         len(self.rirs.keys()),
+                                                         iana_count,
+                                                         len(self.population))
+
+  def ApplyOrgRecords(self, records, lir_behave = None, rir_behave = None):
+    """Populate our RIR objects and our population from extended
+    delegated.Parse() style tuples, one LIR per organisation id. Space
+    nobody holds (available or reserved) is passed over, and lines
+    without an id go to an organisation named for their country. Only
+    the RIRs are filled in here; see population.py. Returns the number
+    of IANA assignments (lines) seen, which are left to
+    ApplyIANARecords."""
+    if self.population == None:
+      self.population = population.Population(lir_behave)
+      self.population.Attach(self)
+    iana_count = 0
+    the_rir = None
+    for (assigner, assignee, status, start, plen, date, first, org) in \
+          records:
+      if assigner == 'iana':
+        iana_count += first
+        continue
+      if status not in ('allocated', 'assigned'):
+        continue
+      if first:
+        the_rir = self.CreateRIRIfNotSeen(assigner,
+                                          self.instrument,
+                                          rir_behave)
+      self.population.Add(org or assignee, assignee, assigner, start, plen,
+                          date, first)
+      the_rir._AddTreePrefix(delegated.PrefixString(start, plen),
+                             "sim.from_rir_process",
+                             True, date)
+    return iana_count
 
   def CreateRIRIfNotSeen(self,
                              rir_name,
@@ -330,6 +408,7 @@ class simulation:
                         supplied_debug = self.debug,
                         supplied_inst = instrument,
                         requested_behaviour = rir_behave)
+      self.Enrol(new_rir)
       tmp_binding = {'obj': new_rir, 'count': 1}
       self.rirs[rir_name] = tmp_binding
       return new_rir
@@ -355,6 +434,7 @@ class simulation:
                         supplied_debug = self.debug,
                         supplied_inst = instrument,
                         requested_behaviour = lir_behave)
+      self.Enrol(new_lir)
       tmp_binding = {'obj': new_lir, 'count': 1}
       self.lirs[lir_name] = tmp_binding
       return new_lir
@@ -366,44 +446,108 @@ class simulation:
       return self.GetLIRByName(lir_name)
 
   def DumpCheckpoint(self, output_file):
+    """ Write state of world out to checkpoint file, for later reading.
+    See checkpoint.py for the format. """
     if self.debug >= 2:
       print "sim.dump_checkpoint to [%s]" % output_file
-    """ Write state of world out to checkpoint file, for later reading. """
-    FILE = open(output_file, "w")
-    #world_state = [self.lirs, self.rirs, self.timeline, self.global_table, self.debug]
-    #Can't pickle radix objects... FIXME
-    world_state = [self.iana,  self.rirs, self.lirs, self.timeline]
-    sys.stdout.write(".")
-    sys.stdout.flush()
-    cPickle.dump(world_state, FILE, protocol=-1)  # Warning: selects latest proto!
-    sys.stdout.write(".")
-    sys.stdout.flush()
-    FILE.close()
+    checkpoint.Save(self, output_file)
 
   def ReadCheckpoint(self, input_file):
     """ Read state of world from checkpoint file, to prevent us having
     to read in initialisation every time. """
     if self.debug >= 2:
       print "sim.read_checkpoint from [%s]" % input_file
+    if checkpoint.IsSectioned(input_file):
+      checkpoint.Load(self, input_file)
+      return
+    # An old style checkpoint: one pickle of the whole world.
     FILE = open(input_file, 'r')
-    sys.stdout.write(".")
-    sys.stdout.flush()
     world_state = cPickle.load(FILE)
-    sys.stdout.write(".")
-    sys.stdout.flush()
     self.timeline = world_state.pop()
-    sys.stdout.write(".")
-    sys.stdout.flush()
+    self.population = None
     self.lirs = world_state.pop()
-    sys.stdout.write(".")
-    sys.stdout.flush()
     self.rirs = world_state.pop()
-    sys.stdout.write(".")
-    sys.stdout.flush()
     self.iana = world_state.pop()
-    sys.stdout.write(".")
-    sys.stdout.flush()
+    # Older checkpoints have no record of what they were built from.
+    if world_state:
+      self.applied = world_state.pop()
     FILE.close()
+    checkpoint.Upgrade('timeline', 0, self.timeline)
+    checkpoint.Upgrade('iana', 0, self.iana)
+    for rir in self.GetRIRs():
+      checkpoint.Upgrade('rir', 0, rir)
+    for lir in self.GetLIRs():
+      checkpoint.Upgrade('lir', 0, lir)
+    self.ReindexHolders()
+
+  def ApplyBehaviours(self, lir_behave = None, rir_behave = None):
+    """Give every LIR and/or RIR a fresh behaviour object from the supplied
+    spec, overriding whatever they were created (or checkpointed) with,
+    and have LIRs made from then on given it too."""
+    if lir_behave != None:
+      for lir in self.GetLIRs():
+        lir.behaviour = behaviour.FromSpec(lir_behave)
+      if self.population != None:
+        self.population.behave = lir_behave
+    if rir_behave != None:
+      for rir in self.GetRIRs():
+        rir.behaviour = behaviour.FromSpec(rir_behave)
+
+  def LoadStartupWorld(self, lir_behave = None, rir_behave = None,
+                       checkpoint = False, processes = None, per_org = False):
+    """Populate IANA, RIRs and LIRs from the historical data, or from the
+    startup checkpoint if we are using checkpoints and have one. When
+    checkpointing and there is no startup checkpoint yet, write one.
+    If processes is given, parse the data files with that many worker
+    processes (see ingest.py) rather than line by line. If per_org, read
+    one LIR per organisation from the extended NRO file (see
+    FromOrgProcess), line by line, with a startup checkpoint of its own."""
+    startup_file = constants.defines._STARTUP_CHECKPOINT_FILE
+    if per_org:
+      startup_file = constants.defines._STARTUP_ORG_CHECKPOINT_FILE
+    if not os.path.exists(startup_file):
+      if per_org:
+        self.FromIANAProcess(rir_behave = rir_behave)
+        self.FromOrgProcess(lir_behave = lir_behave,
+                            rir_behave = rir_behave)
+      elif processes != None:
+        ingest.Ingest(self, lir_behave = lir_behave, rir_behave = rir_behave,
+                      processes = processes)
+      else:
+        self.FromIANAProcess(rir_behave = rir_behave)
+        self.FromRIRProcess(lir_behave = lir_behave,
+                            rir_behave = rir_behave)
+      if self.instrument != None:
+        self.instrument.ReceiveEvent("FINISHED_SETUP")
+      if checkpoint:
+        # DeltaIngest only knows the per-country file; an organisation
+        # world is rebuilt rather than refreshed.
+        if not per_org:
+          ingest.RecordApplied(self)
+        self.DumpCheckpoint(startup_file)
+    elif checkpoint:
+      self.ReadCheckpoint(startup_file)
+
+  def RefreshStartupWorld(self, lir_behave = None, rir_behave = None):
+    """Bring the startup checkpoint up to date with the data files by
+    applying only the lines added since it was written (see
+    ingest.DeltaIngest), and write it back.
+
+    Returns:
+      (iana_added, nro_added) line counts, or None if there is no startup
+      checkpoint or it can't be brought up to date, in which case it is
+      left alone and should be rebuilt."""
+    checkpoint_file = constants.defines._STARTUP_CHECKPOINT_FILE
+    if not os.path.exists(checkpoint_file):
+      return None
+    self.ReadCheckpoint(checkpoint_file)
+    added = ingest.DeltaIngest(self, lir_behave = lir_behave,
+                               rir_behave = rir_behave)
+    if added != None:
+      # Never leave a half-written checkpoint behind.
+      self.DumpCheckpoint(checkpoint_file + ".tmp")
+      os.rename(checkpoint_file + ".tmp", checkpoint_file)
+    return added
 
   def DecomposeAmountToPrefixes(self, amount):
     """Decompose supplied number into minimum powers of two. For example, an amount 
@@ -430,97 +574,302 @@ class simulation:
     return prefixes
 
 
+class RunResult(object):
+  """The outcome of a timelined.Run().
+
+  exhaustion_dates maps entity name ('iana' or an RIR name) to the date
+  of the callback after which it was first seen exhausted. series maps
+  the same names to a list of (date, percentage free) pairs, recorded at
+  the end of each date on which the value changed. counters holds simple
+  totals for the run. stopped_by says why the run ended: 'exhaustion'
+  (every RIR exhausted), 'stop_condition', 'until' or 'timeline' (nothing
+  left to do). stats is the stats.Rollup of address totals the run keeps
+  as it goes."""
+  def __init__(self):
+    self.exhaustion_dates = dict()
+    self.series = dict()
+    self.counters = {'callbacks': 0, 'dates': 0}
+    self.stats = None
+    self.start_date = None
+    self.end_date = None
+    self.stopped_by = None
+
+  def _Record(self, name, date, percentage):
+    """Append to name's series, unless the value has not moved."""
+    series = self.series.setdefault(name, [])
+    if not series or series[-1][1] != percentage:
+      series.append((date, percentage))
+
+  def __repr__(self):
+    return "<RunResult %s-%s stopped_by=%s exhaustion_dates=%s>" % \
+      (self.start_date, self.end_date, self.stopped_by, self.exhaustion_dates)
+
+def AllRIRsExhausted(sim, result):
+  """Default stop condition for timelined.Run: every RIR has run out."""
+  for rir in sim.GetRIRs():
+    if rir.name not in result.exhaustion_dates:
+      return False
+  return True
+
+def RIRsUsedPercentage(percentage):
+  """A stop condition for timelined.Run: the RIRs between them have used
+  percentage of the space they hold. Read off the run's stats roll-up,
+  so checking it costs the same however big the world is."""
+  def Stop(sim, result):
+    return result.stats.PercentageUsed('rir') >= percentage
+  return Stop
+
 class timelined(simulation):
   """IPv4 run-out simulation with a timeline."""
-  def Begin(self, lir_behave, rir_behave):
-    # Useful initial declarations.
-    exhaustion_dates = dict()
+  def Setup(self, lir_behave = None, rir_behave = None, verbose = False):
+    """Start a fresh RunResult and register every LIR and RIR on the
+    timeline, ready for walking. Run() does this itself on its first call;
+    it is separate so that callers can see the timeline before running."""
+    self.result = RunResult()
     # Remove irreleavant LIRs, if they exist.
     try:
       del self.lirs['ZZ']
     except:
       pass
     # Display the state of IANA at the very start.
-    self.iana.PrintStats()
+    if verbose:
+      self.iana.PrintStats()
+    # Set behaviour as supplied on CLI, which might be different
+    # to default behaviour module. Useful to over-ride in case of
+    # checkpoint.
+    self.ApplyBehaviours(lir_behave, rir_behave)
+    # We go a region at a time, in RIR name order, and through a region's
+    # LIRs in name order, so that the IANA hears from the regions in the
+    # same order a sharded run has it (see shard.py).
+    unstarted = _Unstarted(self.timeline)
+    rirs = dict()
+    lirs = dict()  # Region name to its LIRs
+    for rir in self.GetRIRs():
+      rirs[rir.name] = rir
+    for lir in self.GetLIRs():
+      lirs.setdefault(lir.Region(), []).append(lir)
     # Lame, please FIXME
     lir_progress_count = 0
     lir_total = len(self.lirs)
-    # Go around the LIR population once doing setup.
-    for lir in self.GetLIRs():
-      lir_progress_count += 1
-      if self.debug >= 1:
-        print "sim.begin: Examining [%s] of [%s] LIRs" % (lir_progress_count,
-                                                          lir_total)
-      # Set behaviour as supplied on CLI, which might be different
-      # to default behaviour module. Useful to over-ride in case of
-      # checkpoint.
-      if lir_behave != None:
-        # If the class name has arguments, mask them out...
-        m = re.compile('(\S+)\((\S+)\)$')
-        q = m.match(lir_behave)
-        if q != None:
-          name = getattr(behaviour, q.group(1))
-          self.behaviour = name(q.group(2))
-        else:
-          name = getattr(behaviour, lir_behave)
-          self.behaviour = name()
-      # Register each LIR we iterate with on the callback timeline.
-      lir.ActivityCallback(self.timeline)
-    # We'll do the RIRs as well. Although they don't generally have
-    # the immediate requirements that LIRs have, they do need to keep
-    # track of their overall availability, and follow policy with respect
-    # to asking for more.
-    for rir in self.GetRIRs():
-      # Setup for RIRs now.
+    for region in sorted(set(rirs.keys()) | set(lirs.keys())):
+      # Go around the region's LIR population once doing setup.
+      for lir in sorted(lirs.get(region, []), key = lambda lir: lir.name):
+        lir_progress_count += 1
+        if self.debug >= 1:
+          print "sim.begin: Examining [%s] of [%s] LIRs" % (
+            lir_progress_count, lir_total)
+        # Register each LIR we iterate with on the callback timeline.
+        lir.ActivityCallback(unstarted)
+      rir = rirs.get(region)
+      if rir == None:
+        continue
+      # Organisations whose LIRs haven't been made yet are registered
+      # all at once, from the RIR's date, and made as they come due.
+      if self.population != None:
+        scheduled = self.population.Schedule(self.timeline, rir.GetDate(),
+                                             registry = region)
+        if self.debug >= 1:
+          print "sim.begin: Scheduled [%s] organisations" % scheduled
+      # We'll do the RIR as well. Although they don't generally have
+      # the immediate requirements that LIRs have, they do need to keep
+      # track of their overall availability, and follow policy with respect
+      # to asking for more.
       if self.debug >= 1:
         print "sim.begin: Examining rir [%s]" % rir.name
       rir.UpdateStats()
-      rir.PrintStats()
-      rir.ActivityCallback(self.timeline)
+      if verbose:
+        rir.PrintStats()
+      rir.ActivityCallback(unstarted)
+
+  def Run(self, lir_behave = None, rir_behave = None, until = None,
+          stop_condition = AllRIRsExhausted, verbose = False,
+          checkpointer = None):
+    """Walk the timeline in-process and return a RunResult.
+
+    The first call registers the LIR and RIR population on the timeline;
+    later calls carry on from wherever the previous one stopped (handy
+    with until=), accumulating into the same result.
+
+    Args:
+      lir_behave, rir_behave: behaviour overrides, as for Begin.
+      until: YYYYMMDD date; stop before processing anything after it.
+      stop_condition: callable(sim, result) checked before each new
+        date; the run stops as soon as it returns True. Defaults to
+        AllRIRsExhausted. Pass None to run until the timeline empties.
+      verbose: print the per-callback status Begin always used to print.
+      checkpointer: optional checkpoint.Periodic, written to between
+        dates whenever it says a checkpoint is due. Reading the file back
+        and calling Run() again resumes the run.
+
+    Returns:
+      a RunResult."""
+    resume = self.result != None
+    if not resume:
+      self.Setup(lir_behave, rir_behave, verbose)
+    result = self.result
+    stopped = []
+    def RecordSeries():
+      """Add where the holders that changed on the date just walked
+      finished it to the series."""
+      if previous_date == None:
+        return
+      for holder in changed_today.values():
+        if holder is self.iana:
+          result._Record('iana', previous_date,
+                         self.iana.AddressPercentageLeft())
+        else:
+          result._Record(holder.name, previous_date,
+                         holder.AddressPercentageLeft())
+      changed_today.clear()
+    def Stop(date):
+      RecordSeries()
+      if stop_condition != None and stop_condition(self, result):
+        stopped.append(stop_condition)
+        return True
+      if checkpointer != None and checkpointer.Due(date):
+        checkpointer.Write(self, date)
+      return False
+    # Rather than poll every RIR after every callback, we listen for the
+    # IANA and RIRs telling us they have run out (SPACE_EXHAUSTED) or that
+    # their percentage free has moved (SPACE_THRESHOLD), and look at just
+    # those: for exhaustion after the callback, and for the series at the
+    # end of the date. Everyone gets looked at once to begin with.
+    watched = dict()
+    for holder in [self.iana] + list(self.GetRIRs()):
+      watched[id(holder)] = holder
+    # Every holder's counter deltas go into the stats roll-up, which is
+    # seeded with the world as it stands the first time round.
+    holders = watched.values() + list(self.GetLIRs())
+    if result.stats == None:
+      result.stats = stats.Rollup()
+      result.stats.Seed(holders)
+      if self.population != None:
+        self.population.Seed(result.stats)
+    exhausted = dict(watched)
+    changed_today = dict(watched)
+    def SpaceExhausted(holder):
+      if id(holder) in watched:
+        exhausted[id(holder)] = holder
+    def SpaceThreshold(holder, percentage):
+      if id(holder) in watched:
+        changed_today[id(holder)] = holder
+        if percentage <= 0.0:
+          exhausted[id(holder)] = holder
+    instruments = dict()
+    for holder in watched.values():
+      instrument = getattr(holder, 'instrument', None)
+      if instrument != None:
+        instruments[id(instrument)] = instrument
+    for instrument in instruments.values():
+      instrument.Subscribe('SPACE_EXHAUSTED', SpaceExhausted)
+      instrument.Subscribe('SPACE_THRESHOLD', SpaceThreshold)
+    all_instruments = dict()
+    for holder in holders:
+      instrument = getattr(holder, 'instrument', None)
+      if instrument != None:
+        all_instruments[id(instrument)] = instrument
+    for instrument in all_instruments.values():
+      instrument.Subscribe('SPACE_DELTA', result.stats.Add)
     # Now this is effectively the main loop, which amounts to iterating
-    # along the timeline until we end.
-    current_date = self.timeline.GetCurrentDate()
+    # along the timeline until we end. Stopping is decided between dates,
+    # so a later Run() resumes cleanly.
     previous_date = None
-    for callback in self.timeline.WalkAlong():
-      self.timeline.PrintStatus()
-      print exhaustion_dates
-      if current_date != previous_date:
-        self.iana.SetDate(self.timeline.GetCurrentDate())
-      for rir in self.GetRIRs():
-        rir.SetDate(self.timeline.GetCurrentDate())
-        if rir.GetSpaceExhausted() == True and rir.name not in exhaustion_dates: 
-          print "RIR EXHAUSTED", rir.name
-          exhaustion_dates[rir.name] = self.timeline.GetCurrentDate()
-      if len(exhaustion_dates) == 5:
-        print "Game over - RIR exhaustion at [%s]" % self.timeline.GetCurrentDate()
-        print exhaustion_dates
-        sys.exit()
-      self.iana.SetDate(self.timeline.GetCurrentDate())
-      current_date = self.timeline.GetCurrentDate()
-      print "IANA PERCENT FREE: [%s]" % self.iana.AddressPercentageLeft()
-      if self.iana.AddressPercentageLeft() <= 0.0 and 'iana' not in exhaustion_dates:
-        exhaustion_dates['iana'] = self.timeline.GetCurrentDate()
-      callback(self.timeline)
-      previous_date = current_date
+    try:
+      for callback in self.timeline.WalkAlong(until = until, stop = Stop,
+                                              resume = resume):
+        current_date = self.timeline.GetCurrentDate()
+        if verbose:
+          self.timeline.PrintStatus()
+          print result.exhaustion_dates
+        if current_date != previous_date:
+          # Clocks only need moving once a date.
+          result.counters['dates'] += 1
+          if result.start_date == None:
+            result.start_date = current_date
+          result.stats.SetDate(current_date)
+          self.iana.SetDate(current_date)
+          for rir in self.GetRIRs():
+            rir.SetDate(current_date)
+        if verbose:
+          print "IANA PERCENT FREE: [%s]" % self.iana.AddressPercentageLeft()
+        callback(self.timeline)
+        for holder in exhausted.values():
+          if holder is self.iana:
+            if self.iana.AddressPercentageLeft() <= 0.0 and \
+                  'iana' not in result.exhaustion_dates:
+              result.exhaustion_dates['iana'] = current_date
+          elif holder.GetSpaceExhausted() == True and \
+                holder.name not in result.exhaustion_dates:
+            if verbose:
+              print "RIR EXHAUSTED", holder.name
+            result.exhaustion_dates[holder.name] = current_date
+        exhausted.clear()
+        if checkpointer != None:
+          checkpointer.Touch(callback)
+        result.counters['callbacks'] += 1
+        result.end_date = current_date
+        previous_date = current_date
+      RecordSeries()
+    finally:
+      for instrument in instruments.values():
+        instrument.Unsubscribe('SPACE_EXHAUSTED', SpaceExhausted)
+        instrument.Unsubscribe('SPACE_THRESHOLD', SpaceThreshold)
+      for instrument in all_instruments.values():
+        instrument.Unsubscribe('SPACE_DELTA', result.stats.Add)
+    if stopped:
+      if stopped[0] == AllRIRsExhausted:
+        result.stopped_by = 'exhaustion'
+      else:
+        result.stopped_by = 'stop_condition'
+    elif self.timeline.pointer != None:
+      result.stopped_by = 'until'
+    else:
+      result.stopped_by = 'timeline'
+    return result
+
+  def Begin(self, lir_behave, rir_behave, checkpointer = None):
+    """Run the simulation on the command line: chatty, and exits the
+    process once every RIR is exhausted. With a checkpointer, the run is
+    checkpointed as it goes, and the checkpoint is removed once the run
+    is over."""
+    result = self.Run(lir_behave, rir_behave, verbose = True,
+                      checkpointer = checkpointer)
+    if checkpointer != None and os.path.exists(checkpointer.filename):
+      os.remove(checkpointer.filename)
+    if result.stopped_by == 'exhaustion':
+      print "Game over - RIR exhaustion at [%s]" % result.end_date
+      print result.exhaustion_dates
+      for line in result.stats.Report():
+        print line
+      sys.exit()
 
 def Usage():
   """Instructions for usage."""
   print "Run an address allocation simulation."
   print
   print "--help: this help"
-  print "--checkpoint: generate or use a previously generated checkpoint file"
+  print "--checkpoint: generate or use a previously generated checkpoint file,"
+  print "  and checkpoint the run as it goes; an interrupted run resumes from it"
+  print "--checkpoint_days: simulated days between run checkpoints"
+  print "--checkpoint_seconds: wall-clock seconds between run checkpoints"
   print "--lir_behave: select a particular kind of LIR behaviour from available classes"
   print "--rir_behave: select a particular kind of RIR behaviour from available classes"
   print "--debug: set integer debug level"
+  print "--processes: parse the data files with this many worker processes"
+  print "--per_org: one LIR per organisation, from the extended NRO file"
 
 if __name__ == '__main__':
   # CLI argument parsing
   try:
-    opts, args = getopt.getopt(sys.argv[1:], "hcl:r:d:", ["help",
+    opts, args = getopt.getopt(sys.argv[1:], "hcD:S:l:r:d:j:o", ["help",
                               "checkpoint",
+                              "checkpoint_days=",
+                              "checkpoint_seconds=",
                               "lir_behave=",
                               "rir_behave=",
-                              "debug="])
+                              "debug=",
+                              "processes=",
+                              "per_org"])
   except getopt.GetoptError:
     # TODO(niallm)
     sys.exit(2)
@@ -528,6 +877,12 @@ if __name__ == '__main__':
   cur_debug = 0
   # Checkpoint(ed) flag
   cp = False
+  checkpoint_days = constants.defines._CHECKPOINT_DAYS
+  checkpoint_seconds = constants.defines._CHECKPOINT_SECONDS
+  # Parse data files serially unless told otherwise
+  processes = None
+  # One LIR per country unless told otherwise
+  per_org = False
   lir_behave = constants.defines._DEFAULT_LIR_BEHAVIOUR
   rir_behave = constants.defines._DEFAULT_RIR_BEHAVIOUR
   for opt, arg in opts:
@@ -536,12 +891,20 @@ if __name__ == '__main__':
       sys.exit()
     if opt in ("-c", "--checkpoint"):
       cp = True
+    elif opt in ("-D", "--checkpoint_days"):
+      checkpoint_days = int(arg)
+    elif opt in ("-S", "--checkpoint_seconds"):
+      checkpoint_seconds = int(arg)
     elif opt in ('-l', '--lir_behave'):
       lir_behave = arg
     elif opt in ('-r', '--rir_behave'):
       rir_behave = arg
     elif opt in ('-d', '--debug'):
       cur_debug = arg
+    elif opt in ('-j', '--processes'):
+      processes = int(arg)
+    elif opt in ('-o', '--per_org'):
+      per_org = True
   # Set up the event processor object so that it can cascade
   # through the object tree.
   eventp = instrumentation.event_processor()
@@ -552,17 +915,14 @@ if __name__ == '__main__':
   # from the historical table and checkpoint it (so we don't have to do
   # it again for every simulation). We assume this is the right thing
   # to do, since most people aren't interested in a clean-room simulation...
-  if not os.path.exists(constants.defines._STARTUP_CHECKPOINT_FILE):
-    sim.FromIANAProcess(rir_behave = rir_behave)
-    sim.FromRIRProcess(lir_behave = lir_behave,
-                       rir_behave = rir_behave)
-    eventp.ReceiveEvent("FINISHED_SETUP")
-    if cp:
-      sim.DumpCheckpoint(constants.defines._STARTUP_CHECKPOINT_FILE)
-  elif os.path.exists(constants.defines._STARTUP_CHECKPOINT_FILE) and cp:
-    sim.ReadCheckpoint(constants.defines._STARTUP_CHECKPOINT_FILE)
+  sim.LoadStartupWorld(lir_behave, rir_behave, cp, processes, per_org)
+  checkpointer = None
+  if cp:
+    checkpointer = checkpoint.Periodic(constants.defines._CHECKPOINT_FILE,
+                                       checkpoint_days, checkpoint_seconds)
   if not os.path.exists(constants.defines._CHECKPOINT_FILE):
-    sim.Begin(lir_behave, rir_behave)
+    sim.Begin(lir_behave, rir_behave, checkpointer)
   elif os.path.exists(constants.defines._CHECKPOINT_FILE):
+    # Carry on with the interrupted run.
     sim.ReadCheckpoint(constants.defines._CHECKPOINT_FILE)
-    sim.Begin(lir_behave, rir_behave)
+    sim.Begin(lir_behave, rir_behave, checkpointer)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+stats.py - running address totals, rolled up IANA -> RIR -> LIR.
+
+Holders put every change to their address counters through
+address_holder._Account(), which publishes it as a SPACE_DELTA event of
+(holder, span, used). A Rollup subscribed to those events adds each
+delta into the totals of every group the holder is in:
+
+  ('iana', None, None)      the IANA
+  ('rir', None, None)       all RIRs
+  ('rir', name, None)       one RIR
+  ('lir', None, None)       all LIRs
+  ('lir', rir, None)        the LIRs served by one RIR
+  ('lir', None, country)    the LIRs in one country
+
+so reading a total is a dict lookup however many holders there are. The
+totals are also remembered per date, as of the end of the date: rows are
+appended only for dates on which a group moves, and read back by
+bisection. An LIR's deltas go to the RIR that supplied it at the time.
+
+timelined.Run() keeps one of these as result.stats, seeded once from
+the world as it stands, and moves its clock on at each date.
+
+Typical use case:
+  rollup = stats.Rollup()
+  rollup.Seed([world.iana] + list(world.GetRIRs()) + list(world.GetLIRs()))
+  print rollup.PercentageUsed('lir', country = 'IE')
+"""
+
+import lir
+import ledger
+
+import array
+import bisect
+
+def LIRGroups(rir, country):
+  """The groups an LIR supplied by the RIR named rir, in country, is in."""
+  return (('lir', None, None), ('lir', rir, None), ('lir', None, country))
+
+class Rollup(object):
+  """Address span and use, totalled by kind of holder, RIR and country."""
+
+  def __init__(self):
+    self.date = None  # YYYYMMDD; deltas before the first date are history's base
+    self.day = 0
+    self.totals = dict()  # Group to [span, used]
+    self.history = dict()  # Group to (days, spans, useds)
+
+  def SetDate(self, date):
+    """Move the clock on: deltas from now on are dated date."""
+    self.date = date
+    self.day = ledger.DayOrdinal(date)
+
+  def Groups(self, holder):
+    """The groups holder's deltas count towards."""
+    if isinstance(holder, lir.iana):
+      return (('iana', None, None),)
+    if isinstance(holder, lir.rir):
+      return (('rir', None, None), ('rir', holder.name, None))
+    supplier = holder.address_supplier
+    if supplier != None:
+      supplier = supplier.GetName()
+    return LIRGroups(supplier, holder.GetCountry())
+
+  def Add(self, holder, span, used):
+    """Count a change in holder's counters; subscribed to SPACE_DELTA."""
+    self.AddToGroups(self.Groups(holder), span, used)
+
+  def AddToGroups(self, groups, span, used):
+    """Count a change in the counters of something in groups."""
+    if not span and not used:
+      return
+    for group in groups:
+      total = self.totals.get(group)
+      if total is None:
+        total = self.totals[group] = [0, 0]
+        self.history[group] = (array.array('l'), [], [])
+      total[0] += span
+      total[1] += used
+      (days, spans, useds) = self.history[group]
+      if days and days[-1] == self.day:
+        spans[-1] = total[0]
+        useds[-1] = total[1]
+      else:
+        days.append(self.day)
+        spans.append(total[0])
+        useds.append(total[1])
+
+  def Seed(self, holders):
+    """Count each holder's counters as they stand, once. Stand-ins for
+    holders, like shard.IANAProxy, have none and are passed over."""
+    for holder in holders:
+      if isinstance(holder, lir.address_holder):
+        self.Add(holder, holder.address_span, holder.addresses_used)
+
+  def Totals(self, kind, rir = None, country = None):
+    """(span, used) for a group, now."""
+    return tuple(self.totals.get((kind, rir, country), (0, 0)))
+
+  def At(self, date, kind, rir = None, country = None):
+    """(span, used) for a group as of the end of YYYYMMDD date."""
+    history = self.history.get((kind, rir, country))
+    if history is None:
+      return (0, 0)
+    (days, spans, useds) = history
+    i = bisect.bisect_right(days, ledger.DayOrdinal(date)) - 1
+    if i < 0:
+      return (0, 0)
+    return (spans[i], useds[i])
+
+  def PercentageUsed(self, kind, rir = None, country = None):
+    """How much of a group's span it has used, now, as a percentage."""
+    (span, used) = self.Totals(kind, rir, country)
+    if span == 0:
+      return 0.0
+    return used * 100.0 / span
+
+  def Report(self):
+    """One line per group: kind, RIR, country, span, used and percentage."""
+    lines = []
+    for group in sorted(self.totals.keys()):
+      (kind, rir, country) = group
+      (span, used) = self.totals[group]
+      lines.append("%-4s %-8s %-4s span [%s] used [%s] [%.2f%%]" %
+                   (kind, rir or '*', country or '*', span, used,
+                    self.PercentageUsed(*group)))
+    return lines
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+sweep.py - run timelined simulations over a grid of parameters.
+
+A grid maps parameter names to lists of values. Names beginning with an
+underscore are attributes of constants.defines (e.g. _LOOKBACK_PERIOD);
+'lir_behave' and 'rir_behave' take behaviour specs as for simulation.py.
+Every combination is run once per seed, in parallel, from a single
+loaded copy of the startup world.
+
+Each completed run is memoised under _SWEEP_CACHE_DIR, keyed by a hash of
+the input data files, the parameters and the seed, so re-running a sweep
+only computes the points that have not been seen before.
+
+Typical use case:
+  ./sweep.py --grid _LOOKBACK_PERIOD=270,540 --grid lir_behave=LIR_Static,LIR_Probability --seeds 0,1,2
+"""
+
+import constants
+import ensemble
+import ingest
+import instrumentation
+import simulation
+
+import cPickle
+import getopt
+import hashlib
+import multiprocessing
+import os
+import sys
+
+# The loaded world, inherited by forked workers; see RunSweep.
+_WORLD = None
+
+def ExpandGrid(grid):
+  """Return every combination of a grid as a list of tuples of
+  (name, value) pairs, sorted by name so equal points compare equal."""
+  points = [()]
+  for name in sorted(grid.keys()):
+    points = [point + ((name, value),) for point in points
+                                       for value in grid[name]]
+  return points
+
+def CacheKey(data_hash, point, seed, until = None):
+  """The memo key for one run: data, parameters, seed and stop date."""
+  return hashlib.sha1(repr((data_hash, point, seed, until))).hexdigest()
+
+def CachePath(key, cache_dir = constants.defines._SWEEP_CACHE_DIR):
+  return os.path.join(cache_dir, key + ".pickle")
+
+def ReadCached(key, cache_dir = constants.defines._SWEEP_CACHE_DIR):
+  """Return the memoised run for key, or None."""
+  try:
+    f = open(CachePath(key, cache_dir), 'rb')
+  except IOError:
+    return None
+  try:
+    return cPickle.load(f)
+  finally:
+    f.close()
+
+def WriteCached(key, record, cache_dir = constants.defines._SWEEP_CACHE_DIR):
+  """Memoise a run. Written to a temporary file and renamed into place, so
+  a half-written entry is never mistaken for a result."""
+  if not os.path.isdir(cache_dir):
+    try:
+      os.makedirs(cache_dir)
+    except OSError:
+      pass  # Another worker got there first.
+  path = CachePath(key, cache_dir)
+  tmp = "%s.%s.tmp" % (path, os.getpid())
+  f = open(tmp, 'wb')
+  cPickle.dump(record, f, protocol=-1)
+  f.close()
+  os.rename(tmp, path)
+
+def ApplyPoint(sim, point):
+  """Set up a (forked) world for one grid point."""
+  behaviours = dict()
+  for (name, value) in point:
+    if name in ('lir_behave', 'rir_behave'):
+      behaviours[name] = value
+    elif name.startswith('_'):
+      if not hasattr(constants.defines, name):
+        raise ValueError, "Unknown constant %s in sweep grid" % name
+      setattr(constants.defines, name, value)
+    else:
+      raise ValueError, "Unknown sweep parameter %s" % name
+  sim.ApplyBehaviours(behaviours.get('lir_behave'),
+                      behaviours.get('rir_behave'))
+
+def _RunPoint(args):
+  """Pool worker: run one grid point under one seed and memoise it."""
+  (key, point, seed, until, cache_dir) = args
+  ApplyPoint(_WORLD, point)
+  result = ensemble.RunSeeded(_WORLD, seed, until)
+  record = {'point': point,
+            'seed': seed,
+            'exhaustion_dates': result.exhaustion_dates,
+            'stopped_by': result.stopped_by,
+            'end_date': result.end_date}
+  WriteCached(key, record, cache_dir)
+  return (key, record)
+
+def RunSweep(load_world, grid, seeds, processes = None, until = None,
+             data_files = None,
+             cache_dir = constants.defines._SWEEP_CACHE_DIR):
+  """Run every point of the grid under every seed, reusing memoised runs.
+
+  Args:
+    load_world: callable returning a loaded, unstarted timelined. Only
+      called if something actually needs computing.
+    grid: dict of parameter name to list of values.
+    seeds: list of seeds to run each point under.
+    processes: pool size; defaults to the number of CPUs.
+    until: optional YYYYMMDD date at which to stop each run.
+    data_files: input files whose contents key the cache; defaults to
+      the IANA and NRO delegated files.
+    cache_dir: where memoised runs live.
+
+  Returns:
+    a tuple (records, computed): records is a list of dicts with 'point',
+    'seed', 'exhaustion_dates', 'stopped_by' and 'end_date', in grid then
+    seed order; computed is how many of them were not in the cache."""
+  global _WORLD
+  if data_files == None:
+    data_files = [constants.defines._IANA_DATA, constants.defines._NRO_DATA]
+  data_hash = ingest.HashFiles(data_files)
+  keys = []
+  records = dict()
+  todo = []
+  for point in ExpandGrid(grid):
+    for seed in seeds:
+      key = CacheKey(data_hash, point, seed, until)
+      keys.append(key)
+      cached = ReadCached(key, cache_dir)
+      if cached != None:
+        records[key] = cached
+      else:
+        todo.append((key, point, seed, until, cache_dir))
+  if todo:
+    _WORLD = load_world()
+    # One task per child, so every run gets a fresh fork of the world
+    # and of constants.defines.
+    pool = multiprocessing.Pool(processes = processes, maxtasksperchild = 1)
+    try:
+      for (key, record) in pool.imap_unordered(_RunPoint, todo):
+        records[key] = record
+    finally:
+      pool.close()
+      pool.join()
+      _WORLD = None
+  return ([records[key] for key in keys], len(todo))
+
+def ParseGridArgument(arg):
+  """Turn 'name=v1,v2' into (name, [v1, v2]), with numbers as numbers."""
+  (name, values) = arg.split('=', 1)
+  parsed = []
+  for value in values.split(','):
+    for kind in (int, float):
+      try:
+        value = kind(value)
+        break
+      except ValueError:
+        pass
+    parsed.append(value)
+  return (name, parsed)
+
+def Usage():
+  """Instructions for usage."""
+  print "Sweep address allocation simulations over a parameter grid."
+  print
+  print "--help: this help"
+  print "--grid: name=value,value,... (repeatable); constants or lir_behave/rir_behave"
+  print "--seeds: comma separated list of seeds to run each point with (default 0)"
+  print "--processes: number of worker processes (default: one per CPU)"
+  print "--until: stop each run at this YYYYMMDD date"
+  print "--checkpoint: generate or use a previously generated checkpoint file"
+  print "--debug: set integer debug level"
+
+if __name__ == '__main__':
+  try:
+    opts, args = getopt.getopt(sys.argv[1:], "hg:s:j:u:cd:", ["help",
+                               "grid=",
+                               "seeds=",
+                               "processes=",
+                               "until=",
+                               "checkpoint",
+                               "debug="])
+  except getopt.GetoptError:
+    Usage()
+    sys.exit(2)
+  grid = dict()
+  seeds = [0]
+  processes = None
+  until = None
+  cp = False
+  cur_debug = 0
+  for opt, arg in opts:
+    if opt in ("-h", "--help"):
+      Usage()
+      sys.exit()
+    elif opt in ("-g", "--grid"):
+      (name, values) = ParseGridArgument(arg)
+      grid[name] = values
+    elif opt in ("-s", "--seeds"):
+      seeds = [int(seed) for seed in arg.split(',')]
+    elif opt in ("-j", "--processes"):
+      processes = int(arg)
+    elif opt in ("-u", "--until"):
+      until = arg
+    elif opt in ("-c", "--checkpoint"):
+      cp = True
+    elif opt in ("-d", "--debug"):
+      cur_debug = int(arg)
+  def LoadWorld():
+    world = simulation.timelined(supplied_debug = cur_debug,
+                                 supplied_inst = instrumentation.event_processor())
+    world.LoadStartupWorld(constants.defines._DEFAULT_LIR_BEHAVIOUR,
+                           constants.defines._DEFAULT_RIR_BEHAVIOUR, cp,
+                           processes)
+    return world
+  (records, computed) = RunSweep(LoadWorld, grid, seeds, processes, until)
+  print "Sweep of [%s] runs, [%s] computed, [%s] from cache:" % \
+    (len(records), computed, len(records) - computed)
+  for record in records:
+    print record['point'], record['seed'], record['stopped_by'], \
+      sorted(record['exhaustion_dates'].items())
@@ -10,6 +10,7 @@ import sys
 sys.path.append(".")
 import behaviour
 import constants
+import ledger
 import timeline
 import unittest
 
@@ -28,6 +29,24 @@ class BehaviourTest(unittest.TestCase):
     self.assertEqual(defsize, constants.defines._LIR_DEFAULT_POLICY)
     # FIXME test Failed (with timeline registration)
 
+  def testFromSpec(self):
+    b = behaviour.FromSpec('LIR_Static')
+    self.assert_(isinstance(b, behaviour.LIR_Static))
+    b = behaviour.FromSpec('LIR_Static(16)')
+    self.assert_(isinstance(b, behaviour.LIR_Static))
+    self.assertEqual(b.args, '16')
+    self.failUnlessRaises(KeyError, behaviour.FromSpec, 'No_Such_Behaviour')
+
+  def testShared(self):
+    b = behaviour.Shared('LIR_Static(16)')
+    self.assert_(behaviour.Shared('LIR_Static(16)') is b)
+    self.assertEqual(b.args, '16')
+    self.failIf(behaviour.Shared('LIR_Static') is b)
+    # Behaviours that remember things per holder are never shared.
+    b = behaviour.Shared('LIR_Histogram')
+    self.assert_(isinstance(b, behaviour.LIR_Histogram))
+    self.failIf(behaviour.Shared('LIR_Histogram') is b)
+
 class ScalingTest(unittest.TestCase):
   def setUp(self):
     self.s = behaviour.Scaling()
@@ -53,6 +72,23 @@ class ScalingTest(unittest.TestCase):
                                                constants.defines._DEFAULT_CUTOFF)
     self.assertEqual(num, 0)
     self.assertEqual(span, 0)
+
+  def testWindowStart(self):
+    start = behaviour.WindowStart("20080112", 365)
+    self.assertEqual(timeline.DayDelta("20080112", start), 364)
+
+  def testSpanBetween(self):
+    self.p['20071101'] = ['194.125.0.0/17']
+    book = ledger.Ledger()
+    for (date, prefixes) in sorted(self.p.items()):
+      for prefix in prefixes:
+        book.Append(prefix, date)
+    for items in (self.p, sorted(self.p.items()), book.ByDateItems()):
+      self.assertEqual(self.s.SpanBetween(items), (3, 2 ** 17 + 2 ** 15))
+      self.assertEqual(self.s.SpanBetween(items, '20071011'), (1, 2 ** 15))
+      self.assertEqual(self.s.SpanBetween(items, '20071010', '20071031'),
+                       (2, 2 ** 17))
+      self.assertEqual(self.s.SpanBetween(items, None, '20071009'), (0, 0))
     
 class LIRScalingTest(unittest.TestCase):
   
@@ -91,6 +127,15 @@ class LIRScalingTest(unittest.TestCase):
     self.assertEqual(amount, [(2 ** 17)/365*14])
     self.failUnless(timeline.FilterWithinDate(when, 40, '20071011'))
     
+  def testLIRMonthlyExp(self):
+    self.s = behaviour.LIR_Monthly_Exp()
+    (amount, when) = self.s.CalculateReqs(sorted(self.q.items()), '20071011')
+    # Everything from the last thirty days, not just one date's worth.
+    self.assertEqual(amount, [2 ** 17 + 2 ** 15])
+    (amount, when) = self.s.CalculateReqs(sorted(self.q.items()), '20071111')
+    self.assertEqual(amount, [int((2 ** 17 + 2 ** 15) *
+                        constants.defines._DEFAULT_LIR_REQUEST_MULTIPLIER)])
+
   def testLIRReplay(self):
     self.s = behaviour.LIR_Replay()
     (amount, when) = self.s.CalculateReqs(self.p, '20071201')
@@ -113,6 +158,14 @@ class RIRScalingTest(unittest.TestCase):
   def testRIRDefaults(self):
     self.assertEqual(self.i.CostOfBusiness(), constants.defines._COST_BUSINESS_LOW)
 
+  def testRIRFailedReschedules(self):
+    tl = timeline.Timeline()
+    handle = self.i.Failed("19950101", tl, [self.testRIRDefaults])
+    self.assertNotEqual(handle, None)
+    self.failUnless(timeline.FilterWithinDate(handle.date, 40, "19950101"))
+    self.assertEqual(handle.Cancel(), True)
+    self.assertEqual(list(tl.WalkAlong()), [])
+
   def testRIRStandard(self):
     # self, addr_avail, prefix_items, cur_date
     addr_avail = 0
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+checkpoint_test.py
+
+Tests for sectioned checkpoint files.
+"""
+import sys
+sys.path.append(".")
+import checkpoint
+import cPickle
+import delegated
+import instrumentation
+import ledger
+import lir
+import os
+import random
+import simulation
+import tempfile
+import unittest
+import worlds
+
+class CheckpointTestCase(unittest.TestCase):
+
+  def setUp(self):
+    (handle, self.filename) = tempfile.mkstemp()
+    os.close(handle)
+
+  def tearDown(self):
+    os.remove(self.filename)
+
+  def testRoundTrip(self):
+    eventp = instrumentation.event_processor()
+    sim = worlds.SmallWorld(eventp)
+    sim.applied = {'iana': [], 'nro': []}
+    sim.DumpCheckpoint(self.filename)
+    self.assert_(checkpoint.IsSectioned(self.filename))
+    loaded = simulation.timelined(supplied_inst = eventp)
+    loaded.ReadCheckpoint(self.filename)
+    self.assertEqual(loaded.GetRIRNames(), ['north', 'south'])
+    self.assertEqual(loaded.GetLIRNames(), ['NORTH', 'SOUTH'])
+    self.assertEqual(loaded.applied, sim.applied)
+    self.assertEqual(loaded.iana.addresses_used, sim.iana.addresses_used)
+    north = loaded.GetRIRByName('north')
+    self.assertEqual(north.address_span,
+                     sim.GetRIRByName('north').address_span)
+    # Shared objects are shared again, not copied.
+    self.assert_(north.address_supplier is loaded.iana)
+    self.assert_(loaded.GetLIRByName('NORTH').address_supplier is north)
+    self.assert_(north.instrument is eventp)
+    self.assertEqual([holder.id for holder in loaded.holders],
+                     [holder.id for holder in sim.holders])
+    self.assert_(loaded.GetHolder(north.id) is north)
+
+  def testLazyLoad(self):
+    worlds.SmallWorld().DumpCheckpoint(self.filename)
+    reader = checkpoint.Reader(self.filename)
+    try:
+      self.assertEqual(reader.Names(),
+                       ['applied', 'iana', 'lir:NORTH', 'lir:SOUTH', 'result',
+                        'rir:north', 'rir:south', 'timeline', 'world'])
+      south = reader.RIR('south')
+      self.assertEqual(south.GetName(), 'south')
+      self.assert_(reader.RIR('south') is south)
+      self.failIf('rir:north' in reader.loaded)
+      self.failIf('lir:SOUTH' in reader.loaded)
+      self.failIf('timeline' in reader.loaded)
+    finally:
+      reader.Close()
+
+  def testCompression(self):
+    sim = worlds.SmallWorld()
+    sizes = dict()
+    for compression in ('none', 'zlib'):
+      checkpoint.Save(sim, self.filename, compression)
+      sizes[compression] = os.path.getsize(self.filename)
+      reader = checkpoint.Reader(self.filename)
+      self.assertEqual(reader.IANA().addresses_used, sim.iana.addresses_used)
+      reader.Close()
+    self.assert_(sizes['zlib'] < sizes['none'])
+    self.assertRaises(ValueError, checkpoint.Save, sim, self.filename,
+                      'bogus')
+
+  def testNewerSectionRefused(self):
+    worlds.SmallWorld().DumpCheckpoint(self.filename)
+    reader = checkpoint.Reader(self.filename)
+    (offset, length, version, compression) = reader.index['iana']
+    reader.index['iana'] = (offset, length, version + 1, compression)
+    self.assertRaises(ValueError, reader.IANA)
+    reader.Close()
+
+  def testTimelineCallbacks(self):
+    sim = worlds.SmallWorld()
+    random.seed(1)
+    sim.Setup()
+    sim.Run(until = '19960101', stop_condition = None)
+    sim.DumpCheckpoint(self.filename)
+    loaded = simulation.timelined()
+    loaded.ReadCheckpoint(self.filename)
+    north = loaded.GetRIRByName('north')
+    handle = loaded.timeline.GetPending((north, 'ActivityCallback'))
+    self.assert_(handle != None)
+    self.assertEqual(handle.event[0].im_self, north)
+
+  def testPeriodicAppends(self):
+    sim = worlds.SmallWorld()
+    random.seed(1)
+    checkpointer = checkpoint.Periodic(self.filename, days = 30)
+    sim.Run(until = '19970101', stop_condition = None,
+            checkpointer = checkpointer)
+    self.assert_(checkpointer.writes > 2)
+    # One full write, then appends, each smaller than a full one.
+    full = os.path.getsize(self.filename)
+    checkpointer.touched = {id(sim.GetLIRByName('NORTH')): None}
+    checkpointer.full = False
+    checkpointer.Write(sim, sim.timeline.head.date)
+    grown = os.path.getsize(self.filename) - full
+    self.assert_(0 < grown < full)
+    reader = checkpoint.Reader(self.filename)
+    self.assertEqual(reader.Section('result').end_date, sim.result.end_date)
+    reader.Close()
+
+  def testResume(self):
+    random.seed(1)
+    whole = worlds.SmallWorld().Run(until = '20050101',
+                                    stop_condition = None)
+    sim = worlds.SmallWorld()
+    random.seed(1)
+    checkpointer = checkpoint.Periodic(self.filename, days = 100)
+    sim.Run(until = '19990101', stop_condition = None,
+            checkpointer = checkpointer)
+    # Pretend we crashed, and pick up from the last checkpoint.
+    random.seed(99)
+    resumed = simulation.timelined()
+    resumed.ReadCheckpoint(self.filename)
+    self.assert_(resumed.result.end_date < '19990101')
+    result = resumed.Run(until = '20050101', stop_condition = None)
+    self.assertEqual(result.exhaustion_dates, whole.exhaustion_dates)
+    self.assertEqual(result.series, whole.series)
+    self.assertEqual(result.counters, whole.counters)
+    self.assertEqual(result.end_date, whole.end_date)
+
+  def testResumeStreams(self):
+    whole = worlds.SmallWorld()
+    whole.SeedStreams(4)
+    random.seed(1)
+    whole_result = whole.Run(until = '20050101', stop_condition = None)
+    sim = worlds.SmallWorld()
+    sim.SeedStreams(4)
+    random.seed(2)
+    checkpointer = checkpoint.Periodic(self.filename, days = 100)
+    sim.Run(until = '19990101', stop_condition = None,
+            checkpointer = checkpointer)
+    # The holders' streams are saved with them, so random is irrelevant.
+    random.seed(99)
+    resumed = simulation.timelined()
+    resumed.ReadCheckpoint(self.filename)
+    self.assert_(resumed.GetRIRByName('north').stream != None)
+    result = resumed.Run(until = '20050101', stop_condition = None)
+    self.assertEqual(result.exhaustion_dates, whole_result.exhaustion_dates)
+    self.assertEqual(result.series, whole_result.series)
+    self.assertEqual(resumed.iana.fulfilled.Rows(),
+                     whole.iana.fulfilled.Rows())
+
+  def testPopulation(self):
+    sim = simulation.timelined()
+    sim.ApplyIANARecords([('iana', 'ZZ', 'north',
+                           delegated.AddressToInt('10.0.0.0'), 12,
+                           '19950101', 1)], 'RIR_Standard')
+    sim.ApplyOrgRecords([('north', 'IE', 'allocated',
+                          delegated.AddressToInt('10.0.%s.0' % (16 * n)), 20,
+                          '19960101', 1, 'org-%s' % n) for n in range(4)],
+                        'LIR_Static(16)', 'RIR_Standard')
+    random.seed(1)
+    sim.Setup()
+    wakes = sorted([day for (registry, day) in sim.population.due.keys()])
+    sim.Run(until = ledger.OrdinalDate(wakes[0]), stop_condition = None)
+    sim.DumpCheckpoint(self.filename)
+    loaded = simulation.timelined()
+    loaded.ReadCheckpoint(self.filename)
+    self.assert_(loaded.population.world is loaded)
+    self.assertEqual(loaded.GetLIRNames(), sim.GetLIRNames())
+    self.assertEqual(loaded.population.names, sim.population.names)
+    self.assertEqual(loaded.population.due, sim.population.due)
+    handle = loaded.timeline.GetPending((loaded.population, 'Wake',
+                                         wakes[-1], 'north'))
+    self.assertEqual(handle.event[0].func.im_self, loaded.population)
+    self.assertEqual(handle.rank, 'north')
+    # Both carry on making the rest the same way.
+    until = ledger.OrdinalDate(wakes[-1] + 60)
+    results = []
+    for world in (sim, loaded):
+      random.seed(2)
+      results.append(world.Run(until = until, stop_condition = None))
+      self.assertEqual(len(world.GetLIRNames()), 4)
+    self.assertEqual(results[0].series, results[1].series)
+    self.assertEqual(results[0].counters, results[1].counters)
+
+  def testOldCheckpoint(self):
+    sim = worlds.SmallWorld()
+    # As written before RIRs had a capacity index, or holders ledgers.
+    north = sim.GetRIRByName('north')
+    state = north.__getstate__()
+    del state['capacity']
+    del state['id']
+    del state['stream']
+    for (old, new) in (('registered_prefixes', 'registered'),
+                       ('fulfilled_requests', 'fulfilled')):
+      state[old + '_by_date'] = state[new].ByDate()
+      state[old + '_by_prefix'] = state.pop(new).ByPrefix()
+    def OldState(holder):
+      if holder is north:
+        return state
+      return lir.address_holder.__getstate__(holder)
+    lir.rir.__getstate__ = OldState
+    try:
+      f = open(self.filename, 'wb')
+      cPickle.dump([sim.iana, sim.rirs, sim.lirs, sim.timeline], f, -1)
+      f.close()
+    finally:
+      del lir.rir.__getstate__
+    self.failIf(checkpoint.IsSectioned(self.filename))
+    loaded = simulation.timelined()
+    loaded.ReadCheckpoint(self.filename)
+    self.assertEqual(loaded.GetRIRNames(), ['north', 'south'])
+    self.assertEqual(loaded.applied, None)
+    self.assertEqual(loaded.GetRIRByName('north').capacity, {})
+    self.assertEqual(loaded.GetRIRByName('north').stream, None)
+    self.assertEqual(loaded.GetRIRByName('north').registered_prefixes_by_date,
+                     {'19950101': ['10.0.0.0/12']})
+    self.assert_(loaded.GetHolder(loaded.GetRIRByName('north').id) is
+                 loaded.GetRIRByName('north'))
+
+
+if __name__ == '__main__':
+  suite = unittest.TestLoader().loadTestsFromTestCase(CheckpointTestCase)
+  unittest.TextTestRunner(verbosity=2).run(suite)
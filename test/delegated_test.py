@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+delegated_test.py
+
+Tests for the streaming delegated file parser.
+"""
+import sys
+sys.path.append(".")
+import delegated
+import simulation
+import unittest
+
+_LINES = """2|nro|20080101|6|19830101|20080101|+0000
+nro|*|ipv4|*|4|summary
+# ripencc|IE|ipv4|20.9.0.0|256|19960101|allocated
+ripencc|IE|ipv4|20.0.0.0|36864|19960101|allocated
+ripencc|GB|ipv4|20.1.0.0|65536|00000000|allocated
+arin|US|ipv6|2001:400::|32|19990101|allocated
+iana|ZZ|ipv4|10.0.0.0|16777216|19940301|ietf
+"""
+
+_EXTENDED_LINES = """2.3|nro|20080101|4|19830101|20080101|+0000
+nro|*|ipv4|*|3|summary
+ripencc|IE|ipv4|20.0.0.0|36864|19960101|allocated|org-a
+ripencc||ipv4|20.2.0.0|65536||available|
+arin|US|ipv4|20.3.0.0|256|19990101|assigned|org-b|e-stats
+ripencc|IE|ipv4|20.9.0.0|256|19960101|allocated
+"""
+
+class DelegatedTestCase(unittest.TestCase):
+
+  def testAddressArithmetic(self):
+    self.assertEqual(delegated.AddressToInt("10.1.2.3"), 0x0a010203)
+    self.assertEqual(delegated.IntToAddress(0x0a010203), "10.1.2.3")
+    self.assertEqual(delegated.PrefixString(0xc0000200, 24), "192.0.2.0/24")
+
+  def testDecompose(self):
+    start = delegated.AddressToInt("20.0.0.0")
+    self.assertEqual([delegated.PrefixString(b, p)
+                      for (b, p) in delegated.Decompose(start, 36864)],
+                     ["20.0.0.0/17", "20.0.128.0/20"])
+    sim = simulation.simulation()
+    self.assertEqual([p for (b, p) in delegated.Decompose(start, 36864)],
+                     sim.DecomposeAmountToPrefixes(36864))
+    self.assertEqual([delegated.PrefixString(b, p)
+                      for (b, p) in delegated.Decompose(start, 36864)],
+                     sim.ProvideSeriesFromPrefixesAndLengths("20.0.0.0",
+                       sim.DecomposeAmountToPrefixes(36864)))
+
+  def testParse(self):
+    counts = dict()
+    rows = list(delegated.Parse(_LINES.splitlines(True), counts = counts))
+    self.assertEqual(rows[0], ('ripencc', 'IE', 'allocated',
+                               delegated.AddressToInt("20.0.0.0"), 17,
+                               "19960101", 1))
+    self.assertEqual(rows[1][4:], (20, "19960101", 0))
+    self.assertEqual(rows[2][5], "00000000")
+    self.assertEqual(rows[3][:3], ('iana', 'ZZ', 'ietf'))
+    self.assertEqual(len(rows), 4)
+    self.assertEqual(counts, {'lines': 7, 'skipped': 4})
+
+  def testZeroDate(self):
+    rows = list(delegated.Parse(_LINES.splitlines(True), "19930101"))
+    self.assertEqual([row[5] for row in rows],
+                     ["19960101", "19960101", "19930101", "19940301"])
+
+  def testExtended(self):
+    counts = dict()
+    rows = list(delegated.Parse(_EXTENDED_LINES.splitlines(True),
+                                counts = counts, extended = True))
+    self.assertEqual(rows[0], ('ripencc', 'IE', 'allocated',
+                               delegated.AddressToInt("20.0.0.0"), 17,
+                               "19960101", 1, 'org-a'))
+    self.assertEqual(rows[1][6:], (0, 'org-a'))
+    self.assertEqual(rows[2][2], 'available')
+    self.assertEqual(rows[3][:3], ('arin', 'US', 'assigned'))
+    self.assertEqual(rows[3][7], 'org-b')
+    self.assertEqual(len(rows), 4)
+    self.assertEqual(counts, {'lines': 6, 'skipped': 3})
+    # A plain parse reads only the plain line.
+    rows = list(delegated.Parse(_EXTENDED_LINES.splitlines(True)))
+    self.assertEqual([row[3] for row in rows],
+                     [delegated.AddressToInt("20.9.0.0")])
+
+
+if __name__ == '__main__':
+  suite = unittest.TestLoader().loadTestsFromTestCase(DelegatedTestCase)
+  unittest.TextTestRunner(verbosity=2).run(suite)
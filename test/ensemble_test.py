@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+ensemble_test.py
+
+Tests for running and summarising Monte Carlo ensembles.
+"""
+import sys
+sys.path.append(".")
+import ensemble
+import unittest
+import worlds
+
+class EnsembleTestCase(unittest.TestCase):
+
+  def testDeriveSeeds(self):
+    self.assertEqual(ensemble.DeriveSeeds(42, 5), ensemble.DeriveSeeds(42, 5))
+    self.assertNotEqual(ensemble.DeriveSeeds(42, 5), ensemble.DeriveSeeds(43, 5))
+    self.assertEqual(len(set(ensemble.DeriveSeeds(42, 5))), 5)
+
+  def testPercentile(self):
+    ordered = ['1', '2', '3', '4', '5']
+    self.assertEqual(ensemble.Percentile(ordered, 0.0), '1')
+    self.assertEqual(ensemble.Percentile(ordered, 0.5), '3')
+    self.assertEqual(ensemble.Percentile(ordered, 1.0), '5')
+
+  def testSummarise(self):
+    results = [(0, 1, {'north': '20010101', 'iana': '20000101'}, 'exhaustion'),
+               (1, 2, {'north': '20020101'}, 'timeline')]
+    summary = ensemble.Summarise(results)
+    self.assertEqual(summary['north']['dates'], ['20010101', '20020101'])
+    self.assertEqual(summary['north']['min'], '20010101')
+    self.assertEqual(summary['north']['max'], '20020101')
+    self.assertEqual(summary['iana']['exhausted'], 1)
+    self.assertEqual(summary['iana']['not_exhausted'], 1)
+
+  def testRunSeededFailsEarly(self):
+    world = worlds.SmallWorld()
+    def Setup(*args):
+      raise ValueError, "Supplied year [3000] out of bounds"
+    world.Setup = Setup
+    try:
+      ensemble.RunSeeded(world, 1234)
+    except ValueError, error:
+      self.assert_("seed 1234" in str(error))
+      self.assert_("3000" in str(error))
+    else:
+      self.fail("RunSeeded returned without a result")
+
+  def testRunEnsembleReproducible(self):
+    world = worlds.SmallWorld()
+    serial = ensemble.RunEnsemble(world, 3, 7, processes = 1)
+    parallel = ensemble.RunEnsemble(world, 3, 7, processes = 2)
+    self.assertEqual(serial, parallel)
+    self.assertEqual([r[0] for r in serial], [0, 1, 2])
+    for (replica, seed, exhaustion_dates, stopped_by) in serial:
+      self.assertEqual(stopped_by, 'exhaustion')
+    # The parent's copy of the world is never started.
+    self.assertEqual(world.result, None)
+
+
+if __name__ == '__main__':
+  suite = unittest.TestLoader().loadTestsFromTestCase(EnsembleTestCase)
+  unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+ingest_test.py
+
+Tests for parallel parsing and application of delegated files.
+"""
+import sys
+sys.path.append(".")
+import delegated
+import ingest
+import os
+import simulation
+import tempfile
+import unittest
+
+_IANA_LINES = """2|iana|20080101|6|19830101|20080101|+0000
+iana|*|ipv4|*|6|summary
+iana|ZZ|ipv4|10.0.0.0|16777216|19940301|ietf
+iana|ZZ|ipv4|20.0.0.0|16777216|19950101|ripencc
+iana|ZZ|ipv4|22.0.0.0|33554432|19930101|arin
+iana|US|ipv4|3.0.0.0|16777216|19880223|assigned
+iana|ZZ|ipv4|30.0.0.0|16777216|19970101|various
+iana|ZZ|ipv6|2001::|32|19990101|arin
+"""
+
+_NRO_LINES = """2|nro|20080101|6|19830101|20080101|+0000
+# ripencc|IE|ipv4|20.9.0.0|256|19960101|allocated
+ripencc|IE|ipv4|20.0.0.0|36864|19960101|allocated
+ripencc|GB|ipv4|20.1.0.0|65536|00000000|allocated
+arin|US|ipv4|23.0.0.0|1024|19950601|assigned
+arin|CA|ipv4|22.0.0.0|512|19950101|assigned
+arin|US|ipv6|2001:400::|32|19990101|allocated
+iana|ZZ|ipv4|10.0.0.0|16777216|19940301|ietf
+"""
+
+class IngestTestCase(unittest.TestCase):
+
+  def setUp(self):
+    self.files = []
+    self.iana_file = self._File(_IANA_LINES)
+    self.nro_file = self._File(_NRO_LINES)
+    self.cache_dir = tempfile.mkdtemp()  # Not the repository's data/cache
+
+  def tearDown(self):
+    for filename in self.files:
+      os.remove(filename)
+    ingest.ClearCache(self.cache_dir)
+
+  def _File(self, contents):
+    (handle, filename) = tempfile.mkstemp()
+    os.write(handle, contents)
+    os.close(handle)
+    self.files.append(filename)
+    return filename
+
+  def testChunkBoundaries(self):
+    whole = ingest.ParseFile(self.nro_file, processes = 1,
+                             cache_dir = self.cache_dir)
+    for chunks in (2, 3, 7, 50):
+      parts = ingest.Records()
+      for (start, end) in ingest.ChunkRanges(self.nro_file, chunks):
+        parts.Extend(ingest.ParseChunk((self.nro_file, start, end, None)))
+      self.assertEqual(list(parts.Rows()), list(whole.Rows()))
+
+  def testParseFile(self):
+    records = ingest.ParseFile(self.nro_file, processes = 2,
+                               zero_date = "19930101",
+                               cache_dir = self.cache_dir)
+    rows = list(records.Rows())
+    self.assertEqual(len(rows), 6)
+    self.assertEqual(rows[0], ('ripencc', 'IE', 'allocated',
+                               delegated.AddressToInt("20.0.0.0"), 17,
+                               19960101, 1))
+    self.assertEqual(rows[1][4:], (20, 19960101, 0))
+    self.assertEqual(rows[2][5], 19930101)
+    self.assertEqual([records.dates[i] for i in records.DateOrder()],
+                     sorted(records.dates))
+
+  @unittest.skipIf(ingest.numpy is None, "NumPy not available")
+  def testParseCache(self):
+    cache_dir = tempfile.mkdtemp()
+    try:
+      fresh = ingest.ParseFile(self.nro_file, processes = 1,
+                               zero_date = "19930101", cache_dir = cache_dir)
+      self.assertEqual(len(os.listdir(cache_dir)), 1)
+      cached = ingest.ParseFile(self.nro_file, processes = 1,
+                                zero_date = "19930101", cache_dir = cache_dir)
+      self.assert_(isinstance(cached.starts, ingest.numpy.memmap))
+      self.assertEqual(list(cached.Rows()), list(fresh.Rows()))
+      self.assertEqual(cached.DateOrder(), fresh.DateOrder())
+      # Different parse options, or different contents, miss the cache.
+      ingest.ParseFile(self.nro_file, processes = 1, cache_dir = cache_dir)
+      self.assertEqual(len(os.listdir(cache_dir)), 2)
+      f = open(self.nro_file, 'a')
+      f.write("arin|US|ipv4|24.0.0.0|256|19950101|assigned\n")
+      f.close()
+      changed = ingest.ParseFile(self.nro_file, processes = 1,
+                                 zero_date = "19930101", cache_dir = cache_dir)
+      self.assertEqual(len(changed), len(fresh) + 1)
+      self.assertEqual(len(os.listdir(cache_dir)), 3)
+      ingest.ClearCache(cache_dir)
+      self.failIf(os.path.exists(cache_dir))
+    finally:
+      if os.path.exists(cache_dir):
+        ingest.ClearCache(cache_dir)
+
+  def testIngestMatchesSerial(self):
+    serial = simulation.timelined()
+    serial.FromIANAProcess(filename = self.iana_file)
+    serial.FromRIRProcess(filename = self.nro_file)
+    parallel = simulation.timelined()
+    cache_dir = tempfile.mkdtemp()
+    try:
+      ingest.Ingest(parallel, self.iana_file, self.nro_file, processes = 2,
+                    cache_dir = cache_dir)
+    finally:
+      ingest.ClearCache(cache_dir)
+    self._AssertSameWorld(serial, parallel)
+
+  def _AssertSameWorld(self, serial, parallel):
+    self.assertEqual(serial.GetRIRNames(), parallel.GetRIRNames())
+    self.assertEqual(serial.GetLIRNames(), parallel.GetLIRNames())
+    self.assertEqual(serial.iana.addresses_used,
+                     parallel.iana.addresses_used)
+    self.assertEqual(sorted(serial.iana.registered_prefixes_by_prefix.items()),
+                     sorted(parallel.iana.registered_prefixes_by_prefix.items()))
+    for name in serial.GetRIRNames():
+      (a, b) = (serial.GetRIRByName(name), parallel.GetRIRByName(name))
+      self.assertEqual(serial.rirs[name]['count'], parallel.rirs[name]['count'])
+      self.assertEqual(a.addresses_used, b.addresses_used)
+      self.assertEqual(a.address_span, b.address_span)
+      self.assertEqual(sorted(a.iana_prefixes), sorted(b.iana_prefixes))
+      self.assertEqual(list(a.free), list(b.free))
+    for name in serial.GetLIRNames():
+      (a, b) = (serial.GetLIRByName(name), parallel.GetLIRByName(name))
+      self.assertEqual(serial.lirs[name]['count'], parallel.lirs[name]['count'])
+      self.assertEqual(a.registered_prefixes_by_prefix,
+                       b.registered_prefixes_by_prefix)
+      self.assertEqual(a.address_supplier.name, b.address_supplier.name)
+
+
+  def testDifference(self):
+    self.assertEqual(ingest.Difference([1, 2, 4, 6], [2, 3, 4, 5, 6, 7]),
+                     ([3, 5, 7], [1]))
+    self.assertEqual(ingest.Difference([], [1, 2]), ([1, 2], []))
+    self.assertEqual(ingest.Difference([1, 1, 2], [1, 2]), ([], [1]))
+
+  def testAppliedLines(self):
+    lines = ingest.AppliedLines(self.nro_file, "19930101", iana = False)
+    self.assertEqual(len(lines), 4)
+    self.assertEqual(lines[0], ("19930101", 'ripencc', 'GB', '',
+                                delegated.AddressToInt("20.1.0.0"), 65536))
+    self.assertEqual([line[0] for line in lines], sorted([line[0]
+                                                          for line in lines]))
+    self.assertEqual(len(ingest.AppliedLines(self.iana_file)), 5)
+
+  def testDeltaIngest(self):
+    iana_lines = _IANA_LINES.splitlines(True)
+    nro_lines = _NRO_LINES.splitlines(True)
+    old_iana = self._File("".join(iana_lines[:4]))
+    old_nro = self._File("".join(nro_lines[:4]))
+    delta = simulation.timelined()
+    self.assertEqual(ingest.DeltaIngest(delta, self.iana_file, self.nro_file),
+                     None)
+    delta.FromIANAProcess(filename = old_iana)
+    delta.FromRIRProcess(filename = old_nro)
+    ingest.RecordApplied(delta, old_iana, old_nro)
+    self.assertEqual(ingest.DeltaIngest(delta, old_iana, old_nro), (0, 0))
+    self.assertEqual(ingest.DeltaIngest(delta, self.iana_file, self.nro_file),
+                     (3, 2))
+    full = simulation.timelined()
+    ingest.Ingest(full, self.iana_file, self.nro_file, processes = 1,
+                  cache_dir = None)
+    self._AssertSameWorld(full, delta)
+    # Withdrawn lines come back out.
+    self.assertEqual(ingest.DeltaIngest(delta, old_iana, self.nro_file),
+                     (0, 0))
+    full = simulation.timelined()
+    ingest.Ingest(full, old_iana, self.nro_file, processes = 1,
+                  cache_dir = None)
+    self._AssertSameWorld(full, delta)
+
+  def testDeltaIngestChangedLines(self):
+    delta = simulation.timelined()
+    ingest.Ingest(delta, self.iana_file, self.nro_file, processes = 1,
+                  cache_dir = None)
+    ingest.RecordApplied(delta, self.iana_file, self.nro_file)
+    # The next day: GB's block shrinks and moves to ARIN, the IANA
+    # redates a block, and an LIR gets a new line.
+    iana_file = self._File(_IANA_LINES.replace(
+        "20.0.0.0|16777216|19950101", "20.0.0.0|16777216|19950102"))
+    nro_file = self._File(_NRO_LINES.replace(
+        "ripencc|GB|ipv4|20.1.0.0|65536|",
+        "arin|GB|ipv4|23.4.0.0|32768|") +
+        "arin|CA|ipv4|22.1.0.0|256|19960101|allocated\n")
+    self.assertEqual(ingest.DeltaIngest(delta, iana_file, nro_file), (1, 2))
+    full = simulation.timelined()
+    ingest.Ingest(full, iana_file, nro_file, processes = 1, cache_dir = None)
+    self._AssertSameWorld(full, delta)
+    self.assertEqual(delta.GetLIRByName('GB').address_supplier.name, 'arin')
+    self.failIf(delta.GetRIRByName('ripencc').tree.Lookup('20.1.0.0/16'))
+    # Withdrawing CA's lines would leave an LIR a rebuild wouldn't make;
+    # the world is left as it was.
+    used = delta.GetRIRByName('arin').addresses_used
+    nro_file = self._File("".join([line for line in
+                                   _NRO_LINES.splitlines(True)
+                                   if "|CA|" not in line]))
+    self.assertEqual(ingest.DeltaIngest(delta, iana_file, nro_file), None)
+    self.assertEqual(delta.GetRIRByName('arin').addresses_used, used)
+
+
+if __name__ == '__main__':
+  suite = unittest.TestLoader().loadTestsFromTestCase(IngestTestCase)
+  unittest.TextTestRunner(verbosity=2).run(suite)
@@ -6,6 +6,7 @@
 import sys
 sys.path.append('.')
 import constants
+import cPickle
 import instrumentation
 import unittest
 
@@ -28,6 +29,25 @@ class InstrumentationTest(unittest.TestCase):
     print result
     self.failUnless(result == ({'invoker': 'IANA', 
       'action': 'add_route_event', 'route': '137.43.4.16/32', 'date': '19930101'},))
-    
+
+  def testSubscribe(self):
+    eventp = instrumentation.event_processor()
+    seen = []
+    def Seen(*args):
+      seen.append(args)
+    eventp.Subscribe('UNIT_TEST', Seen)
+    eventp.ReceiveEvent('UNIT_TEST', 'a', 1)
+    eventp.ReceiveEvent('SET_NAME', 'b')
+    self.assertEqual(seen, [('a', 1)])
+    # Subscribers don't survive pickling; they belong to the run.
+    copy = cPickle.loads(cPickle.dumps(eventp, -1))
+    copy.ReceiveEvent('UNIT_TEST', 'c')
+    self.assertEqual(len(seen), 1)
+    eventp.Unsubscribe('UNIT_TEST', Seen)
+    eventp.ReceiveEvent('UNIT_TEST', 'd')
+    self.assertEqual(len(seen), 1)
+    self.assertRaises(instrumentation.EventError, eventp.Subscribe,
+                      'NO_SUCH_EVENT', Seen)
+
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+ledger_test.py
+
+Tests for the columnar allocation ledger.
+"""
+import sys
+sys.path.append(".")
+import cPickle
+import ledger
+import unittest
+
+class LedgerTestCase(unittest.TestCase):
+  def setUp(self):
+    self.book = ledger.Ledger()
+    self.book.Append('10.0.0.0/8', '19950101', 'RIPE')
+    self.book.Append('192.0.2.1', '19940101')
+    self.book.Append('172.16.0.0/12', '19950101', 'ARIN')
+    self.book.Append('10.0.0.0/8', '19960101', 'RIPE')
+
+  def testPrefixSpelling(self):
+    self.assertEqual(ledger.ParsePrefix('192.0.2.0/24'), (0xc0000200, 24))
+    self.assertEqual(ledger.ParsePrefix('192.0.2.1'), (0xc0000201, 32))
+    self.assertEqual(ledger.ParsePrefix('0/8'), (0, 8))
+    self.assertEqual(ledger.SpellPrefix(0xc0000200, 24), '192.0.2.0/24')
+    self.assertEqual(ledger.SpellPrefix(0xc0000201, 32), '192.0.2.1')
+    self.assertEqual(ledger.OrdinalDate(ledger.DayOrdinal('20080229')),
+                     '20080229')
+
+  def testCompatibilityViews(self):
+    self.assertEqual(self.book.ByDate(),
+                     {'19940101': ['192.0.2.1'],
+                      '19950101': ['10.0.0.0/8', '172.16.0.0/12'],
+                      '19960101': ['10.0.0.0/8']})
+    self.assertEqual(self.book.ByPrefix(),
+                     {'192.0.2.1': ['19940101'],
+                      '10.0.0.0/8': ['19950101', '19960101'],
+                      '172.16.0.0/12': ['19950101']})
+    self.assertEqual(self.book.ByDateItems(),
+                     sorted(self.book.ByDate().items()))
+
+  def testSortedOnRead(self):
+    self.assert_(self.book.unsorted)
+    self.assertEqual([date for (date, prefix, party) in self.book.Rows()],
+                     ['19940101', '19950101', '19950101', '19960101'])
+    self.failIf(self.book.unsorted)
+    self.assertEqual(self.book.Rows()[1], ('19950101', '10.0.0.0/8', 'RIPE'))
+    self.assertEqual(self.book.party_names, ['RIPE', 'ARIN'])
+
+  def testWindow(self):
+    window = self.book.Window(ledger.DayOrdinal('19941231'),
+                              ledger.DayOrdinal('19950101'))
+    self.assertEqual(len(window), 2)
+    self.assertEqual(window.Span(), 2 ** 24 + 2 ** 20)
+    self.assert_(window.ledger.days is self.book.days)
+    self.assertEqual(len(self.book.Window(ledger.DayOrdinal('19970101'))), 0)
+    self.assertEqual(self.book.Window().Span(), 2 * 2 ** 24 + 2 ** 20 + 1)
+
+  def testSpanBetween(self):
+    self.assertEqual(self.book.SpanBetween(), (4, 2 * 2 ** 24 + 2 ** 20 + 1))
+    self.assertEqual(self.book.SpanBetween('19950101', '19950101'),
+                     (2, 2 ** 24 + 2 ** 20))
+    self.assertEqual(self.book.SpanBetween('19950102'), (1, 2 ** 24))
+    self.assertEqual(self.book.SpanBetween(None, '19931231'), (0, 0))
+    self.assertEqual(self.book.ByDateItems().SpanBetween('19940101',
+                                                         '19950101'),
+                     (3, 2 ** 24 + 2 ** 20 + 1))
+    # Running totals survive sorting and pickling.
+    copy = cPickle.loads(cPickle.dumps(self.book, -1))
+    copy.Append('10.1.0.0/16', '19930101')
+    self.assertEqual(copy.SpanBetween(None, '19940101'), (2, 2 ** 16 + 1))
+    self.assertEqual(copy.cumulative[-1], 2 * 2 ** 24 + 2 ** 20 + 2 ** 16 + 1)
+
+  def testDateItemsKeptUpToDate(self):
+    items = self.book.ByDateItems()
+    self.book.Append('10.1.0.0/16', '19960101')
+    self.book.Append('10.2.0.0/16', '19970101')
+    self.assertEqual(self.book.ByDateItems(),
+                     sorted(self.book.ByDate().items()))
+    # What we handed out before is left as it was.
+    self.assertEqual(items[-1], ('19960101', ['10.0.0.0/8']))
+    self.book.Append('10.3.0.0/16', '19930101')
+    self.assertEqual(self.book.ByDateItems(),
+                     sorted(self.book.ByDate().items()))
+
+  def testPickle(self):
+    self.book.ByDateItems()
+    copy = cPickle.loads(cPickle.dumps(self.book, -1))
+    self.assertEqual(copy.date_items, None)
+    self.assertEqual(copy.Rows(), self.book.Rows())
+
+  def testMembership(self):
+    self.assert_(self.book.Has('10.0.0.0/8'))
+    self.assert_(self.book.Has('192.0.2.1/32'))
+    self.failIf(self.book.Has('10.0.0.0/9'))
+    self.failIf(self.book.Has('110.0.0.0/8'))
+    self.assertEqual(self.book.Count(), 3)
+
+  def testOverlaps(self):
+    self.assert_(self.book.Overlaps('10.0.0.0/8'))
+    self.assert_(self.book.Overlaps('10.20.0.0/16'))  # Inside a row
+    self.assert_(self.book.Overlaps('172.0.0.0/8'))  # Holds a row
+    self.assert_(self.book.Overlaps('192.0.2.0/24'))
+    self.failIf(self.book.Overlaps('11.0.0.0/8'))
+    self.failIf(self.book.Overlaps('172.32.0.0/12'))
+    self.failIf(self.book.Overlaps('192.0.2.2/31'))
+    self.assert_(self.book.Overlaps('0.0.0.0/0'))
+    # The indices are rebuilt, not pickled.
+    copy = cPickle.loads(cPickle.dumps(self.book, -1))
+    self.failIf('exact' in self.book.__getstate__())
+    self.assert_(copy.Has('172.16.0.0/12'))
+    self.assert_(copy.Overlaps('172.16.1.0/24'))
+    self.assertEqual(copy.Count(), 3)
+
+  def testOverlapsTail(self):
+    # New networks wait in the tail until Overlaps() wants them sorted.
+    self.book.Overlaps('0.0.0.0/0')
+    self.book.Append('9.0.0.0/16', '19970101')
+    self.book.Append('10.0.0.0/16', '19970101')
+    self.book.Append('10.0.0.0/8', '19970101')
+    self.assertEqual(self.book.tail, [9 << 24, 10 << 24])
+    self.assert_(self.book.Overlaps('9.0.0.0/8'))
+    self.assertEqual(self.book.tail, [])
+    self.assertEqual(list(self.book.starts), sorted(self.book.starts))
+    self.failIf(self.book.Overlaps('9.1.0.0/16'))
+    copy = cPickle.loads(cPickle.dumps(self.book, -1))
+    self.assertEqual(copy.tail, [])
+    self.assertEqual(copy.exact, self.book.exact)
+    self.assertEqual(copy.held_lengths, self.book.held_lengths)
+    self.assertEqual(sorted(set(copy.starts)), sorted(set(self.book.starts)))
+
+  def testRemove(self):
+    self.book.ByDateItems()
+    self.book.Remove('10.0.0.0/8', '19950101')
+    self.assertEqual(self.book.Rows(),
+                     [('19940101', '192.0.2.1', None),
+                      ('19950101', '172.16.0.0/12', 'ARIN'),
+                      ('19960101', '10.0.0.0/8', 'RIPE')])
+    self.assertEqual(self.book.SpanBetween(), (3, 2 ** 24 + 2 ** 20 + 1))
+    self.assertEqual(self.book.ByDateItems()[-1], ('19960101', ['10.0.0.0/8']))
+    self.assert_(self.book.Has('10.0.0.0/8'))
+    self.book.Remove('10.0.0.0/8', '19960101')
+    self.failIf(self.book.Has('10.0.0.0/8'))
+    self.failIf(self.book.Overlaps('10.1.0.0/16'))
+    self.assert_(self.book.Overlaps('172.0.0.0/8'))
+    self.assertEqual(self.book.Count(), 2)
+    self.assertRaises(KeyError, self.book.Remove, '172.16.0.0/12', '19960101')
+
+  def testFromDicts(self):
+    rebuilt = ledger.FromDicts(self.book.ByDate())
+    self.assertEqual([row[:2] for row in rebuilt.Rows()],
+                     [row[:2] for row in self.book.Rows()])
+
+
+if __name__ == '__main__':
+  suite = unittest.TestLoader().loadTestsFromTestCase(LedgerTestCase)
+  unittest.TextTestRunner(verbosity=2).run(suite)
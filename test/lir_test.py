@@ -9,8 +9,13 @@ sys.path.append(".")
 import constants
 import datetime
 import math
+import timeline
 import unittest
+import cPickle
+import behaviour
+import ledger
 import lir
+import random
 
 class AddressHolderTestCase(unittest.TestCase):
   def setUp(self):
@@ -73,6 +78,26 @@ instead got [%s]" % result)
     result2 = self.addr_hold.GetSpaceExhausted()
     self.assertEqual(result2, True, "Space exhausted should have been set to True")
 
+  def testAddressHolderPublishesExhaustion(self):
+    exhausted = []
+    self.addr_hold.instrument.Subscribe('SPACE_EXHAUSTED', exhausted.append)
+    self.addr_hold._SetSpaceExhausted(True)
+    self.addr_hold._SetSpaceExhausted(True)  # No change, so no event
+    self.addr_hold._SetSpaceExhausted(False)  # Not running out
+    self.assertEqual(exhausted, [self.addr_hold])
+
+  def testAddressHolderPublishesThresholds(self):
+    crossed = []
+    def Crossed(holder, percentage):
+      crossed.append((holder, percentage))
+    self.addr_hold.instrument.Subscribe('SPACE_THRESHOLD', Crossed)
+    self.addr_hold._AddTreePrefix('10.0.0.0/16', 'test', False)
+    self.assertEqual(crossed, [])  # Still all free
+    self.addr_hold._AddTreePrefix('11.0.0.0/16', 'test', True)
+    self.assertEqual(crossed, [(self.addr_hold, 50.0)])
+    self.addr_hold._RemoveTreePrefix('11.0.0.0/16', True)
+    self.assertEqual(crossed, [(self.addr_hold, 50.0), (self.addr_hold, 100)])
+
   def testAddressHolderRegisterPrefix(self):
     today = self.addr_hold.GetDate()
     self.addr_hold._RegisterPrefix('137.43.4.16', today)
@@ -169,7 +194,11 @@ instead got [%s]" % result)
 class AddressSupplier(unittest.TestCase):
   
   def setUp(self):
-    self.addr_supp = lir.address_supplier()
+    # An RIR is the address supplier that hands out of the blocks it holds;
+    # its IANA has nothing more to give.
+    self.addr_supp = lir.rir()
+    self.addr_supp.address_supplier = lir.iana()
+    self.addr_supp.address_supplier._SetSpaceExhausted(True)
 
   def testAddressSupplierNew(self):
     self.assert_(self.addr_supp, 
@@ -179,8 +208,8 @@ class AddressSupplier(unittest.TestCase):
     fake_lir = lir.lir()
     supplier = fake_lir.address_supplier
     self.assertEqual(supplier, None)
-    fake_lir.set_address_supplier(self.addr_supp)
-    supplier = fake_lir.get_address_supplier()
+    fake_lir.address_supplier = self.addr_supp
+    supplier = fake_lir.address_supplier
     self.assertEqual(supplier, self.addr_supp)
 
   def testAddressSupplierMakeRequestFailure(self):
@@ -190,10 +219,10 @@ class AddressSupplier(unittest.TestCase):
 
   def testAddressSupplierMakeRequestSuccess(self):
     fake_lir = lir.lir()
-    self.addr_supp._AddTreePrefix('0.0.0.0/8', "MakeRequestSuccess")
+    self.addr_supp._AddTreePrefix('0.0.0.0/8', "MakeRequestSuccess", False)
     result = self.addr_supp.Request(fake_lir, 8)
     self.assertEqual(result, '0.0.0.0/8')
-    self.addr_supp._AddTreePrefix('1.0.0.0/8', "test_addrsupp_make")
+    self.addr_supp._AddTreePrefix('1.0.0.0/8', "test_addrsupp_make", False)
     result = self.addr_supp.Request(fake_lir, 8)
     self.assertEqual(result, '1.0.0.0/8')
 
@@ -202,8 +231,15 @@ class AddressSupplier(unittest.TestCase):
     pass
 
   def testAddressSupplierCountRequests(self):
-    # TODO(niallm): unimplemented
-    pass
+    fake_lir = lir.lir()
+    self.addr_supp._AddTreePrefix('41.0.0.0/8', "CountRequests", False)
+    self.assertEqual(self.addr_supp._CountFulfilledRequests(), 0)
+    result = self.addr_supp.Request(fake_lir, 16)
+    self.assertEqual(self.addr_supp._CountFulfilledRequests(), 1)
+    self.assert_(self.addr_supp._HaveGivenOut(result))
+    self.failIf(self.addr_supp._HaveGivenOut('1.0.0.0/16'))
+    self.assert_(self.addr_supp._HaveGivenOutOverlapping('41.0.0.0/8'))
+    self.failIf(self.addr_supp._HaveGivenOutOverlapping('41.1.0.0/16'))
   
 
 class AddressHolderPrefixTestCase(unittest.TestCase):
@@ -223,6 +259,32 @@ class AddressHolderPrefixTestCase(unittest.TestCase):
                  "Address holder has zero length prefix registration - got \
                  [%s]" % result)
 
+  def testAddressHolderSlots(self):
+    self.failIf(hasattr(self.addr_hold, '__dict__'))
+    self.assertRaises(AttributeError, setattr, self.addr_hold, 'wibble', 1)
+    self.addr_hold.id = 7
+    copy = cPickle.loads(cPickle.dumps(self.addr_hold, -1))
+    self.assertEqual(copy.id, 7)
+    self.assertEqual(copy.name, self.addr_hold.name)
+    self.assert_(copy._HaveRegistered(self.prefix))
+
+  def testAddressHolderNotes(self):
+    self.addr_hold.id = 3
+    self.addr_hold._AddTreePrefix('10.0.0.0/16', "by test", True, '19950101')
+    notes = [data for (prefix, data) in self.addr_hold.tree.IterateNodes(True)
+             if prefix == '10.0.0.0/16']
+    self.assertEqual(notes, [(3, ledger.DayOrdinal('19950101'), "by test")])
+
+  def testAddressHolderHaveRegisteredExactly(self):
+    self.assert_(self.addr_hold._AddTreePrefix('41.0.0.0/8', "exactly"))
+    # Not a substring match: 1.0.0.0/8 is inside the spelling of 41.0.0.0/8.
+    self.failIf(self.addr_hold._HaveRegistered('1.0.0.0/8'))
+    self.failIf(self.addr_hold._HaveRegistered('37.43.0.0/16'))
+    self.failIf(self.addr_hold._HaveRegisteredOverlapping('1.0.0.0/8'))
+    self.assert_(self.addr_hold._HaveRegisteredOverlapping('41.2.3.0/24'))
+    self.assert_(self.addr_hold._HaveRegisteredOverlapping('137.0.0.0/8'))
+    self.failIf(self.addr_hold._HaveRegisteredOverlapping('137.44.0.0/16'))
+
 class IANATestCase(unittest.TestCase):
   def setUp(self):
     self.iana = lir.iana()
@@ -294,6 +356,119 @@ class RIRTestCase(unittest.TestCase):
   def testRIRNew(self):
     self.assert_(self.rir, "RIR could not be created")
 
+  def testRIRCapacityIndex(self):
+    self.rir._AddTreePrefix('10.0.0.0/22', 'first', False, '19950101')
+    self.rir._AddTreePrefix('10.1.0.0/22', 'second', False, '19950101')
+    self.rir.address_supplier = self.iana
+    fake_lir = lir.lir()
+    self.assertEqual(self.rir.Request(fake_lir, 23), '10.0.0.0/23')
+    self.assertEqual(self.rir.Request(fake_lir, 23), '10.0.2.0/23')
+    self.assertEqual(self.rir.capacity, {})
+    # The first block is full now; once we've seen that, we skip it.
+    self.assertEqual(self.rir.Request(fake_lir, 23), '10.1.0.0/23')
+    self.assertEqual(self.rir.capacity, {'10.0.0.0/22': 23})
+    searched = []
+    find_gap_from = self.rir.tree.FindGapFrom
+    def FindGapFrom(prefix, size):
+      searched.append(prefix)
+      return find_gap_from(prefix, size)
+    self.rir.tree.FindGapFrom = FindGapFrom
+    self.assertEqual(self.rir.Request(fake_lir, 23), '10.1.2.0/23')
+    self.assertEqual(searched, ['10.1.0.0/22'])
+
+  def testRIRWholeBlockAllocated(self):
+    self.rir._AddTreePrefix('11.0.0.0/16', 'first', False, '19950101')
+    self.rir._AddTreePrefix('12.0.0.0/15', 'second', False, '19950101')
+    self.rir.address_supplier = self.iana
+    self.iana._SetSpaceExhausted(True)
+    held = (self.rir.AddressesAvailable(), list(self.rir.iana_prefixes))
+    fake_lir = lir.lir()
+    self.assertEqual(self.rir.Request(fake_lir, 16), '11.0.0.0/16')
+    # Not 11.1.0.0/16, which we don't hold.
+    self.assertEqual(self.rir.Request(fake_lir, 16), '12.0.0.0/16')
+    self.assertEqual(self.rir.Request(fake_lir, 16), '12.1.0.0/16')
+    self.assertEqual(self.rir.Request(fake_lir, 16), None)
+    # Nothing was taken in from outside what we hold.
+    self.assertEqual((self.rir.AddressesAvailable(),
+                      list(self.rir.iana_prefixes)), held)
+
+  def testRIRCapacityAfterRemoval(self):
+    self.rir._AddTreePrefix('10.0.0.0/15', 'first', False, '19950101')
+    self.rir._AddTreePrefix('10.2.0.0/15', 'second', False, '19950101')
+    self.rir._AddTreePrefix('10.0.0.0/16', 'line', True, '19950101')
+    self.rir.address_supplier = self.iana
+    fake_lir = lir.lir()
+    self.assertEqual(self.rir.Request(fake_lir, 16), '10.1.0.0/16')
+    self.assertEqual(self.rir.Request(fake_lir, 16), '10.2.0.0/16')
+    self.assertEqual(self.rir.capacity, {'10.0.0.0/15': 16})
+    # Withdrawing the line makes room in the first block again.
+    self.rir._RemoveTreePrefix('10.0.0.0/16', True, '19950101')
+    self.assertEqual(self.rir.capacity, {})
+    self.assertEqual(self.rir.Request(fake_lir, 16), '10.0.0.0/16')
+
+  def testRIRContiguousExhaustion(self):
+    self.rir._AddTreePrefix('10.0.0.0/22', 'first', False, '19950101')
+    self.rir.address_supplier = self.iana
+    self.iana._SetSpaceExhausted(True)
+    fake_lir = lir.lir()
+    self.assertEqual(self.rir.LargestAllocatable(), 22)
+    self.assertEqual(self.rir.Request(fake_lir, 24), '10.0.0.0/24')
+    self.assertEqual(self.rir.Request(fake_lir, 23), '10.0.2.0/23')
+    self.assertEqual(self.rir.Request(fake_lir, 23), None)
+    # A /24 is left, but nothing as big as a /23.
+    self.assertEqual(self.rir.LargestAllocatable(), 24)
+    self.assertEqual(self.rir.FitMask(), ((1 << 33) - 1) & ~((1 << 24) - 1))
+    self.assertTrue(self.rir.GetSpaceExhausted(16))
+    self.assertTrue(self.rir.GetSpaceExhausted(23))
+    self.assertFalse(self.rir.GetSpaceExhausted(24))
+    # We know without looking.
+    self.rir.tree.FindGapFrom = None
+    self.assertEqual(self.rir.Request(fake_lir, 22), None)
+    del self.rir.tree.FindGapFrom
+    self.assertEqual(self.rir.Request(fake_lir, 24), '10.0.1.0/24')
+    self.assertEqual(self.rir.LargestAllocatable(), None)
+    self.assertEqual(self.rir.FitMask(), 0)
+    self.rir._AddTreePrefix('10.1.0.0/22', 'second', False, '19950101')
+    self.assertTrue(self.rir.CanSatisfy(22))
+    self.assertEqual(self.rir.LargestAllocatable(), 22)
+
+  def testRIRScatteredFreeBlocks(self):
+    # Two /25s from different /24s: plenty of /25s, but no /24.
+    self.rir._AddTreePrefix('10.0.0.0/25', 'first', False, '19950101')
+    self.rir._AddTreePrefix('10.0.1.128/25', 'second', False, '19950101')
+    self.rir.address_supplier = self.iana
+    self.iana._SetSpaceExhausted(True)
+    self.assertEqual(self.rir.LargestAllocatable(), 25)
+    self.assertEqual(self.rir.free[25], 2)
+    self.assertEqual(self.rir.FitMask(), ((1 << 33) - 1) & ~((1 << 25) - 1))
+    self.assertTrue(self.rir.GetSpaceExhausted(24))
+    self.assertFalse(self.rir.GetSpaceExhausted(25))
+    fake_lir = lir.lir()
+    self.assertEqual(self.rir.Request(fake_lir, 24), None)
+    # Taking a /26 splits one /25, leaving the other whole.
+    self.assertEqual(self.rir.Request(fake_lir, 26), '10.0.0.0/26')
+    self.assertEqual((self.rir.free[25], self.rir.free[26]), (1, 1))
+    self.assertEqual(self.rir.LargestAllocatable(), 25)
+    self.assertEqual(self.rir.Request(fake_lir, 25), '10.0.1.128/25')
+    self.assertEqual(self.rir.LargestAllocatable(), 26)
+    # Counting afresh from the tree agrees.
+    (free, fit) = (list(self.rir.free), self.rir.fit)
+    self.rir._CountFree()
+    self.assertEqual((list(self.rir.free), self.rir.fit), (free, fit))
+
+  def testHolderOneSlash24(self):
+    holder = lir.address_holder()
+    holder._AddTreePrefix('10.0.0.0/24', 'only', False, '19950101')
+    self.assertEqual(holder.LargestAllocatable(), 24)
+    self.assertTrue(holder.GetSpaceExhausted(23))
+    self.assertFalse(holder.GetSpaceExhausted(24))
+
+class _RetryLater(behaviour.LIR_Static):
+  """LIR_Static, retrying on a fixed date when refused."""
+
+  def Failed(self, cur_date, supplied_timeline, callback, key=None):
+    return supplied_timeline.RegisterCallbackAtDate('19950301', callback, key)
+
 class LIRTestCase(unittest.TestCase):
   def setUp(self):
     self.rir = lir.rir()
@@ -302,10 +477,92 @@ class LIRTestCase(unittest.TestCase):
   def testLIRNew(self):
     self.assert_(self.lir, "LIR could not be created")
 
+  def testLIRSinglePendingCallback(self):
+    tl = timeline.Timeline()
+    self.rir._AddTreePrefix('10.0.0.0/8', 'test_lir', False, '19950101')
+    self.lir = lir.lir(requested_behaviour = 'LIR_Static(16)')
+    self.lir.address_supplier = self.rir
+    self.lir.SetDate('19950101')
+    self.lir.ActivityCallback(tl)
+    self.lir.ActivityCallback(tl)
+    pending = list(tl.RangeQuery('19930101', '20500101'))
+    self.assertEqual(len(pending), 1)
+    self.assertEqual(self.lir.addresses_used, 2 * 2 ** 16)
+
+  def _BatchedDate(self, policy):
+    """Two LIRs asking on one date, served as policy says; returns what
+    they were given."""
+    tl = timeline.Timeline()
+    self.rir._AddTreePrefix('10.0.0.0/8', 'test_lir', False, '19950101')
+    lirs = []
+    for size in (22, 16):
+      requester = lir.lir(requested_behaviour = 'LIR_Static(%s)' % size)
+      requester.address_supplier = self.rir
+      tl.RegisterCallbackAtDate('19950101', [requester.ActivityCallback])
+      lirs.append(requester)
+    saved = constants.defines._RIR_REQUEST_POLICY
+    constants.defines._RIR_REQUEST_POLICY = policy
+    try:
+      served = []
+      for callback in tl.WalkAlong(until = '19950101'):
+        served.append(self.rir.request_queue[:])
+        callback(tl)
+    finally:
+      constants.defines._RIR_REQUEST_POLICY = saved
+    # The RIR served the queue once, after both LIRs had asked.
+    self.assertEqual([len(queue) for queue in served], [0, 1, 2])
+    self.assertEqual(self.rir.request_queue, [])
+    return [sorted(requester.registered_prefixes_by_prefix.keys())
+            for requester in lirs]
+
+  def _RefusedPending(self, policy):
+    """An LIR refused on its first date, with requests batched as policy
+    says; returns (name, action) to date for what is left pending."""
+    random.seed(5)
+    tl = timeline.Timeline()
+    supplier = lir.rir()
+    supplier.address_supplier = lir.iana()
+    supplier.address_supplier._SetSpaceExhausted(True)
+    supplier._AddTreePrefix('10.0.0.0/24', 'test_lir', False, '19950101')
+    requester = lir.lir(supplied_name = 'refused')
+    requester.behaviour = _RetryLater('16')
+    requester.address_supplier = supplier
+    tl.RegisterCallbackAtDate('19950101', [requester.ActivityCallback])
+    saved = constants.defines._RIR_REQUEST_POLICY
+    constants.defines._RIR_REQUEST_POLICY = policy
+    try:
+      for callback in tl.WalkAlong(until = '19950101'):
+        callback(tl)
+    finally:
+      constants.defines._RIR_REQUEST_POLICY = saved
+    self.assertEqual(requester.addresses_used, 0)
+    return dict([((key[0].name, key[1]), handle.date)
+                 for (key, handle) in tl.pending_by_key.items()])
+
+  def testLIRBatchedRefusalPendingAsUnbatched(self):
+    unbatched = self._RefusedPending(None)
+    self.assertEqual(unbatched.keys(), [('refused', 'ActivityCallback')])
+    # The ask again date replaces the behaviour's retry.
+    self.assertNotEqual(unbatched.values(), ['19950301'])
+    self.assertEqual(self._RefusedPending('fifo'), unbatched)
+
+  def testLIRBatchedRequests(self):
+    self.assertEqual(self._BatchedDate('fifo'),
+                     [['10.0.0.0/22'], ['10.1.0.0/16']])
+
+  def testLIRBatchedRequestsLargestFirst(self):
+    self.assertEqual(self._BatchedDate('largest'),
+                     [['10.1.0.0/22'], ['10.0.0.0/16']])
+
+  def testLIRBatchedRequestsUnknownPolicy(self):
+    self.assertRaises(ValueError, self._BatchedDate, 'smallest')
+
 
 if __name__ == '__main__':
   suite = unittest.TestLoader().loadTestsFromTestCase(AddressHolderTestCase)
   unittest.TextTestRunner(verbosity=2).run(suite)
+  suite = unittest.TestLoader().loadTestsFromTestCase(AddressSupplier)
+  unittest.TextTestRunner(verbosity=2).run(suite)
   suite = unittest.TestLoader().loadTestsFromTestCase(AddressHolderPrefixTestCase)
   unittest.TextTestRunner(verbosity=2).run(suite)
   suite = unittest.TestLoader().loadTestsFromTestCase(IANATestCase)
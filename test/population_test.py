@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+population_test.py
+
+Tests for the lazily made, per-organisation LIR population.
+"""
+import sys
+sys.path.append(".")
+import delegated
+import ledger
+import random
+import stats
+import unittest
+import worlds
+
+def _Row(registry, country, status, address, plen, date, org):
+  return (registry, country, status, delegated.AddressToInt(address), plen,
+          date, 1, org)
+
+class PopulationTestCase(unittest.TestCase):
+
+  def setUp(self):
+    """The RIRs of worlds.SmallWorld, and three organisations, one of them
+    without an id."""
+    self.org_rows = [
+      _Row('north', 'IE', 'allocated', '10.0.0.0', 20, '19960101', 'org-a'),
+      _Row('north', 'GB', 'assigned', '10.0.32.0', 22, '19960101', 'org-b'),
+      _Row('north', 'IE', 'allocated', '10.0.16.0', 20, '19970101', 'org-a'),
+      _Row('north', '', 'available', '10.1.0.0', 16, '', ''),
+      _Row('south', 'FR', 'allocated', '10.16.0.0', 20, '19960101', '')]
+    self.sim = worlds.SmallWorld(lirs = False)
+    self.sim.ApplyOrgRecords(self.org_rows, 'LIR_Static(16)', 'RIR_Standard')
+    self.population = self.sim.population
+
+  def testOnlyRIRsFilledIn(self):
+    self.assertEqual(len(self.population), 3)
+    self.assertEqual(self.population.names, ['IE.org-a', 'GB.org-b', 'FR.FR'])
+    self.assertEqual(self.sim.GetLIRNames(), [])
+    self.assertEqual(self.sim.GetRIRByName('north').addresses_used,
+                     2 * 2 ** 12 + 2 ** 10)
+    # The RIRs end up as they would one LIR per country.
+    eager = worlds.SmallWorld(lirs = False)
+    eager.ApplyRIRRecords([row[:7] for row in self.org_rows
+                           if row[2] != 'available'],
+                          'LIR_Static(16)', 'RIR_Standard')
+    for name in ('north', 'south'):
+      (ours, theirs) = (self.sim.GetRIRByName(name), eager.GetRIRByName(name))
+      self.assertEqual((ours.address_span, ours.addresses_used),
+                       (theirs.address_span, theirs.addresses_used))
+      self.assertEqual(ours.registered.Rows(), theirs.registered.Rows())
+
+  def testLookupMakes(self):
+    org_a = self.sim.GetLIRByName('IE.org-a')
+    self.assertEqual(self.sim.GetLIRNames(), ['IE.org-a'])
+    self.assert_(self.sim.GetLIRByName('IE.org-a') is org_a)
+    self.assert_(self.sim.GetHolder(org_a.id) is org_a)
+    self.assert_(org_a.address_supplier is self.sim.GetRIRByName('north'))
+    self.assertEqual(org_a.GetCountry(), 'IE')
+    self.assertEqual(org_a.addresses_used, 2 * 2 ** 12)
+    self.assertEqual(org_a.registered.Rows(),
+                     [('19960101', '10.0.0.0/20', 'north'),
+                      ('19970101', '10.0.16.0/20', 'north')])
+    self.assertEqual(self.sim.lirs['IE.org-a']['count'], 2)
+    self.assertEqual(org_a.behaviour.args, '16')
+    self.assert_(self.sim.GetLIRByName('FR.FR').behaviour is org_a.behaviour)
+    self.assertEqual(self.sim.GetLIRByName('GB.org-a'), None)
+    self.assertEqual(self.sim.GetLIRByName('IE.nobody'), None)
+
+  def testSeed(self):
+    rollup = stats.Rollup()
+    self.population.Seed(rollup)
+    self.assertEqual(rollup.Totals('lir'), (3 * 2 ** 12 + 2 ** 10,) * 2)
+    self.assertEqual(rollup.Totals('lir', 'north'),
+                     (2 * 2 ** 12 + 2 ** 10,) * 2)
+    self.assertEqual(rollup.Totals('lir', country = 'IE'), (2 * 2 ** 12,) * 2)
+    # Those already made count for themselves.
+    org_a = self.sim.GetLIRByName('IE.org-a')
+    rollup = stats.Rollup()
+    self.population.Seed(rollup)
+    self.assertEqual(rollup.Totals('lir', country = 'IE'), (0, 0))
+    rollup.Seed([org_a])
+    self.assertEqual(rollup.Totals('lir', country = 'IE'), (2 * 2 ** 12,) * 2)
+
+  def testSchedule(self):
+    self.sim.GetLIRByName('GB.org-b')
+    self.assertEqual(self.population.Schedule(self.sim.timeline, '19980101'),
+                     2)
+    dates = list(self.sim.timeline.dates)
+    self.assert_(1 <= len(dates) <= 2)
+    for date in dates:
+      self.assert_('19980102' <= date <= '19980107')
+    self.assertEqual(sorted(sum([list(due) for due in
+                                 self.population.due.values()], [])),
+                     [0, 2])
+    # Nobody is made until they are due.
+    self.assertEqual(self.sim.GetLIRNames(), ['GB.org-b'])
+    for callback in self.sim.timeline.WalkAlong(until = '19980107'):
+      callback(self.sim.timeline)
+    self.assertEqual(self.sim.GetLIRNames(), ['FR.FR', 'GB.org-b', 'IE.org-a'])
+    self.assertEqual(self.population.due, {})
+    org_a = self.sim.GetLIRByName('IE.org-a')
+    self.assert_(self.sim.timeline.GetPending((org_a, 'ActivityCallback')))
+
+  def testOneEventPerDate(self):
+    # A /24 each for a thousand organisations.
+    start = ledger.ParsePrefix('10.2.0.0/16')[0]
+    self.sim.ApplyOrgRecords(
+      [('north', 'IE', 'allocated', start + (number << 8), 24, '19960101', 1,
+        'many-%s' % number) for number in range(1000)])
+    self.assertEqual(self.population.Schedule(self.sim.timeline, '19980101'),
+                     1003)
+    self.assert_(len(self.sim.timeline.dates) <= 6)
+    self.assertEqual(sum([len(due) for due in self.population.due.values()]),
+                     1003)
+
+  def testScheduleRepeats(self):
+    random.seed(3)
+    self.population.Schedule(self.sim.timeline, '19980101')
+    first = dict(self.population.due)
+    random.seed(3)
+    self.population.Schedule(self.sim.timeline, '19980101')
+    self.assertEqual(self.population.due, first)
+
+  def testScheduleByRegistry(self):
+    self.population.SeedStreams(5)
+    random.seed(1)
+    self.assertEqual(self.population.Schedule(self.sim.timeline, '19980101'),
+                     3)
+    both = dict(self.population.due)
+    self.assertEqual(sorted(set([registry for (registry, day) in both])),
+                     ['north', 'south'])
+    # A registry on its own, whatever random is up to, wakes the same.
+    random.seed(2)
+    self.population.due = dict()
+    self.assertEqual(self.population.Schedule(self.sim.timeline, '19980101',
+                                              registry = 'south'), 1)
+    self.assertEqual(self.population.due,
+                     dict([(key, due) for (key, due) in both.items()
+                           if key[0] == 'south']))
+    for (registry, day) in both:
+      handle = self.sim.timeline.GetPending((self.population, 'Wake', day,
+                                             registry))
+      self.assertEqual(handle.rank, registry)
+    self.assertEqual(self.population.Lookup('FR.FR').stream.state,
+                     self.population._Stream('FR.FR').state)
+
+  def testRun(self):
+    result = self.sim.Run()
+    self.assertEqual(result.stopped_by, 'exhaustion')
+    self.assertEqual(self.sim.GetLIRNames(), ['FR.FR', 'GB.org-b', 'IE.org-a'])
+    # What the organisations held to begin with is counted once.
+    self.assertEqual(result.stats.Totals('lir')[1],
+                     sum([holder.addresses_used
+                          for holder in self.sim.GetLIRs()]))
+
+
+if __name__ == '__main__':
+  suite = unittest.TestLoader().loadTestsFromTestCase(PopulationTestCase)
+  unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+shard_test.py
+
+Tests for running a simulation with one process per RIR.
+"""
+import sys
+sys.path.append(".")
+import ensemble
+import Queue
+import shard
+import unittest
+import worlds
+
+class ShardTestCase(unittest.TestCase):
+
+  def testProxy(self):
+    requests = Queue.Queue()
+    replies = Queue.Queue()
+    proxy = shard.IANAProxy('north', requests, replies)
+    # Until the IANA is exhausted, asking means waiting our turn.
+    replies.put(('GRANT', None, (False, 50.0)))
+    self.assertEqual(proxy.GetSpaceExhausted(), False)
+    self.assertEqual(requests.get_nowait(), ('REQUEST', 'north', None))
+    self.assertEqual(proxy.AddressPercentageLeft(), 50.0)
+    # After that, it always will be.
+    proxy.Update((True, 0.0))
+    self.assertEqual(proxy.GetSpaceExhausted(), True)
+    self.assert_(requests.empty())
+    self.assertEqual(proxy.AddressPercentageLeft(), 0.0)
+
+  def testShardedRun(self):
+    world = worlds.SmallWorld()
+    result = shard.RunSharded(world, master_seed = 3)
+    self.assertEqual(result.stopped_by, 'exhaustion')
+    self.assertEqual(sorted(result.exhaustion_dates.keys()),
+                     ['north', 'south'])
+    self.assert_(result.counters['callbacks'] > 0)
+    self.assert_('north' in result.series and 'iana' in result.series)
+    # The shards' IANA requests were served from the coordinator's IANA.
+    self.assert_(world.iana.AddressPercentageLeft() <
+                 worlds.SmallWorld().iana.AddressPercentageLeft() or
+                 len(world.iana._RetrieveFulfilledRequests()) > 0)
+
+  def testShardedRunReproducible(self):
+    first = shard.RunSharded(worlds.SmallWorld(), master_seed = 5)
+    second = shard.RunSharded(worlds.SmallWorld(), master_seed = 5)
+    self.assertEqual(first.exhaustion_dates, second.exhaustion_dates)
+    self.assertEqual(first.series, second.series)
+    self.assertEqual(first.counters, second.counters)
+
+  def testShardedMatchesSingleProcess(self):
+    for seed in (3, 11):
+      single = worlds.SmallWorld()
+      single_result = ensemble.RunSeeded(single, seed)
+      sharded = worlds.SmallWorld()
+      sharded_result = shard.RunSharded(sharded, master_seed = seed)
+      self.assertEqual(sharded_result.exhaustion_dates,
+                       single_result.exhaustion_dates)
+      # Each RIR got the same blocks from the IANA on the same dates.
+      self.assert_(len(single.iana.fulfilled.Rows()) > 0)
+      self.assertEqual(sharded.iana.fulfilled.Rows(),
+                       single.iana.fulfilled.Rows())
+      self.assertEqual(sharded_result.series, single_result.series)
+      self.assertEqual(sharded_result.counters, single_result.counters)
+
+  def testShardedRunUntil(self):
+    result = shard.RunSharded(worlds.SmallWorld(), until = '19960101')
+    self.assertEqual(result.stopped_by, 'until')
+    self.assert_(result.end_date <= '19960101')
+
+  def testShardFailure(self):
+    world = worlds.SmallWorld()
+    world.GetLIRByName('NORTH').behaviour = None
+    self.failUnlessRaises(RuntimeError, shard.RunSharded, world)
+
+
+if __name__ == '__main__':
+  suite = unittest.TestLoader().loadTestsFromTestCase(ShardTestCase)
+  unittest.TextTestRunner(verbosity=2).run(suite)
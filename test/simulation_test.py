@@ -11,9 +11,13 @@ Created by Niall Murphy on 2007-10-13.
 """
 import sys
 sys.path.append(".")
+import behaviour
 import constants
+import delegated
+import random
 import unittest
 import simulation
+import worlds
 
 class SimTestCase(unittest.TestCase):
 
@@ -61,6 +65,24 @@ class SimTestCase(unittest.TestCase):
                      "Incorrect IANA reservations; [%s] not [%s]" % 
                      (constants.defines._IANA_RESERVATIONS, ia_norm))
 
+  def testSimIANAKindCounts(self):
+    records = [('iana', 'ZZ', status, delegated.AddressToInt(start), plen,
+                '19950101', 1)
+               for (status, start, plen) in (('ripencc', '2.0.0.0', 8),
+                                             ('ripencc', '5.0.0.0', 8),
+                                             ('arin', '3.0.0.0', 8),
+                                             ('ietf', '0.0.0.0', 8),
+                                             ('assigned', '4.0.0.0', 8),
+                                             ('various', '6.0.0.0', 7))]
+    self.assertEqual(self.s.ApplyIANARecords(records, 'RIR_Standard'), 6)
+    iana = self.s.iana
+    self.assertEqual(iana.IETFReservedCount(), 2 ** 24)
+    self.assertEqual(iana.IANAAssignedCount(), 2 ** 24)
+    self.assertEqual(iana.IANAVariousCount(), 2 ** 25)
+    self.assertEqual(iana.IANAToRIRCount('ripencc'), 2 * 2 ** 24)
+    self.assertEqual(iana.IANAToRIRCount('arin'), 2 ** 24)
+    self.assertEqual(iana.IANAToRIRCount('lacnic'), 0)
+
   def testSimIANAFullPool(self):
     self.s.FromIANAProcess()
     space = True
@@ -185,6 +207,79 @@ class SimTestCase(unittest.TestCase):
     self.assertEqual(self.s.GetLIRPopulationSize('arin'), 
                      constants.defines._ARIN_POP_SIZE)
 
+  def testSimHolderIds(self):
+    sim = worlds.SmallWorld()
+    everyone = [sim.iana, sim.GetRIRByName('north'), sim.GetLIRByName('NORTH'),
+                sim.GetRIRByName('south'), sim.GetLIRByName('SOUTH')]
+    self.assertEqual([holder.id for holder in everyone], range(5))
+    for holder in everyone:
+      self.assert_(sim.GetHolder(holder.id) is holder)
+    sim.GetLIRByName('NORTH').id = None
+    sim.ReindexHolders()
+    self.assertEqual(sim.GetLIRByName('NORTH').id, 5)
+    self.assertEqual(sim.holders[2], None)
+
+  def testSimApplyBehaviours(self):
+    sim = worlds.SmallWorld()
+    old = sim.GetLIRByName('NORTH').behaviour
+    sim.ApplyBehaviours(lir_behave = 'LIR_Static(15)')
+    new = sim.GetLIRByName('NORTH').behaviour
+    self.assertNotEqual(old, new)
+    self.assertEqual(new.args, '15')
+    self.assertNotEqual(new, sim.GetLIRByName('SOUTH').behaviour)
+    self.assert_(isinstance(sim.GetRIRByName('north').behaviour,
+                            behaviour.RIR_Standard))
+
+  def testSimRunToExhaustion(self):
+    result = worlds.SmallWorld().Run()
+    self.assertEqual(result.stopped_by, 'exhaustion')
+    self.assertEqual(sorted(result.exhaustion_dates.keys()),
+                     ['north', 'south'])
+    self.assert_(result.counters['callbacks'] > 0)
+    self.assert_(result.series['north'][-1][1] < result.series['north'][0][1])
+
+  def testSimRunUntilResumes(self):
+    random.seed(1)
+    whole = worlds.SmallWorld().Run()
+    random.seed(1)
+    sim = worlds.SmallWorld()
+    part = sim.Run(until = '19960101')
+    self.assertEqual(part.stopped_by, 'until')
+    self.assert_(part.end_date <= '19960101')
+    rest = sim.Run()
+    self.assertEqual(rest.exhaustion_dates, whole.exhaustion_dates)
+    self.assertEqual(rest.counters, whole.counters)
+
+  def testSimRunStopCondition(self):
+    def NorthOut(sim, result):
+      return 'north' in result.exhaustion_dates
+    result = worlds.SmallWorld().Run(stop_condition = NorthOut)
+    self.assertEqual(result.stopped_by, 'stop_condition')
+    self.assert_('north' in result.exhaustion_dates)
+
+  def testSimRunKeepsStats(self):
+    sim = worlds.SmallWorld()
+    result = sim.Run(until = '19960101')
+    rollup = result.stats
+    north = sim.GetRIRByName('north')
+    self.assertEqual(rollup.Totals('rir', 'north'),
+                     (north.address_span, north.addresses_used))
+    self.assertEqual(rollup.Totals('iana'),
+                     (sim.iana.address_span, sim.iana.addresses_used))
+    lir_used = sum([holder.addresses_used for holder in sim.GetLIRs()])
+    self.assertEqual(rollup.Totals('lir')[1], lir_used)
+    # Carrying on keeps the same roll-up, rather than counting twice.
+    sim.Run()
+    self.assert_(result.stats is rollup)
+    self.assertEqual(rollup.Totals('rir', 'north'),
+                     (north.address_span, north.addresses_used))
+
+  def testSimRunRIRsUsedPercentage(self):
+    result = worlds.SmallWorld().Run(
+      stop_condition = simulation.RIRsUsedPercentage(50))
+    self.assertEqual(result.stopped_by, 'stop_condition')
+    self.assert_(result.stats.PercentageUsed('rir') >= 50)
+
   def testSimCheckpoints(self):
     # TODO(niallm): actually implement this
     pass
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+stats_test.py
+
+Tests for the hierarchical address statistics roll-up.
+"""
+import sys
+sys.path.append(".")
+import instrumentation
+import lir
+import stats
+import unittest
+
+class RollupTestCase(unittest.TestCase):
+  def setUp(self):
+    self.eventp = instrumentation.event_processor()
+    self.rollup = stats.Rollup()
+    self.eventp.Subscribe('SPACE_DELTA', self.rollup.Add)
+    self.iana = lir.iana(supplied_inst = self.eventp)
+    self.rir = lir.rir(supplied_name = 'north', supplied_inst = self.eventp,
+                       supplied_date = '19950101')
+    self.rir.address_supplier = self.iana
+    self.lir = lir.lir(supplied_name = 'IE.example', supplied_inst = self.eventp,
+                       supplied_date = '19950101',
+                       requested_behaviour = 'LIR_Static(16)')
+    self.lir.address_supplier = self.rir
+    self.rollup.Seed([self.iana, self.rir, self.lir])
+
+  def testGroups(self):
+    self.assertEqual(self.rollup.Groups(self.rir),
+                     (('rir', None, None), ('rir', 'north', None)))
+    self.assertEqual(self.rollup.Groups(self.lir),
+                     (('lir', None, None), ('lir', 'north', None),
+                      ('lir', None, 'IE')))
+
+  def testDeltasRollUp(self):
+    self.assertEqual(self.rollup.Totals('iana'), (2 ** 32, 0))
+    self.rollup.SetDate('19950101')
+    self.iana._AddTreePrefix('10.0.0.0/8', "TO RIR", True, '19950101')
+    self.rir._AddTreePrefix('10.0.0.0/8', "TO RIR", False, '19950101')
+    self.lir._AddTreePrefix('10.0.0.0/16', "TO LIR", True, '19950101')
+    self.rir._Allocated(2 ** 16)
+    self.assertEqual(self.rollup.Totals('iana'), (2 ** 32, 2 ** 24))
+    self.assertEqual(self.rollup.Totals('rir'), (2 ** 24 + 2 ** 16, 2 ** 16))
+    self.assertEqual(self.rollup.Totals('rir', 'north'),
+                     self.rollup.Totals('rir'))
+    self.assertEqual(self.rollup.Totals('lir', 'north'), (2 ** 16, 2 ** 16))
+    self.assertEqual(self.rollup.Totals('lir', country = 'IE'),
+                     (2 ** 16, 2 ** 16))
+    self.assertEqual(self.rollup.Totals('lir', country = 'FR'), (0, 0))
+    self.assertEqual(self.rollup.PercentageUsed('lir'), 100.0)
+    self.assertEqual(self.rollup.Totals('rir'),
+                     (self.rir.address_span, self.rir.addresses_used))
+
+  def testHistory(self):
+    self.rollup.SetDate('19950101')
+    self.lir._AddTreePrefix('10.0.0.0/16', "TO LIR", True, '19950101')
+    self.lir._AddTreePrefix('10.1.0.0/16', "TO LIR", True, '19950101')
+    self.rollup.SetDate('19960101')
+    self.lir._AddTreePrefix('10.2.0.0/15', "TO LIR", True, '19960101')
+    self.assertEqual(self.rollup.At('19941231', 'lir'), (0, 0))
+    self.assertEqual(self.rollup.At('19950101', 'lir'), (2 ** 17, 2 ** 17))
+    self.assertEqual(self.rollup.At('19950601', 'lir', 'north'),
+                     (2 ** 17, 2 ** 17))
+    self.assertEqual(self.rollup.At('20000101', 'lir', country = 'IE'),
+                     (2 ** 18, 2 ** 18))
+    self.assertEqual(self.rollup.At('20000101', 'rir', 'south'), (0, 0))
+    self.assertEqual(len(self.rollup.history[('lir', None, None)][0]), 2)
+
+  def testReport(self):
+    self.lir._AddTreePrefix('10.0.0.0/16', "TO LIR", True, '19950101')
+    lines = self.rollup.Report()
+    self.assertEqual(len(lines), len(self.rollup.totals))
+    self.assert_(lines[0].startswith('iana'))
+    self.assert_([line for line in lines if ' IE ' in line])
+
+
+if __name__ == '__main__':
+  suite = unittest.TestLoader().loadTestsFromTestCase(RollupTestCase)
+  unittest.TextTestRunner(verbosity=2).run(suite)
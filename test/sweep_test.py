@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+sweep_test.py
+
+Tests for parameter grids, run memoisation and the sweep engine.
+"""
+import sys
+sys.path.append(".")
+import constants
+import os
+import shutil
+import simulation
+import sweep
+import tempfile
+import unittest
+import worlds
+
+class SweepTestCase(unittest.TestCase):
+
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.cache_dir = os.path.join(self.tmpdir, "cache")
+    self.data_file = os.path.join(self.tmpdir, "data")
+    f = open(self.data_file, 'w')
+    f.write("iana|ZZ|ipv4|10.0.0.0|16777216|19940301|ietf\n")
+    f.close()
+    self.loads = 0
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def _SmallWorld(self):
+    """worlds.SmallWorld(), counting how many times one is loaded."""
+    self.loads += 1
+    return worlds.SmallWorld()
+
+  def testExpandGrid(self):
+    self.assertEqual(sweep.ExpandGrid({'b': ['x'], 'a': [1, 2]}),
+                     [(('a', 1), ('b', 'x')), (('a', 2), ('b', 'x'))])
+    self.assertEqual(sweep.ExpandGrid({}), [()])
+
+  def testParseGridArgument(self):
+    self.assertEqual(sweep.ParseGridArgument("_LOOKBACK=5,10"),
+                     ("_LOOKBACK", [5, 10]))
+    self.assertEqual(sweep.ParseGridArgument("_X=1.5,LIR_Static(16)"),
+                     ("_X", [1.5, "LIR_Static(16)"]))
+
+  def testCacheKey(self):
+    point = (('_LOOKBACK', 5),)
+    self.assertEqual(sweep.CacheKey("abc", point, 1),
+                     sweep.CacheKey("abc", point, 1))
+    self.assertNotEqual(sweep.CacheKey("abc", point, 1),
+                        sweep.CacheKey("abc", point, 2))
+    self.assertNotEqual(sweep.CacheKey("abc", point, 1),
+                        sweep.CacheKey("abd", point, 1))
+
+  def testApplyPointUnknown(self):
+    sim = simulation.timelined()
+    self.failUnlessRaises(ValueError, sweep.ApplyPoint, sim,
+                          (('_NO_SUCH_CONSTANT', 1),))
+    self.failUnlessRaises(ValueError, sweep.ApplyPoint, sim,
+                          (('wibble', 1),))
+
+  def testRunSweepMemoises(self):
+    grid = {'lir_behave': ['LIR_Static(16)', 'LIR_Static(15)']}
+    policy = constants.defines._LIR_DEFAULT_POLICY
+    (first, computed) = sweep.RunSweep(self._SmallWorld, grid, [1, 2],
+                                       processes = 2,
+                                       data_files = [self.data_file],
+                                       cache_dir = self.cache_dir)
+    self.assertEqual(computed, 4)
+    self.assertEqual(self.loads, 1)
+    self.assertEqual([(r['point'][0][1], r['seed']) for r in first],
+                     [('LIR_Static(16)', 1), ('LIR_Static(16)', 2),
+                      ('LIR_Static(15)', 1), ('LIR_Static(15)', 2)])
+    (second, computed) = sweep.RunSweep(self._SmallWorld, grid, [1, 2],
+                                        data_files = [self.data_file],
+                                        cache_dir = self.cache_dir)
+    self.assertEqual(computed, 0)
+    self.assertEqual(self.loads, 1)
+    self.assertEqual(first, second)
+    # Only the new seed is computed.
+    (third, computed) = sweep.RunSweep(self._SmallWorld, grid, [1, 2, 3],
+                                       data_files = [self.data_file],
+                                       cache_dir = self.cache_dir)
+    self.assertEqual(computed, 2)
+    # Workers never touch the parent's constants.
+    self.assertEqual(constants.defines._LIR_DEFAULT_POLICY, policy)
+
+  def testRunSweepDataChange(self):
+    grid = {'_LIR_DEFAULT_POLICY': [20]}
+    sweep.RunSweep(self._SmallWorld, grid, [1], data_files = [self.data_file],
+                   cache_dir = self.cache_dir)
+    f = open(self.data_file, 'a')
+    f.write("iana|ZZ|ipv4|11.0.0.0|16777216|19940301|ietf\n")
+    f.close()
+    (records, computed) = sweep.RunSweep(self._SmallWorld, grid, [1],
+                                         data_files = [self.data_file],
+                                         cache_dir = self.cache_dir)
+    self.assertEqual(computed, 1)
+
+
+if __name__ == '__main__':
+  suite = unittest.TestLoader().loadTestsFromTestCase(SweepTestCase)
+  unittest.TextTestRunner(verbosity=2).run(suite)
@@ -187,6 +187,193 @@ class TimeLineTest(unittest.TestCase):
     result = self.tl.GetFirstAfter("19950101")
     self.assertEqual(result, self.tl.GetAtDate("19950303"))
 
+  def testTimeLineGetFirstAfterEnd(self):
+    self.tl.Add("19950101", ["wibb"])
+    self.tl.Add("19950606", ["wubb"])
+    self.assertEqual(self.tl.GetFirstAfter("19950606"), None)
+    self.assertEqual(self.tl.GetFirstAfter("19940101"),
+                     self.tl.GetAtDate("19950101"))
+    self.assertEqual(self.tl.GetFirstBefore("19950101"), None)
+
+  def testTimeLineRemoveHead(self):
+    self.tl.Add("19950101", ["wibb"])
+    self.tl.Add("19950606", ["wubb"])
+    self.assertEqual(self.tl.Remove("19950101"), True)
+    self.assertEqual(self.tl.head.date, "19950606")
+    self.assertEqual(self.tl.GetAtDate("19950101"), None)
+    self.assertEqual(self.tl.Remove("19950101"), False)
+    self.tl.Add("19950303", ["wobb"])
+    self.assertEqual(self.tl.head.next.date, "19950606")
+
+  def testTimeLineRangeQuery(self):
+    self.tl.Add("19950101", ["wibb"])
+    self.tl.Add("19950606", ["wubb", "glimmer"])
+    self.tl.Add("19950303", ["wobb1"])
+    self.tl.Add("19960101", ["wargl"])
+    result = list(self.tl.RangeQuery("19950202", "19950606"))
+    self.assertEqual(result, [("19950303", "wobb1"),
+                              ("19950606", "wubb"),
+                              ("19950606", "glimmer")])
+    result = list(self.tl.RangeQuery("19970101", "19980101"))
+    self.assertEqual(result, [])
+
+  def testTimeLineHandleCancel(self):
+    called = []
+    handle1 = self.tl.RegisterCallbackAtDate("19950101",
+                                             [lambda: called.append(1)])
+    handle2 = self.tl.RegisterCallbackAtDate("19950101",
+                                             [lambda: called.append(2)])
+    handle3 = self.tl.RegisterCallbackAtDate("19950303",
+                                             [lambda: called.append(3)])
+    self.assertEqual(handle2.Cancel(), True)
+    self.assertEqual(handle2.Cancel(), False)
+    self.assertEqual(len(list(self.tl.RangeQuery("19950101", "19950101"))), 1)
+    for callback in self.tl.WalkAlong():
+      callback()
+    self.assertEqual(called, [1, 3])
+    node = self.tl.GetAtDate("19950101")
+    self.assertEqual(node.data, [handle1])
+    self.assertEqual(node.dead, 0)
+
+  def testTimeLineHandlePrune(self):
+    def callback():
+      pass
+    self.tl.RegisterCallbackAtDate("19950101", [callback])
+    self.assertEqual(self.tl.Prune("19950101", callback), True)
+    self.assertEqual(self.tl.GetAtDate("19950101").data, [])
+
+  def testTimeLineKeyedCoalesce(self):
+    called = []
+    handle1 = self.tl.RegisterCallbackAtDate("19950101",
+                                             [lambda: called.append(1)],
+                                             key=("lir", "act"))
+    handle2 = self.tl.RegisterCallbackAtDate("19950101",
+                                             [lambda: called.append(2)],
+                                             key=("lir", "act"))
+    self.assert_(handle1 is handle2)
+    handle3 = self.tl.RegisterCallbackAtDate("19950303",
+                                             [lambda: called.append(3)],
+                                             key=("lir", "act"))
+    self.assertEqual(handle1.cancelled, True)
+    self.assert_(self.tl.GetPending(("lir", "act")) is handle3)
+    for callback in self.tl.WalkAlong():
+      callback()
+    self.assertEqual(called, [3])
+    self.assertEqual(self.tl.GetPending(("lir", "act")), None)
+
+  def testTimeLineKeyedReregisterFromCallback(self):
+    called = []
+    def callback():
+      called.append(self.tl.GetCurrentDate())
+      if len(called) < 3:
+        later = timeline.CalculatePeriodLater(self.tl.GetCurrentDate(), 5)
+        self.tl.RegisterCallbackAtDate(later, [callback], key="again")
+        self.tl.RegisterCallbackAtDate(later, [callback], key="again")
+    self.tl.RegisterCallbackAtDate("19950101", [callback], key="again")
+    for event in self.tl.WalkAlong():
+      event()
+    self.assertEqual(len(called), 3)
+
+  def testTimeLineRanked(self):
+    self.tl = timeline.Timeline(rank=lambda key: key[0])
+    seen = []
+    def Event(name):
+      def Callback():
+        seen.append(name)
+        # Something for today, in our own region, goes after the rest of it.
+        if name == "b1":
+          self.tl.RegisterCallbackAtDate("19950101", [Event("b3")],
+                                         key=("b", 3))
+      return Callback
+    for (region, number) in (("b", 1), ("a", 1), ("b", 2), ("a", 2)):
+      name = "%s%s" % (region, number)
+      self.tl.RegisterCallbackAtDate("19950101", [Event(name)],
+                                     key=(region, number))
+    self.tl.RegisterCallbackAtDate("19950101", [Event("none")])
+    self.assertEqual([event.key for (date, event) in self.tl.RangeQuery(
+      "19950101", "19950101")], [None, ("a", 1), ("a", 2), ("b", 1), ("b", 2)])
+    for callback in self.tl.WalkAlong():
+      callback()
+    self.assertEqual(seen, ["none", "a1", "a2", "b1", "b2", "b3"])
+
+  def testTimeLineStreaming(self):
+    self.tl = timeline.Timeline(streaming=True, archive=True)
+    self.tl.Add("19950101", ["wibb"])
+    self.tl.Add("19950606", ["wubb", "glimmer"])
+    self.tl.Add("19950303", ["wobb1"])
+    seen = []
+    for event in self.tl.WalkAlong():
+      seen.append(event)
+      if event == "wobb1":
+        break
+    self.assertEqual(seen, ["wibb", "wobb1"])
+    # 19950101 is fully consumed and released; 19950303 is still current.
+    self.assertEqual(self.tl.GetAtDate("19950101"), None)
+    self.assertEqual(self.tl.head.date, "19950303")
+    self.tl.Add("19950707", ["wargl"])
+    for event in self.tl.WalkAlong():
+      seen.append(event)
+    self.assertEqual(seen, ["wibb", "wobb1", "wubb", "glimmer", "wargl"])
+    self.assertEqual(self.tl.head, None)
+    self.assertEqual(self.tl.dates, [])
+    self.assertEqual(self.tl.GetCurrentDate(), "19950707")
+    self.assertEqual(list(self.tl.GetArchive()),
+                     [("19950101", 1), ("19950303", 1), ("19950606", 2),
+                      ("19950707", 1)])
+
+  def testTimeLineWalkAlongUntilResume(self):
+    self.tl.Add("19950101", ["wibb"])
+    self.tl.Add("19950303", ["wobb"])
+    self.tl.Add("19950606", ["wubb"])
+    self.assertEqual(list(self.tl.WalkAlong(until="19950303")),
+                     ["wibb", "wobb"])
+    self.assertEqual(self.tl.pointer.date, "19950606")
+    self.assertEqual(list(self.tl.WalkAlong(resume=True)), ["wubb"])
+    self.assertEqual(list(self.tl.WalkAlong(resume=True)), [])
+
+  def testTimeLineBreakThenResume(self):
+    for streaming in (False, True):
+      self.tl = timeline.Timeline(streaming=streaming, archive=True)
+      self.tl.Add("19950101", ["wibb", "wobb", "wubb"])
+      self.tl.Add("19950303", ["glimmer"])
+      handle = self.tl.RegisterCallbackAtDate("19950101", [None], key="k")
+      seen = []
+      for event in self.tl.WalkAlong():
+        seen.append(event)
+        if event == "wobb":
+          break
+      self.assertEqual(self.tl.partial[1:], (2, 2))
+      # Cancelled after the break, and added to the node we stopped in.
+      handle.Cancel()
+      self.tl.Add("19950101", ["wargl"])
+      for event in self.tl.WalkAlong(resume=True):
+        seen.append(event)
+        if event == "wubb":
+          break
+      seen.extend(self.tl.WalkAlong(resume=True))
+      self.assertEqual(seen, ["wibb", "wobb", "wubb", "wargl", "glimmer"])
+      self.assertEqual(self.tl.partial, None)
+      if streaming:
+        self.assertEqual(list(self.tl.GetArchive()),
+                         [("19950101", 4), ("19950303", 1)])
+      else:
+        # A fresh walk starts again from the top.
+        self.assertEqual(list(self.tl.WalkAlong()),
+                         ["wibb", "wobb", "wubb", "wargl", "glimmer"])
+
+  def testTimeLineWalkAlongStop(self):
+    self.tl.Add("19950101", ["wibb"])
+    self.tl.Add("19950303", ["wobb"])
+    stop = lambda date: date >= "19950303"
+    self.assertEqual(list(self.tl.WalkAlong(stop=stop)), ["wibb"])
+    self.assertEqual(list(self.tl.WalkAlong(resume=True)), ["wobb"])
+
+  def testTimeLineNoArchive(self):
+    self.tl.Add("19950101", ["wibb"])
+    list(self.tl.WalkAlong())
+    self.assertEqual(list(self.tl.GetArchive()), [])
+    self.assertEqual(self.tl.head.date, "19950101")
+
   def testDayDelta(self):
     result = timeline.DayDelta("19950203", "19950201")
     self.assertEqual(result, 2)
@@ -201,6 +388,55 @@ class TimeLineTest(unittest.TestCase):
     self.assert_(result == "19950120" or result == "19950121" or
                  result == "19950122")
 
+  def testStream(self):
+    first = timeline.Stream(timeline.StreamSeed(42, "north"))
+    second = timeline.Stream(timeline.StreamSeed(42, "north"))
+    other = timeline.Stream(timeline.StreamSeed(42, "south"))
+    draws = [first.randint(1, 6) for i in range(100)]
+    self.assertEqual(draws, [second.randint(1, 6) for i in range(100)])
+    self.assertNotEqual(draws, [other.randint(1, 6) for i in range(100)])
+    self.assertEqual(set(draws), set(range(1, 7)))
+    items = range(10)
+    first.shuffle(items)
+    self.assertEqual(sorted(items), range(10))
+    self.assert_(first.choice(items) in items)
+
+  def testUseStream(self):
+    stream = timeline.Stream(1)
+    replay = timeline.Stream(1)
+    previous = timeline.UseStream(stream)
+    try:
+      self.assert_(timeline.CurrentStream() is stream)
+      later = timeline.CalculatePeriodLater("19950101", delta=0,
+                                            upperbound=6)
+    finally:
+      timeline.UseStream(previous)
+    self.assertEqual(later, "199501%02d" % (1 + replay.randint(1, 6)))
+    self.assert_(timeline.CurrentStream() is previous)
+
+  @unittest.skipIf(timeline.numpy is None, "NumPy not available")
+  def testCalculatePeriodsLater(self):
+    ordinals = timeline.DatesToOrdinals(["19950101", "19991231"])
+    jitter = timeline.JitterSource(seed=1, upperbound=1)
+    result = timeline.OrdinalsToDates(
+      timeline.CalculatePeriodsLater(ordinals, [20, 1], jitter))
+    self.assertEqual(result, ["19950122", "20000102"])
+
+  @unittest.skipIf(timeline.numpy is None, "NumPy not available")
+  def testCalculatePeriodsLaterReproducible(self):
+    ordinals = timeline.DatesToOrdinals(["19950101"] * 10)
+    first = timeline.JitterSource(seed=7, block_size=3)
+    second = timeline.JitterSource(seed=7, block_size=3)
+    self.assertEqual(
+      list(timeline.CalculatePeriodsLater(ordinals, 27, first)),
+      list(timeline.CalculatePeriodsLater(ordinals, 27, second)))
+
+  @unittest.skipIf(timeline.numpy is None, "NumPy not available")
+  def testOrdinalsRoundTrip(self):
+    dates = ["19950101", "20000229", "20071231"]
+    self.assertEqual(timeline.OrdinalsToDates(timeline.DatesToOrdinals(dates)),
+                     dates)
+
   def testFilterWithinDate(self):
     result = timeline.FilterWithinDate("20071010", 10, "20071012")
     self.assertEqual(result, True)
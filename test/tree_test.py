@@ -7,6 +7,7 @@
 import sys
 sys.path.append(".")
 import constants
+import IPy
 import random
 import tree
 import unittest
@@ -422,6 +423,65 @@ class TreeTest(unittest.TestCase):
       compare_list.remove(node)
     self.assertEqual(compare_list, [])
 
+  def testUsedSpanUnder(self):
+    self.t.Insert("10.0.0.0/8", 'testUsedSpanUnder', mark_used = False,
+                  test_none = False)
+    for prefix in ("10.0.0.0/16", "10.0.0.0/24", "10.1.0.0/24", "10.2.3.4"):
+      self.t.Insert(prefix, 'testUsedSpanUnder')
+    span = sum([IPy.IP(prefix).len() for prefix in
+                self.t.IterateNodesUnderOnlySupernets("10.0.0.0/8")])
+    self.assertEqual(span, 2 ** 16 + 2 ** 8 + 1)
+    self.assertEqual(self.t.UsedSpanUnder("10.0.0.0/8"), span)
+    self.assertEqual(self.t.UsedSpanUnder("10.0.0.0/16"), 2 ** 16)
+
+  def testFreeUnder(self):
+    self.assertEqual(self.t.FreeUnder(''), [])
+    self.t.Insert("10.0.0.0/8", 'testFreeUnder', mark_used = False,
+                  test_none = False)
+    self.assertEqual(self.t.FreeUnder(''), [8])
+    self.assertEqual(self.t.FreeAround("10.0.0.0/24"),
+                     ('00001010', [8]))
+    self.t.Insert("10.0.0.0/10", 'testFreeUnder')
+    # What's left of the /8: a /9 and a /10.
+    self.assertEqual(sorted(self.t.FreeUnder('')), [9, 10])
+    self.assertEqual(self.t.FreeAround("10.0.0.0/24"),
+                     ('000010100000000000000000', []))
+    self.assertEqual(self.t.FreeAround("10.128.0.0/24"),
+                     ('000010101', [9]))
+    # Inside free space, any block is one free block.
+    self.assertEqual(self.t.FreeUnder('0000101011'), [10])
+    self.assertEqual(self.t.FreeUnder('00001011'), [])
+
+  def testRemove(self):
+    self.t.Insert("10.0.0.0/8", 'testRemove', mark_used = False,
+                  test_none = False)
+    self.t.Insert("10.1.0.0/16", 'testRemove')
+    self.t.Insert("10.1.2.0/24", 'testRemove')
+    self.assertEqual(self.t.RemovalPath("10.1.0.0/16"), '0000101000000001')
+    self.t.Remove("10.1.0.0/16")
+    # Kept for the /24 under it, but no longer in the way.
+    self.assertEqual(self.t.FindGapFrom("10.0.0.0/8", 16), "10.0.0.0/16")
+    self.assertEqual(self.t.RemovalPath("10.1.2.0/24"), '000010100')
+    self.t.Remove("10.1.2.0/24")
+    self.assertEqual(self.t.Lookup("10.1.0.0/16"), None)
+    self.assertEqual(self.t.FreeUnder(''), [8])
+    self.assertRaises(KeyError, self.t.Remove, "10.1.0.0/16")
+    self.assertRaises(KeyError, self.t.Remove, "10.0.0.0/9")
+
+  def testFindGapFromSameSizePartlyUsed(self):
+    self.t.Insert("10.0.0.0/25", 'testFindGapFrom', mark_used = False,
+                  test_none = False)
+    self.t.Insert("10.0.0.0/26", 'testFindGapFrom')
+    # Not the /25 itself, nor its neighbour, which isn't under it.
+    self.assertEqual(self.t.FindGapFrom("10.0.0.0/25", 25), None)
+    self.assertEqual(self.t.FindGapFrom("10.0.0.0/25", 26), "10.0.0.64/26")
+
+  def testFindGapFromSameSizeUsed(self):
+    self.t.Insert("11.0.0.0/16", 'testFindGapFrom')
+    # The block is taken whole; its neighbour isn't under it.
+    self.assertEqual(self.t.FindGapFrom("11.0.0.0/16", 16), None)
+    self.assertEqual(self.t.FindGapFrom("11.0.0.0/16", 24), None)
+
   def test_tree_quick_17_treeobj_find_gap_from_simple(self):
     self.t.Insert("0.0.0.0/8", 'testFindGapFrom', mark_used = False, 
                   test_none = False)
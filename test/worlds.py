@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+worlds.py
+
+Small hand-built simulation worlds for the tests to share.
+"""
+import sys
+sys.path.append(".")
+import simulation
+
+def SmallWorld(eventp = None, lirs = True):
+  """Two RIRs with a /12 each from IANA, and (if lirs) an LIR hanging off
+  each, called after its RIR in capitals."""
+  sim = simulation.timelined(supplied_inst = eventp)
+  for (rir_name, prefix) in (('north', '10.0.0.0/12'),
+                             ('south', '10.16.0.0/12')):
+    the_rir = sim.CreateRIRIfNotSeen(rir_name, eventp, 'RIR_Standard')
+    the_rir._AddTreePrefix(prefix, "TO RIR", False, '19950101')
+    sim.iana._AddTreePrefix(prefix, "TO RIR", True, '19950101')
+    the_rir.address_supplier = sim.iana
+    the_rir.SetDate('19950101')
+    if lirs:
+      the_lir = sim.CreateLIRIfNotSeen(rir_name.upper(), eventp,
+                                       'LIR_Static(16)')
+      the_lir.address_supplier = the_rir
+      the_lir.SetDate('19950101')
+  return sim
@@ -14,24 +14,55 @@ A typical use case is for a simulation to instantiate a TimeLine object, and
 add callback events on particular dates using the add() method. Within the
 existing simulation, there is no requirement for the events (callbacks) to
 be processed in any particular order within their date grouping, so we just
-follow the order of insertion into the list.
+follow the order of insertion into the list. A timeline made with a rank
+function instead walks each date's events in rank order, and in insertion
+order within a rank; simulation.py ranks events by region, so that a date
+is processed one region at a time.
+
+Random draws made while scheduling come from the current stream: the
+random module, unless an entity with a Stream of its own has made that
+current with UseStream().
 
 Created by Niall Murphy on 2007-07-25.
 """
 
 __author__ = "niallm@gmail.com (Niall Murphy)"
 
+import array
+import bisect
 import constants
 import datetime
+import hashlib
 import logging
 import random
 import types
 
+# NumPy is only needed for the batched scheduling helpers at the bottom
+# of this file; everything else works without it.
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+# datetime.date(1970, 1, 1).toordinal(), i.e. the ordinal of NumPy's epoch.
+_EPOCH_ORDINAL = 719163
+
+_MASK64 = (1 << 64) - 1
+
+# What draws come from just now; see UseStream.
+_stream = random
+
+def _Rank(event):
+  """An event's rank, for ordering within a date; None for bare callbacks
+  and handles registered without one."""
+  return getattr(event, 'rank', None)
+
 
 class ListNode(object):
   """A node in the timeline structure.
 
-  Has 'data', a 'date' (in YYYYMMDD format) and a next pointer.
+  Has 'data', a 'date' (in YYYYMMDD format) and a next pointer. 'dead'
+  counts the cancelled EventHandles still sitting in 'data'.
   """
 
   def __init__(self, data=[], next=None, date=None):
@@ -39,6 +70,7 @@ class ListNode(object):
     self.data = data
     self.next = next
     self.date = date
+    self.dead = 0
 
   def AddData(self, new_data):
     """Add to the data list for this node.
@@ -66,6 +98,61 @@ class ListNode(object):
     """Clear all data from node."""
     self.data = None
 
+  def Compact(self):
+    """Drop cancelled EventHandles from the data list."""
+    if self.dead:
+      self.data = [x for x in self.data
+                   if not (isinstance(x, EventHandle) and x.cancelled)]
+      self.dead = 0
+
+
+class EventHandle(object):
+  """A cancellable reference to callbacks registered on the timeline.
+
+  RegisterCallbackAtDate() stores one of these in the node rather than
+  the bare callbacks, and hands it back to the caller. Calling the handle
+  calls the callbacks in order. Cancel() is O(1): it only marks the handle
+  dead, and WalkAlong() skips it and compacts the node when it gets there.
+  A handle registered with a key is the single pending event for that key.
+  """
+
+  def __init__(self, date, event, key=None, rank=None):
+    self.date = date
+    self.event = event  # The list of callbacks we were registered with.
+    self.key = key
+    self.rank = rank  # See Timeline
+    self.node = None
+    self.cancelled = False
+    self.fired = False
+
+  def __call__(self, *args):
+    result = None
+    for callback in self.event:
+      result = callback(*args)
+    return result
+
+  def __eq__(self, other):
+    """Compare equal to our own callback, so Prune() still works."""
+    if isinstance(other, EventHandle):
+      return self is other
+    return self.event == [other] or self.event == other
+
+  def __ne__(self, other):
+    return not self.__eq__(other)
+
+  def __hash__(self):
+    return id(self)
+
+  def Cancel(self):
+    """Mark this event dead. Returns False if it already was, or if it
+    has already been walked past."""
+    if self.cancelled or self.fired:
+      return False
+    self.cancelled = True
+    if self.node is not None:
+      self.node.dead += 1
+    return True
+
 
 class LinkedList(object):
   """A singly-linked list class that ListNode is a subcomponent of.
@@ -125,15 +212,67 @@ class Timeline(object):
   The Timeline object glues together collection and
   list node objects to provide a (time-index accessible)
   sequence of items.
+
+  Alongside the linked list we keep a date -> node dictionary and a sorted
+  array of the dates present, so that point lookups don't have to walk from
+  the head, and neighbour lookups can bisect. Anything that links or unlinks
+  nodes must keep these in step; see _IndexNode() and _UnindexNode().
+
+  In streaming mode WalkAlong() unlinks each date once it has yielded all
+  of its events, so memory (and anything pickled) depends only on what is
+  still pending. If archive is also set, we keep a compact record of how
+  many events each released date carried; see GetArchive(). Because the
+  head is always the next unprocessed date, a streaming WalkAlong() picks
+  up where the previous one stopped.
+
+  With a rank function, each keyed event is ranked by rank(key) as it is
+  registered, and WalkAlong() walks a date's events in rank order (stably,
+  so in insertion order within a rank). A date is sorted when the walk
+  reaches it; an event registered for the date being walked goes among
+  the events still to come, after those of its own rank.
   """
 
   def __init__(self,
                supplied_debug=0,
-               instrumentation=None):
+               instrumentation=None,
+               streaming=False,
+               archive=False,
+               rank=None):
     self.head = None
     self.pointer = None  # Our notion of 'the current date'.
     self.debug = supplied_debug
     self.instrument = instrumentation
+    self.nodes_by_date = dict()  # YYYYMMDD -> ListNode
+    self.dates = []  # Sorted YYYYMMDD strings with a node in the list.
+    self.pending_by_key = dict()  # Key -> the one pending EventHandle.
+    self.streaming = streaming
+    self.last_date = None  # Date of the last node released when streaming.
+    self.partial = None  # See WalkAlong
+    self.rank = rank
+    if archive:
+      self.archive_dates = array.array('l')  # YYYYMMDD as integers.
+      self.archive_counts = array.array('l')
+    else:
+      self.archive_dates = None
+      self.archive_counts = None
+
+  def _IndexNode(self, node):
+    """Record a newly linked node in the date index."""
+    self.nodes_by_date[node.date] = node
+    bisect.insort(self.dates, node.date)
+
+  def _UnindexNode(self, node):
+    """Forget an unlinked node from the date index."""
+    del self.nodes_by_date[node.date]
+    position = bisect.bisect_left(self.dates, node.date)
+    del self.dates[position]
+
+  def _NodeBefore(self, date):
+    """Return the last node strictly before date, or None."""
+    position = bisect.bisect_left(self.dates, date)
+    if position == 0:
+      return None
+    return self.nodes_by_date[self.dates[position - 1]]
 
   def SetPointerToHead(self):
     """Set the current pointer to the head of the list."""
@@ -153,47 +292,43 @@ class Timeline(object):
 
   def GetAtDate(self, date):
     """Return whatever node is to be found at this precise date, or None."""
-    preserve = self.pointer
-    self.pointer = self.head
-    while self.pointer is not None and self.pointer.date < date:
-      self.pointer = self.pointer.next
-    if self.pointer is None:
-      return None
-    elif self.pointer.date == date:
-      ephemeral = self.pointer
-      self.pointer = preserve
-      return ephemeral
-    else:
-      self.pointer = preserve
-      return None
+    return self.nodes_by_date.get(date, None)
 
   def GetFirstBefore(self, supplied_date):
     """Return the first node before this date, or None."""
-    preserve = self.pointer
-    self.pointer = self.head
-    previous = None
-    while self.pointer is not None and self.pointer.date < supplied_date:
-      previous = self.pointer
-      self.pointer = self.pointer.next
-    if previous.date < supplied_date:
-      self.pointer = preserve
-      return previous
-    else:
-      self.pointer = preserve
-      return None
+    return self._NodeBefore(supplied_date)
 
   def GetFirstAfter(self, date):
     """Return the first node after this date, or None."""
-    preserve = self.pointer
-    self.pointer = self.head
-    while self.pointer is not None and self.pointer.date < date:
-      self.pointer = self.pointer.next
-    if self.pointer.next.date >= date:
-      self.pointer = preserve
-      return self.pointer.next
-    else:
-      self.pointer = preserve
+    position = bisect.bisect_right(self.dates, date)
+    if position == len(self.dates):
       return None
+    return self.nodes_by_date[self.dates[position]]
+
+  def RangeQuery(self, start_date, end_date):
+    """A generator for the events scheduled inside a window of dates.
+
+    Args:
+      start_date, end_date: YYYYMMDD strings; both ends are inclusive.
+
+    Yields (date, event) tuples in date order, and within a date in the
+    order WalkAlong() would produce them. The current pointer is untouched,
+    so this is safe to call from inside a callback.
+    """
+    position = bisect.bisect_left(self.dates, start_date)
+    while position < len(self.dates) and self.dates[position] <= end_date:
+      date = self.dates[position]
+      node = self.nodes_by_date[date]
+      if node.data:
+        events = node.data
+        if self.rank is not None and not (self.partial is not None and
+                                          self.partial[0] is node):
+          events = sorted(events, key=_Rank)
+        for event in events:
+          if node.dead and isinstance(event, EventHandle) and event.cancelled:
+            continue
+          yield (date, event)
+      position += 1
 
   def GetCurrentDate(self):
     """Get the date of the current node.
@@ -201,16 +336,87 @@ class Timeline(object):
     Return the head node if no pointer yet.
     """
     if self.pointer is None:
+      if self.head is None and self.last_date is not None:
+        return self.last_date
       return self.head.date
     else:
       return self.pointer.date
 
-  def RegisterCallbackAtDate(self, date, callback_event):
-    """This wraps the add() action to add a callback for this specific date."""
+  def GetArchive(self):
+    """A generator of (YYYYMMDD, event count) for the dates released while
+    streaming, oldest first. Yields nothing unless archive was requested."""
+    if self.archive_dates is None:
+      return
+    for position in range(len(self.archive_dates)):
+      yield ("%08d" % self.archive_dates[position],
+             self.archive_counts[position])
+
+  def _Release(self, node, count):
+    """Unlink a fully walked node, archiving its event count."""
+    self.Remove(node.date)
+    self.last_date = node.date
+    if self.archive_dates is not None:
+      self.archive_dates.append(int(node.date))
+      self.archive_counts.append(count)
+
+  def RegisterCallbackAtDate(self, date, callback_event, key=None):
+    """This wraps the add() action to add a callback for this specific date.
+
+    Args:
+      date: YYYYMMDD string.
+      callback_event: list of callables.
+      key: optional hashable, conventionally (entity, action). Only one
+        event per key is ever pending: registering again on the same date
+        coalesces into the existing event, and registering on a different
+        date moves it there. It is also what the event is ranked by.
+
+    Returns:
+      An EventHandle; call its Cancel() method to withdraw the callback.
+    """
     if self.debug >= 2:
       print ("timeline.RegisterCallbackAtDate at [%s] with [%s]" %
              (date, callback_event))
-    self.Add(date, callback_event)
+    if key is not None:
+      existing = self.pending_by_key.get(key, None)
+      if existing is not None and not existing.cancelled:
+        if existing.date == date:
+          return existing
+        existing.Cancel()
+    rank = None
+    if key is not None and self.rank is not None:
+      rank = self.rank(key)
+    handle = EventHandle(date, callback_event, key, rank)
+    handle.node = self.Add(date, [handle])
+    if key is not None:
+      self.pending_by_key[key] = handle
+    if (rank is not None and self.partial is not None and
+        self.partial[0] is handle.node):
+      self._Place(handle)
+    return handle
+
+  def _Place(self, handle):
+    """Move handle, just added to the date being walked, from the end of
+    it to after the events of its rank still to come, which are sorted."""
+    (node, index, count) = self.partial
+    data = node.data
+    low = index
+    high = len(data) - 1
+    while low < high:
+      middle = (low + high) // 2
+      if _Rank(data[middle]) <= handle.rank:
+        low = middle + 1
+      else:
+        high = middle
+    if low < len(data) - 1:
+      data.pop()
+      data.insert(low, handle)
+
+  def GetPending(self, key):
+    """Return the pending EventHandle registered under key, or None."""
+    handle = self.pending_by_key.get(key, None)
+    if handle is None or handle.cancelled:
+      return None
+    return handle
 
   def Add(self, date, event):
     """Add an event to the supplied date.
@@ -218,6 +424,9 @@ class Timeline(object):
     If the relevant node with date is missing, create it. Otherwise,
     add it to what is already present. If the date is invalid,
     raise an exception.
+
+    Returns:
+      The ListNode the event was added to.
     """
     # Event process this if we're not in a test.
     if self.instrument is not None:
@@ -229,8 +438,6 @@ class Timeline(object):
       day = int(date[6:8])
     except ValueError:
       raise ValueError("Date %s out of range for timeline.add" % date)
-    preserve = self.pointer
-    self.pointer = self.head
     if (year < constants.defines._YEAR_MIN_BEGIN or
         year > constants.defines._YEAR_MAX_END):
       raise ValueError("Supplied year [%s] out of bounds" % year)
@@ -244,123 +451,154 @@ class Timeline(object):
       logging.info("*** INSERT AT HEAD OF LIST")
       # Insert at head of list (when head is none)
       self.head = ListNode(data=event, next=None, date=date)
+      self._IndexNode(self.head)
       # SIDE EFFECT - WARNING WARNING - we set our pointer to the head now.
       self.SetPointerToHead()
-      return
-    # If we've got a list, we find the best place to put the new node.
-    previous = None
-    while self.pointer is not None and self.pointer.date < date:
-      previous = self.pointer
-      self.pointer = self.pointer.next
-    if self.pointer == None:
-      logging.info("*** REPLACE AT TAIL OF LIST")
-      n = ListNode(next=None, date=date)
-      n.data = event
-      previous.next = n
-    elif self.pointer.date == date:
+      return self.head
+    # If we've got a list, the index tells us where the new node goes.
+    existing = self.nodes_by_date.get(date, None)
+    if existing is not None:
       logging.info("*** ADD TO CURRENT NODE")
-      self.pointer.AddData(event)
-    elif self.pointer.date > date and previous is not None:
-      logging.info("*** INSERT BETWEEN PREVIOUS AND CURRENT")
-      n = ListNode(data=event, next=self.pointer, date=date)
-      previous.next = n
-      n.next = self.pointer
-    elif self.pointer.date > date and previous is None:
+      existing.AddData(event)
+      return existing
+    previous = self._NodeBefore(date)
+    if previous is None:
       logging.info("*** INSERT AT VERY HEAD OF LIST")
-      self.head = (ListNode(data=event, next=self.pointer,
-                   date=date))
-    self.pointer = preserve
+      n = ListNode(data=event, next=self.head, date=date)
+      self.head = n
+    else:
+      logging.info("*** INSERT AFTER PREVIOUS")
+      n = ListNode(data=event, next=previous.next, date=date)
+      previous.next = n
+    self._IndexNode(n)
+    return n
 
   def AddNode(self, node):
     """Add an already constructed node with existing date specification."""
-    preserve = self.pointer
-    self.pointer = self.head
     if self.head == None:
       if self.debug >= 2:
         print "*** INSERT AT HEAD OF LIST"
       self.head = node
+      self._IndexNode(node)
       return
-    previous = None
-    while self.pointer is not None and self.pointer.date < node.date:
-      previous = self.pointer
-      self.pointer = self.pointer.next
-    if self.pointer == None:
-      if self.debug >= 2:
-        print "*** REPLACE AT TAIL OF LIST"
-      previous.next = node
-    elif self.pointer.date == node.date:
+    existing = self.nodes_by_date.get(node.date, None)
+    if existing is not None:
       if self.debug >= 2:
         print "*** ADD TO CURRENT NODE"
       # Add it to current node; brokenly merges data.
       merge1 = node.data
-      merge2 = self.pointer.data
+      merge2 = existing.data
       m = dict([(x, 1) for x in merge1 + merge2])
-      self.pointer.ClearData()
-      self.pointer.data = m.keys
-    elif self.pointer.date > node.date and previous is not None:
-      if self.debug >= 2:
-        print "*** INSERT BETWEEN PREVIOUS AND CURRENT"
-      previous.next = node
-      node.next = self.pointer
-    elif self.pointer.date > node.date and previous is None:
+      existing.ClearData()
+      existing.data = m.keys
+      return
+    previous = self._NodeBefore(node.date)
+    if previous is None:
       if self.debug >= 2:
         print "*** INSERT AT VERY HEAD OF LIST"
+      node.next = self.head
       self.head = node
-      node.next = self.pointer
-    self.pointer = preserve
+    else:
+      if self.debug >= 2:
+        print "*** INSERT AFTER PREVIOUS"
+      node.next = previous.next
+      previous.next = node
+    self._IndexNode(node)
 
   def Remove(self, supplied_date):
     """Remove node at supplied_date.
 
     Such nodes as might exist on either side get joined. If no node exists
     at that precise date, we return False."""
-    preserve = self.pointer
-    self.pointer = self.head
-    while self.pointer is not None and self.pointer.date < supplied_date:
-      previous = self.pointer
-      self.pointer = self.pointer.next
-    if self.pointer.date == supplied_date:
-      previous.next = self.pointer.next
-      self.pointer = preserve
-      return True
-    else:
-      self.pointer = preserve
+    node = self.nodes_by_date.get(supplied_date, None)
+    if node is None:
       return False
+    previous = self._NodeBefore(supplied_date)
+    if previous is None:
+      self.head = node.next
+    else:
+      previous.next = node.next
+    self._UnindexNode(node)
+    return True
 
   def Prune(self, supplied_date, target):
     """Prune the specified item from the data array at the specified date.
 
-    If no node or matching data exists, return False."""
-    preserve = self.pointer
-    self.pointer = self.head
-    while self.pointer is not None and self.pointer.date < supplied_date:
-      self.pointer = self.pointer.next
-    if self.pointer.date == supplied_date:
-      try:
-        self.pointer.data.remove(target)
-        self.pointer = preserve
-        return True
-      except ValueError:
-        # A list existed at the given date, but we didn't find the item.
-        return False
-    else:
+    If no node or matching data exists, return False. This is a linear
+    search of the node; callers holding an EventHandle should Cancel() it
+    instead."""
+    node = self.nodes_by_date.get(supplied_date, None)
+    if node is None:
       # A node with that date did not exist.
-      self.pointer = preserve
+      return False
+    try:
+      node.data.remove(target)
+      return True
+    except ValueError:
+      # A list existed at the given date, but we didn't find the item.
       return False
 
-  def WalkAlong(self):
+  def WalkAlong(self, until=None, stop=None, resume=False):
     """A generator for the timeline object.
 
     The walk_along() method for this class yields the members of the data 
     array for the current node, then moves the pointer to the next node
     and does the same thing there, and so on. (Note that the existence of
     a global pointer member means multiple walkers cannot co-exist.)
+
+    Cancelled EventHandles are skipped, and the node is compacted once
+    we have finished with it. A keyed handle stops being pending as it is
+    yielded, so the callback is free to register its successor.
+
+    Args:
+      until: YYYYMMDD date; stop before the first node later than this.
+      stop: callable(date), checked before each node; stop if it is true.
+      resume: start from the current pointer rather than the head, to
+        carry on from where an earlier walk stopped.
+
+    Either way of stopping leaves the pointer on the untouched node, so a
+    later WalkAlong(resume=True) picks up exactly where this one left off.
+    A caller that breaks out of the walk partway through a node leaves
+    partial set to (node, items consumed, items yielded), and a resumed
+    walk carries on with the rest of that node.
     """
-    self.pointer = self.head
+    # A streaming timeline releases finished nodes, so its head is always
+    # the first thing still to do.
+    if not resume or self.streaming:
+      self.pointer = self.head
+    if not resume and not self.streaming:
+      self.partial = None
     while self.pointer is not None:
-      for x in self.pointer.data:
+      node = self.pointer
+      if until is not None and node.date > until:
+        return
+      if stop is not None and stop(node.date):
+        return
+      if self.partial is None or self.partial[0] is not node:
+        if self.rank is not None and node.data:
+          node.data.sort(key=_Rank)
+        self.partial = (node, 0, 0)
+      (node, index, count) = self.partial
+      while index < len(node.data):
+        x = node.data[index]
+        index += 1
+        if isinstance(x, EventHandle):
+          if x.cancelled:
+            self.partial = (node, index, count)
+            continue
+          x.fired = True
+          if x.key is not None and self.pending_by_key.get(x.key) is x:
+            del self.pending_by_key[x.key]
+        count += 1
+        # Consumed before it is yielded, in case the caller never comes back.
+        self.partial = (node, index, count)
         yield x
-      self.pointer = self.pointer.next
+      self.partial = None
+      if self.streaming:
+        self._Release(node, count)
+      else:
+        node.Compact()
+      self.pointer = node.next
 
 # And now for general functions to do with date manipulations
 # that we'd like to be accessible outside of a TimeLine instance.
@@ -391,9 +629,147 @@ def CalculatePeriodLater(cur_date=None, delta=27, upperbound=6):
   """
   cur_datetime = CalculateDateObj(cur_date)
   reply = (cur_datetime + datetime.timedelta(days=delta) +
-           datetime.timedelta(days=random.randint(1,upperbound)))
+           datetime.timedelta(days=_stream.randint(1,upperbound)))
   return reply.strftime("%Y%m%d")
 
+def StreamSeed(master_seed, name):
+  """Derive the seed of the entity called name's stream from master_seed.
+  Hashed rather than drawn, so it is the same whichever process, and in
+  whatever order, the streams are made."""
+  digest = hashlib.md5("%s/%s" % (master_seed, name)).digest()
+  return int(digest[:8].encode('hex'), 16)
+
+class Stream(object):
+  """A seeded random stream of one entity's own.
+
+  Offers the parts of the random module's interface the simulation draws
+  on, from a 64-bit SplitMix state, so that a stream costs one integer
+  however many entities have one. What one entity draws doesn't depend on
+  what any other does.
+  """
+  __slots__ = ('state',)
+
+  def __init__(self, seed=0):
+    self.state = seed & _MASK64
+
+  def __getstate__(self):
+    return self.state
+
+  def __setstate__(self, state):
+    self.state = state
+
+  def random(self):
+    """The next float in [0, 1)."""
+    self.state = (self.state + 0x9E3779B97F4A7C15) & _MASK64
+    z = self.state
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return ((z ^ (z >> 31)) >> 11) / 9007199254740992.0
+
+  def randint(self, a, b):
+    """An integer in [a, b], both included."""
+    return a + int(self.random() * (b - a + 1))
+
+  def choice(self, seq):
+    """A member of the non-empty sequence seq."""
+    return seq[int(self.random() * len(seq))]
+
+  def shuffle(self, x):
+    """Shuffle list x in place."""
+    for i in reversed(xrange(1, len(x))):
+      j = int(self.random() * (i + 1))
+      x[i], x[j] = x[j], x[i]
+
+def UseStream(stream):
+  """Make stream, a Stream or (if None) the random module, what draws
+  come from.
+
+  Returns:
+    what they came from before, to hand back to UseStream once done."""
+  global _stream
+  previous = _stream
+  if stream is None:
+    stream = random
+  _stream = stream
+  return previous
+
+def CurrentStream():
+  """What draws come from just now: a Stream, or the random module."""
+  return _stream
+
+class JitterSource(object):
+  """Scheduling jitter drawn in blocks from a seeded NumPy generator.
+
+  CalculatePeriodLater() draws once per callback. When we
+  are scheduling many entities at once it is much cheaper to draw a block
+  of jitter in one go and hand out slices of it. Given the same seed and
+  the same sequence of Draw() sizes, the jitter handed out is identical.
+  """
+
+  def __init__(self, seed=None, upperbound=6,
+               block_size=constants.defines._JITTER_BLOCK_SIZE):
+    if numpy is None:
+      raise ImportError("JitterSource requires NumPy")
+    self.generator = numpy.random.RandomState(seed)
+    self.upperbound = upperbound
+    self.block_size = block_size
+    self.block = numpy.zeros(0, dtype=numpy.int64)
+    self.position = 0
+
+  def _Refill(self, needed):
+    """Draw a new block, keeping whatever was left of the old one."""
+    size = max(self.block_size, needed)
+    fresh = self.generator.randint(1, self.upperbound + 1, size=size)
+    self.block = numpy.concatenate((self.block[self.position:],
+                                    fresh.astype(numpy.int64)))
+    self.position = 0
+
+  def Draw(self, count):
+    """Return an array of count jitter values in [1, upperbound]."""
+    if self.position + count > len(self.block):
+      self._Refill(count)
+    reply = self.block[self.position:self.position + count]
+    self.position += count
+    return reply
+
+def CalculatePeriodsLater(day_ordinals, deltas=27, jitter=None, upperbound=6):
+  """Vectorised CalculatePeriodLater().
+
+  Args:
+    day_ordinals: sequence of current dates as proleptic Gregorian
+      ordinals (datetime.date.toordinal()).
+    deltas: a scalar or a sequence of the same length, in days.
+    jitter: a JitterSource; if None, a fresh unseeded one is used.
+    upperbound: jitter bound, as for CalculatePeriodLater; only used when
+      no JitterSource is supplied.
+
+  Returns:
+    A NumPy int64 array of the next dates as ordinals. Use
+    OrdinalsToDates() to turn them into YYYYMMDD strings.
+  """
+  if jitter is None:
+    jitter = JitterSource(upperbound=upperbound)
+  ordinals = numpy.asarray(day_ordinals, dtype=numpy.int64)
+  deltas = numpy.asarray(deltas, dtype=numpy.int64)
+  return ordinals + deltas + jitter.Draw(len(ordinals))
+
+def DatesToOrdinals(dates):
+  """Convert a sequence of YYYYMMDD strings to a NumPy array of ordinals."""
+  iso = ["%s-%s-%s" % (date[0:4], date[4:6], date[6:8]) for date in dates]
+  days = numpy.array(iso, dtype='datetime64[D]').astype(numpy.int64)
+  return days + _EPOCH_ORDINAL
+
+def OrdinalsToDates(ordinals):
+  """Convert a sequence of ordinals to a list of YYYYMMDD strings."""
+  days = (numpy.asarray(ordinals, dtype=numpy.int64) -
+          _EPOCH_ORDINAL).astype('datetime64[D]')
+  months = days.astype('datetime64[M]')
+  years = months.astype('datetime64[Y]').astype(numpy.int64) + 1970
+  month_of_year = months.astype(numpy.int64) % 12 + 1
+  day_of_month = (days - months).astype(numpy.int64) + 1
+  packed = years * 10000 + month_of_year * 100 + day_of_month
+  return ["%08d" % date for date in packed]
+
 def FilterWithinDate(cur_date, days, other_date):
   """Return true if other_date unstrictly within <days> days of cur_date.
 
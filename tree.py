@@ -36,6 +36,13 @@ hooray! We're done. If we have, then back-track and try the right hand branch
 immediately upwards of the left hand branch that was occupied. Follow again,
 retracing our steps upwards as necessary. This amounts to a pre-order traversal.
 
+Free space, for FreeAround() and FreeUnder(), is whatever lies in a node
+inserted unused in its own right (not the root, and not one Insert made
+on its way somewhere else) and not at or under a used node. We describe
+it as the blocks FindGap would see: an unused node inside free space with
+no children is one free block, and otherwise each missing child of an
+unused node is. Address holders count these by length as they insert.
+
 Created by Niall Murphy on 2007-07-25.
 """
 
@@ -48,9 +55,31 @@ import sys
 
 IPy.check_addr_prefixlen = False
 
-class Node:
+# What Insert() calls the nodes it makes on the way to the one it wants.
+_CREATED = "CREATED BY INSERT"
+
+def _Path(route):
+  """The binary path to route's node: its first prefixlen bits."""
+  (address, slash, length) = route.partition('/')
+  octets = address.split('.')
+  if len(octets) != 4:
+    ip = IPy.IP(route)
+    return ip.strBin()[:ip.prefixlen()]
+  network = 0
+  for octet in octets:
+    network = (network << 8) | int(octet)
+  if slash:
+    return format(network, '032b')[:int(length)]
+  return format(network, '032b')
+
+class Node(object):
   """This is a node on the tree, which stores the address prefix by virtue
-  of its position, but must keep track of its children and parent."""
+  of its position, but must keep track of its children and parent.
+
+  Every prefix inserted makes up to 32 of these, so they keep their
+  members in slots; pickled, they are a dict as before."""
+
+  __slots__ = ('left', 'right', 'parent', 'data', 'used', 'level')
 
   def __init__(self, supplied_parent = None, supplied_left = None, 
               supplied_right = None, supplied_data = None, 
@@ -63,6 +92,13 @@ class Node:
     self.used = supplied_used
     self.level = None
 
+  def __getstate__(self):
+    return dict([(name, getattr(self, name)) for name in Node.__slots__])
+
+  def __setstate__(self, state):
+    for name in Node.__slots__:
+      setattr(self, name, state.get(name))
+
   def GetData(self):
     """Return the per-node 'user data' (essentially anything you could
     want to store) associated with this node."""
@@ -237,7 +273,7 @@ class Tree:
         if current.GetLeft() == None and test_none == False:
           current.SetLeft(Node(current))
           current.GetLeft().used = False
-          current.GetLeft().SetData("CREATED BY INSERT")
+          current.GetLeft().SetData(_CREATED)
         elif current.GetLeft() == None and test_none == True:
           return False
         current = current.GetLeft()
@@ -245,14 +281,14 @@ class Tree:
         if current.GetRight() == None and test_none == False:
           current.SetRight(Node(current))
           current.GetRight().used = False
-          current.GetRight().SetData("CREATED BY INSERT")
+          current.GetRight().SetData(_CREATED)
         elif current.right == None and test_none == True:
           return False
         current = current.GetRight()
       else:
         """Don't understand how this could come about."""
         raise ValueException
-    if test_dup == True and current.GetData() != "CREATED BY INSERT":
+    if test_dup == True and current.GetData() != _CREATED:
       return False
     if mark_used == True:
       current.used = True
@@ -280,12 +316,55 @@ class Tree:
         return None
     return current
 
+  def _Dropping(self, route):
+    """What Remove(route) takes out. Returns (node, top, depth): route's
+    node, and the topmost node that goes with it and how deep that is,
+    or route's node itself and its depth if it has children to keep.
+
+    Raises:
+      KeyError if route was never inserted."""
+    node = self.Lookup(route)
+    if node == None or node.data == _CREATED:
+      raise KeyError, route
+    top = node
+    depth = node.GetLevel()
+    if node.left == None and node.right == None:
+      # The nodes Insert made on the way to route go too, once nothing
+      # else is under them.
+      parent = node.parent
+      while parent is not self.root and not parent.used and \
+            parent.data == _CREATED and \
+            (parent.left == None or parent.right == None):
+        top = parent
+        parent = top.parent
+        depth -= 1
+    return (node, top, depth)
+
+  def RemovalPath(self, route):
+    """The binary path of the block Remove(route) changes, to compare
+    FreeUnder() before and after.
+
+    Raises:
+      KeyError if route was never inserted."""
+    (node, top, depth) = self._Dropping(route)
+    return _Path(route)[:depth]
+
   def Remove(self, route):
-    if self.Lookup(route) != None:
-      """Mark current node un-used. TODO(niallm): Is this sufficient?"""
-      current.used = False
-    else:
-      raise ValueException
+    """Take route out of the tree, as if it had never been inserted:
+    mark it unused, forget its data, and drop it and the nodes made on
+    the way to it if nothing else is under them.
+
+    Raises:
+      KeyError if route was never inserted."""
+    (node, top, depth) = self._Dropping(route)
+    node.used = False
+    node.SetData(_CREATED)
+    if node.left == None and node.right == None and top is not self.root:
+      parent = top.parent
+      if parent.left is top:
+        parent.left = None
+      else:
+        parent.right = None
 
 
   def IterateNodes(self, return_data = False):
@@ -379,6 +458,102 @@ class Tree:
     if self.debug >= 2:
       print "FALL OUT BOTTOM"
 
+  def UsedSpanUnder(self, prefix):
+    """How many addresses the nodes IterateNodesUnderOnlySupernets(prefix)
+    would give cover between them, without spelling each one out."""
+    node = self.Lookup(prefix)
+    if node == None:
+      raise "Node Not Present"
+    span = 0
+    stack = [(node, node.GetLevel())]
+    while stack:
+      (current, level) = stack.pop()
+      if current.used:
+        span += 1 << (32 - level)
+        continue
+      if current.left != None:
+        stack.append((current.left, level + 1))
+      if current.right != None:
+        stack.append((current.right, level + 1))
+    return span
+
+  def _Allocatable(self, node):
+    """Was node inserted unused, in its own right, to allocate from?"""
+    return (not node.used and node is not self.root and
+            node.data != _CREATED)
+
+  def _FreeLevels(self, node, level, inside):
+    """Prefix lengths of the free blocks (see the top of the file) at and
+    under node, at level level; inside says whether an ancestor is
+    allocatable."""
+    levels = []
+    stack = [(node, level, inside)]
+    while stack:
+      (current, level, inside) = stack.pop()
+      if current.used:
+        continue
+      inside = inside or self._Allocatable(current)
+      if current.left == None and current.right == None:
+        if inside:
+          levels.append(level)
+        continue
+      for child in (current.left, current.right):
+        if child != None:
+          stack.append((child, level + 1, inside))
+        elif inside:
+          levels.append(level + 1)
+    return levels
+
+  def _Descend(self, path):
+    """Follow binary path from the root as far as it goes. Returns
+    (node, depth, inside): the deepest node on the path, how deep it
+    is, and whether it or anything above it is allocatable. Stops early
+    at a used node, or at a childless allocatable node's free block."""
+    root = current = self.root
+    inside = False
+    depth = 0
+    for bit in path:
+      if current.used:
+        return (current, depth, inside)
+      if not inside and current is not root and current.data != _CREATED:
+        inside = True
+      if bit == '0':
+        child = current.left
+      else:
+        child = current.right
+      if child is None:
+        return (current, depth, inside)
+      current = child
+      depth += 1
+    return (current, depth, inside or self._Allocatable(current))
+
+  def FreeUnder(self, path):
+    """Prefix lengths of the free blocks in the block at binary path
+    (which may be '', for everything). A block that lies wholly in free
+    space counts as one, of its own length."""
+    (node, depth, inside) = self._Descend(path)
+    if node.used:
+      return []
+    if depth < len(path):
+      # The path leaves the tree in free space, or outside it.
+      if inside:
+        return [len(path)]
+      return []
+    return self._FreeLevels(node, depth, inside)
+
+  def FreeAround(self, route):
+    """Where inserting route can change the free blocks. Returns (path,
+    levels): the binary path of the free block route lies in, or of route
+    itself if it is not wholly free, and FreeUnder() that path. Compare
+    with FreeUnder(path) after the insert."""
+    path = _Path(route)
+    (node, depth, inside) = self._Descend(path)
+    if inside and not node.used and depth < len(path):
+      if node.left == None and node.right == None:
+        return (path[:depth], [depth])
+      return (path[:depth + 1], [depth + 1])
+    return (path, self.FreeUnder(path))
+
   def IterateNodesUnderOnlySupernets(self, prefix, return_data = False):
     """Generator for nodes marked used in the current tree,
     rooted at the supplied prefix. Catch only the supernets."""
@@ -479,7 +654,11 @@ class Tree:
           (self.PathToDotQuad(current.GetPath(), current.GetLevel()))
       if previous == current.GetParent() or (previous == self.root 
                                               and current == self.root):
-        if current.used:
+        if current.used and current is start_from:
+          # The whole block I was asked to search is taken; going to
+          # previous would climb out of it onto a neighbour.
+          return None
+        elif current.used:
           if self.debug >= 3:
             print "Tree.FindGap finds current node used; ergo go to previous."
           next_node = previous
@@ -487,6 +666,14 @@ class Tree:
           if self.debug >= 3:
             print "Tree.FindGap finds current level at size limit; ergo go up."
           next_node = current.GetParent()
+        elif current.GetLevel() == size:
+          # A gap only if nothing under it is taken; and I can't go above
+          # where I started.
+          if current.GetLeft() == None and current.GetRight() == None:
+            return self.PathToDotQuad(current.GetPath(), size)
+          if current is start_from:
+            return None
+          next_node = current.GetParent()
         else:
           if self.debug >= 3:
             print "Tree.FindGap goes left from parent..."
@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 
 import constants
+import ingest
+import simulation
 import sys, urllib, os.path
 
 def reporthook(*a): print a
@@ -10,3 +12,23 @@ for url in constants.defines._REGISTRY_DATA:
   print url, "->", file
   urllib.urlretrieve(url, file, reporthook)
 
+# Parses of the old files are no use to anyone now.
+print "Clearing parse cache", constants.defines._PARSE_CACHE_DIR
+ingest.ClearCache()
+
+# Bring the startup checkpoint up to date with what's new in the files,
+# rather than rebuilding the world from scratch.
+if os.path.exists(constants.defines._STARTUP_CHECKPOINT_FILE):
+  lir_behave = constants.defines._DEFAULT_LIR_BEHAVIOUR
+  rir_behave = constants.defines._DEFAULT_RIR_BEHAVIOUR
+  sim = simulation.timelined()
+  added = sim.RefreshStartupWorld(lir_behave, rir_behave)
+  if added != None:
+    print "Startup checkpoint refreshed with [%s] IANA and [%s] NRO lines" % \
+      added
+  else:
+    print "Rebuilding startup checkpoint", \
+      constants.defines._STARTUP_CHECKPOINT_FILE
+    os.remove(constants.defines._STARTUP_CHECKPOINT_FILE)
+    sim = simulation.timelined()
+    sim.LoadStartupWorld(lir_behave, rir_behave, checkpoint = True)